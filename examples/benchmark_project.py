@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+    Benchmark project save and load times for each compression codec
+    Created October 2026
+    Copyright (C) Damien Farrell
+
+    This program is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 2
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import os, time, pickle, gzip, tempfile
+from argparse import ArgumentParser
+from collections import OrderedDict
+import pandas as pd
+from tablexplore import dataset, fileio, project
+
+presets = ['iris', 'titanic', 'pima', 'co2-ppm-mauna-loa']
+
+def get_data(rows):
+    """Sample datasets, each repeated to the given number of rows"""
+
+    data = OrderedDict()
+    for name in presets:
+        df = dataset.getPresetData(name)
+        n = max(1, rows // len(df))
+        df = pd.concat([df] * n, ignore_index=True)
+        data[name] = {'table': df, 'meta': {}}
+    data['sample'] = {'table': dataset.getSampleData(rows, 8), 'meta': {}}
+    return data
+
+def save_legacy(filename, data):
+    """Version 1 project save for comparison"""
+
+    file = gzip.GzipFile(filename, 'w')
+    pickle.dump(data, file)
+    file.close()
+    return
+
+def timed(func, *args, **kwargs):
+    t = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - t
+
+def run(rows, levels):
+    data = get_data(rows)
+    total = sum(data[s]['table'].memory_usage(deep=True).sum() for s in data)
+    print ('%s sheets, %.1f MB in memory' %(len(data), total / 1e6))
+    print ('%-12s %10s %10s %10s' %('codec', 'save (s)', 'load (s)', 'size (MB)'))
+    path = tempfile.mkdtemp()
+    filename = os.path.join(path, 'bench.txpl')
+
+    ts = timed(save_legacy, filename, data)
+    tl = timed(project.load_legacy, filename)
+    print ('%-12s %10.3f %10.3f %10.2f' %('v1 gzip', ts, tl, os.path.getsize(filename) / 1e6))
+    os.remove(filename)
+
+    def load():
+        pf = project.open_project(filename)
+        for s in pf.sheets:
+            pf.read_sheet(s)
+
+    for codec in fileio.available_codecs():
+        for level in levels.get(codec, [None]):
+            ts = timed(project.save_project, filename, data, codec=codec, level=level)
+            tl = timed(load)
+            label = codec if level is None else '%s-%s' %(codec, level)
+            print ('%-12s %10.3f %10.3f %10.2f' %(label, ts, tl, os.path.getsize(filename) / 1e6))
+            os.remove(filename)
+    os.rmdir(path)
+    return
+
+def main():
+    parser = ArgumentParser(description='Benchmark project file codecs')
+    parser.add_argument("-r", "--rows", dest="rows", default=1000000, type=int,
+                        help="rows per sheet")
+    args = parser.parse_args()
+    levels = {'gzip': [1, 6], 'zstd': [None, 9]}
+    run(args.rows, levels)
+
+if __name__ == '__main__':
+    main()
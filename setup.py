@@ -27,7 +27,9 @@ setup(
                        # 'geopandas'
                        ],
     entry_points = { 'gui_scripts': [
-                     'tablexplore = tablexplore.app:main']},
+                     'tablexplore = tablexplore.app:main'],
+                     'console_scripts': [
+                     'tablexplore-pipeline = tablexplore.operations:main']},
     classifiers = ['Operating System :: OS Independent',
             'Programming Language :: Python :: 3',
             'Operating System :: MacOS :: MacOS X',
@@ -22,29 +22,34 @@
 """
 
 from __future__ import absolute_import, division, print_function
-import sys, os, platform, time, traceback
-import pickle, gzip
+import sys, os, platform, time, traceback, threading
+import copy
 from collections import OrderedDict
 from .qt import *
 import pandas as pd
 from .core import DataFrameModel, DataFrameTable, DataFrameWidget
 from .plotting import PlotViewer
-from . import util, dataset, core, dialogs
+from . import util, dataset, core, dialogs, fileio, project, plotting, search, operations
 
 homepath = os.path.expanduser("~")
 module_path = os.path.dirname(os.path.abspath(__file__))
 stylepath = os.path.join(module_path, 'styles')
 iconpath = os.path.join(module_path, 'icons')
 plugin_icon_path = os.path.join(module_path, 'plugins', 'icons')
+configpath = os.path.join(homepath, '.config', 'tablexplore')
+#seconds between autosaves to the recovery journal
+AUTOSAVE_INTERVAL = 60
+#without pandas copy on write, larger tables are not copied for autosave
+AUTOSAVE_MAXCOPY = 500e6
 
 
 class ProgressWidget(QDialog):
     """Progress widget class"""
 
-    def __init__(self, parent=None, label=''):
+    def __init__(self, parent=None, label='', title='Saving..'):
         super(ProgressWidget, self).__init__(parent)
         layout = QVBoxLayout(self)
-        self.setWindowTitle('Saving..')
+        self.setWindowTitle(title)
         self.setMinimumSize(400, 100)
         self.setGeometry(
             QStyle.alignedRect(
@@ -60,9 +65,66 @@ class ProgressWidget(QDialog):
         self.progressbar = QProgressBar(self)
         layout.addWidget(self.progressbar)
         self.progressbar.setGeometry(30, 40, 400, 200)
+        # sheets, bytes, throughput and time left
+        self.info = QLabel('')
+        layout.addWidget(self.info)
+        return
+
+    def setProgress(self, p):
+        """Show a progress dict from project.Progress"""
+
+        mb = 1048576
+        text = 'sheet %s of %s, %.1f of %.1f MB' %(p['sheets'], p['total_sheets'],
+                                                  p['bytes'] / mb, p['total_bytes'] / mb)
+        if p['rate'] > 0:
+            text += ', %.1f MB/s' %(p['rate'] / mb)
+        if p['eta'] is not None:
+            text += ', %ds left' %round(p['eta'])
+        self.info.setText(text)
+        self.progressbar.setValue(p['percent'])
+        return
+
+
+class SheetStub(object):
+    """Placeholder for a sheet whose table and plot widgets have not been
+    built yet. Holds the dataframe and meta data, or a reference to the
+    sheet in a project file they are read from."""
 
+    def __init__(self, splitter, df=None, meta=None, source=None):
+        self.splitter = splitter
+        self.df = df
+        self.meta = meta
+        #(ProjectFile, stored sheet name)
+        self.source = source
+        #table is being read in the background
+        self.loading = False
         return
 
+    @property
+    def dataframe(self):
+        """The sheet table, read from the project file if needed"""
+
+        if self.df is None and self.source is not None:
+            pf, key = self.source
+            self.df = pf.read_sheet(key)
+        return self.df
+
+    def get_meta(self):
+        """Get the sheet meta data"""
+
+        if self.source is not None:
+            pf, key = self.source
+            return pf.read_meta(key)
+        return self.meta
+
+    def save_data(self):
+        """Data for saving the sheet in a project"""
+
+        if self.source is not None:
+            pf, key = self.source
+            return {'stored': pf.stored(key)}
+        return {'table': self.df, 'meta': self.meta}
+
 
 class Application(QMainWindow):
     def __init__(self, project_file=None, csv_file=None):
@@ -71,6 +133,8 @@ class Application(QMainWindow):
         self.setAttribute(QtCore.Qt.WA_DeleteOnClose)
         self.setWindowTitle("Tablexplore")
         self.setWindowIcon(QIcon(os.path.join(module_path, 'logo.png')))
+        # lets tables be snapshot cheaply for background saves
+        util.enable_copy_on_write()
         # Initialize menu bar
         self.file_menu = QMenu(title='File', parent=self)
         self.recent_files_menu = QMenu(title="Recent Projects", parent=self.file_menu)
@@ -90,6 +154,7 @@ class Application(QMainWindow):
         self.main = QTabWidget(self)
         self.main.setTabsClosable(True)
         self.main.tabCloseRequested.connect(lambda index: self.remove_sheet(index))
+        self.main.currentChanged.connect(self.sheet_changed)
         screen_resolution = QGuiApplication.primaryScreen().availableGeometry()
         width, height = screen_resolution.width() * 0.75, screen_resolution.height() * 0.7
         self.setGeometry(QtCore.QRect(200, 200, width, height))
@@ -110,7 +175,15 @@ class Application(QMainWindow):
         self.recent_files = ['']
         self.recent_urls = []
         self.plots = {}
+        self.project = None
+        self.saved = {}
+        self.saved_plots = {}
         self.filename = None
+        self.reset_journal()
+        self.deferred = False
+        self.threadpool = QtCore.QThreadPool()
+        # operations run on several sheets at once
+        self.sheetpool = QtCore.QThreadPool()
 
         self.load_settings()
         self.show_recent_files()
@@ -121,7 +194,15 @@ class Application(QMainWindow):
             self.import_csv_txt(csv_file)
         else:
             self.new_project()
-        self.threadpool = QtCore.QThreadPool()
+            self.recover_journal()
+        # autosaves run one at a time in their own pool
+        self.autosave_pool = QtCore.QThreadPool()
+        self.autosave_pool.setMaxThreadCount(1)
+        self.autosaving = False
+        self.autosave_cancel = threading.Event()
+        self.autosave_timer = QtCore.QTimer(self)
+        self.autosave_timer.timeout.connect(self.autosave)
+        self.autosave_timer.start(AUTOSAVE_INTERVAL * 1000)
         self.running = False
         self.discover_plugins()
         return
@@ -130,19 +211,23 @@ class Application(QMainWindow):
         """Load GUI settings"""
 
         try:
-            self.resize(self.s.value('window_size'))
-            self.move(self.s.value('window_position'))
-            self.set_style(self.s.value('style'))
-            core.FONT = self.s.value("font")
-            core.FONTSIZE = int(self.s.value("fontsize"))
-            core.COLUMNWIDTH = int(self.s.value("columnwidth"))
-            core.TIMEFORMAT = self.s.value("timeformat")
-            r = self.s.value("recent_files")
+            self.resize(self.settings.value('window_size'))
+            self.move(self.settings.value('window_position'))
+            self.set_style(self.settings.value('style'))
+            core.FONT = self.settings.value("font")
+            core.FONTSIZE = int(self.settings.value("fontsize"))
+            core.COLUMNWIDTH = int(self.settings.value("columnwidth"))
+            core.TIMEFORMAT = self.settings.value("timeformat")
+            r = self.settings.value("recent_files")
             if r != '':
                 self.recent_files = r.split(',')
-            r = self.s.value("recent_urls")
+            r = self.settings.value("recent_urls")
             if r != '':
                 self.recent_urls = r.split('^^')
+            if self.settings.value("codec") in fileio.codecs:
+                project.CODEC = self.settings.value("codec")
+                project.LEVEL = fileio.compression_level(project.CODEC,
+                                    int(self.settings.value("level")) or None, clamp=True)
         except:
             pass
         return
@@ -157,6 +242,8 @@ class Application(QMainWindow):
         self.settings.setValue('font', core.FONT)
         self.settings.setValue('fontsize', core.FONTSIZE)
         self.settings.setValue('timeformat', core.TIMEFORMAT)
+        self.settings.setValue('codec', project.CODEC)
+        self.settings.setValue('level', project.LEVEL or 0)
         self.settings.setValue('recent_files', ','.join(self.recent_files))
         self.settings.setValue('recent_urls', '^^'.join(self.recent_urls))
         if hasattr(self, 'plotgallery'):
@@ -286,6 +373,11 @@ class Application(QMainWindow):
         self.tools_menu.addAction('Convert Numeric', lambda: self._call('convertNumeric'))
         self.tools_menu.addAction('Convert Column Names', lambda: self._call('convertColumnNames'))
         self.tools_menu.addAction('Time Series Resample', lambda: self._call('resample'))
+        self.tools_menu.addAction('Export Pipeline', lambda: self._call('exportPipeline'))
+        self.tools_menu.addAction('Run Pipeline', lambda: self._call('importPipeline'))
+        self.tools_menu.addAction('Run Pipeline From Sheet', self.run_sheet_pipeline)
+        self.tools_menu.addAction('Run On Sheets', self.run_on_sheets)
+        self.tools_menu.addAction('Compare Sheets', self.compare_sheets)
         icon = QIcon(os.path.join(iconpath, 'tabletotext.png'))
         self.tools_menu.addAction(icon, 'Table to Text', lambda: self._call('showAsText'),
                                   QtCore.Qt.CTRL + QtCore.Qt.Key_T)
@@ -327,6 +419,174 @@ class Application(QMainWindow):
         getattr(table, func)(**args)
         return
 
+    def run_sheet_pipeline(self):
+        """Replay the operations recorded on another sheet on the current one"""
+
+        table = self.get_current_table()
+        names = [n for n in self.sheets if self.sheets[n] is not table]
+        if table is None or len(names) == 0:
+            return
+        name, ok = QInputDialog.getItem(self, 'Run Pipeline', 'Replay operations of sheet:',
+                                        names, 0, False)
+        if not ok:
+            return
+        source = self.build_sheet(name)
+        table.runPipeline(source.pipeline.copy())
+        return
+
+    def run_on_sheets(self):
+        """Run one operation on several sheets. The options are chosen once
+        and the sheets are done in parallel in the background."""
+
+        table = self.get_current_table()
+        if table is None:
+            return
+        ops = OrderedDict([('Clean Data', 'cleanData'), ('Convert Numeric', 'convertNumeric'),
+                           ('Drop Duplicates', 'findDuplicates'), ('Last Operation', None)])
+        names = list(self.sheets.keys())
+        opts = {'operation': {'type': 'combobox', 'default': 'Clean Data', 'items': list(ops),
+                              'label': 'Operation'},
+                'sheets': {'type': 'list', 'default': '', 'items': names,
+                           'label': 'Sheets (none selected is all)'},
+                'workers': {'type': 'spinbox', 'default': os.cpu_count(), 'range': (1, 64),
+                            'label': 'Parallel workers'},
+                }
+        dlg = dialogs.MultipleInputDialog(self, opts, title='Run On Sheets', width=300)
+        dlg.exec_()
+        if not dlg.accepted:
+            return
+        kwds = dlg.values
+        funcname = ops[kwds['operation']]
+        if funcname is None:
+            if len(table.pipeline) == 0:
+                QMessageBox.information(self, 'Run On Sheets', 'No operation recorded for this sheet.')
+                return
+            step = table.pipeline.steps[-1]
+        else:
+            step = table.askStep(funcname)
+        if step is None:
+            return
+        sheets = kwds['sheets']
+        if len(sheets) == 0:
+            sheets = names
+        self.run_step_on_sheets(step, sheets, kwds['workers'])
+        return
+
+    def run_step_on_sheets(self, step, names, workers=None):
+        """Run a pipeline step on sheets in a pool of worker threads. Each
+        result replaces its table on the GUI thread when ready, unless the
+        table was changed in the meantime.
+        Args:
+            step: step from operations.make_step
+            names: sheet names
+            workers: maximum number of sheets run at once
+        """
+
+        pool = self.sheetpool
+        pool.setMaxThreadCount(workers or os.cpu_count())
+        self.progressdlg = dlg = ProgressWidget(label='Running %s on %s sheets'
+                                                %(step['name'], len(names)), title='Running..')
+        dlg.progressbar.setRange(0, len(names))
+        dlg.show()
+        done = []
+        failed = []
+
+        def finished(name, error=None):
+            done.append(name)
+            if error is not None:
+                failed.append('%s: %s' %(name, error))
+            dlg.progressbar.setValue(len(done))
+            dlg.info.setText('%s done' %name)
+            if len(done) < len(names):
+                return
+            dlg.close()
+            if len(failed) > 0:
+                QMessageBox.warning(self, 'Run On Sheets', 'Not changed:\n' + '\n'.join(failed))
+
+        def commit(name, version, df):
+            w = self.sheets.get(name)
+            if w is None or w.table.model.version != version:
+                finished(name, 'changed while running')
+                return
+            w.setResult(step, df)
+            finished(name)
+
+        def commit_stub(name, stub, token, result):
+            df, meta = result
+            if self.sheets.get(name) is not stub or stub.source != token[1] \
+                or (token[0] is not None and stub.df is not token[0]):
+                finished(name, 'changed while running')
+                return
+            # the step is replayed into the pipeline when the tab is built
+            meta = dict(meta or {})
+            meta['pipeline'] = list(meta.get('pipeline', [])) + [step]
+            stub.df = df
+            stub.meta = meta
+            stub.source = None
+            stub.loading = False
+            if self.main.tabText(self.main.currentIndex()) == name:
+                self.build_sheet(name)
+            finished(name)
+
+        for name in names:
+            w = self.sheets[name]
+            if isinstance(w, SheetStub):
+                # tabs not shown yet are run on their table, read here if
+                # needed, and their widgets are only built when shown
+                def func(progress_callback, df=w.df, meta=w.meta, source=w.source):
+                    if source is not None:
+                        pf, key = source
+                        if df is None:
+                            df = pf.read_sheet(key)
+                        meta = pf.read_meta(key)
+                    return operations.run_step(df, step), meta
+
+                worker = Worker(fn=func)
+                worker.signals.result.connect(lambda r, n=name, s=w, t=(w.df, w.source):
+                                              commit_stub(n, s, t, r))
+            else:
+                model = w.table.model
+
+                def func(progress_callback, df=model.df):
+                    return operations.run_step(df, step)
+
+                worker = Worker(fn=func)
+                worker.signals.result.connect(lambda df, n=name, v=model.version: commit(n, v, df))
+            worker.signals.error.connect(lambda err, n=name: finished(n, err[1]))
+            pool.start(worker)
+        return
+
+    def compare_sheets(self):
+        """Show the rows of the current sheet that are not in another sheet
+        and the reverse, matching rows on the columns both have. Numbers
+        match whatever their type, e.g. 1 and 1.0"""
+
+        table = self.get_current_table()
+        names = [n for n in self.sheets if self.sheets[n] is not table]
+        if table is None or len(names) == 0:
+            return
+        name, ok = QInputDialog.getItem(self, 'Compare Sheets', 'Compare with sheet:',
+                                        names, 0, False)
+        if not ok:
+            return
+        other = self.build_sheet(name)
+        m1 = table.table.model
+        m2 = other.table.model
+        cols = [c for c in m1.df.columns if c in m2.df.columns]
+        if len(cols) == 0:
+            QMessageBox.information(self, 'Compare Sheets', 'The sheets have no columns in common.')
+            return
+        v1 = m1.columnVersions(cols)
+        v2 = m2.columnVersions(cols)
+        h1 = m1.rowhashes.get(m1.df, cols, v1)
+        h2 = m2.rowhashes.get(m2.df, cols, v2)
+        current = self.main.tabText(self.main.currentIndex())
+        only1 = m1.df[cols][~m1.rowhashes.isin(m1.df, cols, v1, h2)]
+        only2 = m2.df[cols][~m2.rowhashes.isin(m2.df, cols, v2, h1)]
+        result = pd.concat([only1.assign(only_in=current), only2.assign(only_in=name)])
+        table.showSubTable(result)
+        return
+
     def _check_snap(self):
 
         if os.environ.has_key('SNAP_USER_COMMON'):
@@ -340,6 +600,8 @@ class Application(QMainWindow):
 
         for s in self.sheets:
             t = self.sheets[s]
+            if isinstance(t, SheetStub):
+                continue
             if t.filtered:
                 t.showAll()
         return
@@ -371,7 +633,10 @@ class Application(QMainWindow):
         return
 
     def new_project(self, data=None, ask=False):
-        """New project"""
+        """New project
+          Args:
+            data: dict of sheets or a project.ProjectFile
+        """
 
         if ask:
             reply = QMessageBox.question(self, 'Are you sure?',
@@ -379,10 +644,33 @@ class Application(QMainWindow):
                                          QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel)
             if reply == QMessageBox.Yes:
                 self.save_project()
+            elif reply == QMessageBox.No:
+                self.remove_journal()
+        self.reset_journal()
+        if isinstance(data, project.ProjectFile):
+            self.sheets = OrderedDict()
+            self.main.clear()
+            self.filename = None
+            self.projopen = True
+            plots = data.read_plots()
+            self.project = data
+            self.saved = {}
+            # figures from older files are converted and saved again
+            self.saved_plots = {k: v for k, v in plots.items()
+                                if isinstance(v, plotting.StoredPlot)}
+            self.plots = plotting.toStoredPlots(OrderedDict(plots))
+            # tables are read from the file when their tab is first shown
+            for s in data.sheets:
+                self.add_sheet(s, source=(data, s), lazy=True)
+            self.main.setCurrentIndex(0)
+            return
         if not type(data) is dict:
             data = None
-        self.main.clear()
         self.sheets = OrderedDict()
+        self.main.clear()
+        self.project = None
+        self.saved = {}
+        self.saved_plots = {}
         self.filename = None
         self.projopen = True
         self.plots = {}
@@ -395,9 +683,10 @@ class Application(QMainWindow):
                     meta = data[s]['meta']
                 else:
                     meta = None
-                self.add_sheet(s, df, meta)
+                self.add_sheet(s, df, meta, lazy=True)
+            self.main.setCurrentIndex(0)
             if 'plots' in data:
-                self.plots = data['plots']
+                self.plots = plotting.toStoredPlots(data['plots'])
         else:
             self.add_sheet('dataset1')
         return
@@ -433,14 +722,43 @@ class Application(QMainWindow):
         if ext != '.txpl':
             print('does not appear to be a project file')
             return
-        if os.path.isfile(filename):
-            data = pickle.load(gzip.GzipFile(filename, 'r'))
-        else:
+        if not os.path.isfile(filename):
             print('no such file')
             self.quit()
             return
+        if project.is_legacy(filename):
+            # old files are read whole in the background
+            self.progressdlg = ProgressWidget(label='Loading %s' % filename, title='Loading..')
+            self.progressdlg.show()
+
+            def func(progress_callback):
+                return project.load_legacy(filename)
+
+            self.run_threaded_process(func, self.processing_completed,
+                                      on_result=lambda data: self.project_opened(filename, data))
+            return
+        try:
+            if project.needs_recovery(filename):
+                project.recover(filename)
+            data = project.open_project(filename)
+        except Exception as e:
+            QMessageBox.warning(self, 'Error', 'Could not open %s: %s' %(filename, e))
+            return
+        # tabs are not built until load_sheets has started reading tables
+        self.deferred = True
+        try:
+            self.project_opened(filename, data)
+        finally:
+            self.deferred = False
+        self.load_sheets(data)
+        return
+
+    def project_opened(self, filename, data):
+        """Show an opened project"""
+
         self.new_project(data)
         self.filename = filename
+        self.recover_journal(filename)
 
         self.proj_label.setText(self.filename)
         self.projopen = True
@@ -448,6 +766,55 @@ class Application(QMainWindow):
         self.add_recent_file(filename)
         return
 
+    def load_sheets(self, pf):
+        """Read the sheet tables of a project file in the background. Each
+        sheet is attached to its tab as it is read, tabs are built when
+        shown once their table has arrived."""
+
+        names = []
+        for name in self.sheets:
+            w = self.sheets[name]
+            if isinstance(w, SheetStub) and w.source is not None \
+                and w.source[0] is pf and w.df is None:
+                w.loading = True
+                names.append(w.source[1])
+        if len(names) == 0:
+            self.sheet_changed(self.main.currentIndex())
+            return
+        self.progressdlg = ProgressWidget(label='Loading %s' % pf.filename, title='Loading..')
+        self.progressdlg.show()
+
+        def func(progress_callback):
+            def callback(p):
+                p['pf'] = pf
+                progress_callback.emit(p)
+            pf.load(callback, names)
+
+        def completed():
+            # anything not read is read when shown
+            for name in self.sheets:
+                w = self.sheets[name]
+                if isinstance(w, SheetStub):
+                    w.loading = False
+            self.processing_completed()
+            self.sheet_changed(self.main.currentIndex())
+
+        self.run_threaded_process(func, completed, progress=True)
+        self.sheet_changed(self.main.currentIndex())
+        return
+
+    def sheet_loaded(self, pf, key, df):
+        """Attach a table read in the background to its sheet"""
+
+        for name in self.sheets:
+            w = self.sheets[name]
+            if isinstance(w, SheetStub) and w.source == (pf, key):
+                w.df = df
+                w.loading = False
+                if self.main.tabText(self.main.currentIndex()) == name:
+                    self.build_sheet(name)
+        return
+
     def save_as_project(self):
         """Save as a new project filename"""
 
@@ -461,8 +828,8 @@ class Application(QMainWindow):
         self.filename = filename
         if not os.path.splitext(filename)[1] == '.txpl':
             self.filename += '.txpl'
-        self.do_save_project(filename)
-        self.add_recent_file(filename)
+        self.do_save_project(self.filename)
+        self.add_recent_file(self.filename)
         self.proj_label.setText(self.filename)
         return
 
@@ -487,60 +854,381 @@ class Application(QMainWindow):
     def save_with_progress(self, filename):
         """Save with progress bar"""
 
-        self.savedlg = dlg = ProgressWidget(label='Saving to %s' % filename)
+        snap = self.snapshot_project()
+        self.progressdlg = dlg = ProgressWidget(label='Saving to %s' % filename)
         dlg.show()
 
         def func(progress_callback):
-            self.do_save_project(self.filename)
+            return self.write_project(filename, snap, progress_callback)
 
-        self.run_threaded_process(func, self.processing_completed)
+        self.run_threaded_process(func, self.processing_completed, progress=True,
+                                  on_result=lambda pf: self.project_saved(pf, snap))
         return
 
-    def run_threaded_process(self, process, on_complete):
-        """Execute a function in the background with a worker"""
+    def run_threaded_process(self, process, on_complete, progress=False, on_result=None):
+        """Execute a function in the background with a worker.
+        Args:
+            process: function taking a progress_callback argument
+            on_complete: called when the worker is finished
+            progress: True if the process emits progress, a percentage
+                      or a dict from project.Progress
+            on_result: called with the value returned by process
+        """
 
         # if self.running == True:
         #    return
         worker = Worker(fn=process)
-        self.threadpool.start(worker)
+        if on_result is not None:
+            worker.signals.result.connect(on_result)
         worker.signals.finished.connect(on_complete)
-        # worker.signals.progress.connect(self.progress_fn)
-        self.savedlg.progressbar.setRange(0, 0)
+        worker.signals.error.connect(self.processing_error)
+        if progress == True:
+            worker.signals.progress.connect(self.progress_fn)
+            self.progressdlg.progressbar.setRange(0, 100)
+        else:
+            self.progressdlg.progressbar.setRange(0, 0)
+        self.threadpool.start(worker)
         # self.worker = worker
         return
 
-    def progress_fn(self, msg):
+    def progress_fn(self, value):
+        """Update progress bar from worker"""
+
+        if isinstance(value, dict):
+            self.progressdlg.setProgress(value)
+            if 'table' in value:
+                self.sheet_loaded(value['pf'], value['sheet'], value['table'])
+            return
+        self.progressdlg.progressbar.setValue(value)
         return
 
     def processing_completed(self):
         """Generic process completed"""
 
-        self.savedlg.progressbar.setRange(0, 1)
-        self.savedlg.close()
+        self.progressdlg.progressbar.setRange(0, 1)
+        self.progressdlg.close()
         self.running = False
         return
 
+    def processing_error(self, err):
+        """Show errors raised in a worker"""
+
+        exctype, value, tb = err
+        QMessageBox.warning(self, 'Error', str(value))
+        return
+
     def do_save_project(self, filename, progress_callback=None):
         """Does the actual saving. Save sheets inculding table dataframes
-           and meta data as dict to compressed pickle.
+           and meta data to the project container. Sheets and plots not
+           changed since the project file was opened or saved are not
+           written again.
         """
 
-        data = {}
+        snap = self.snapshot_project()
+        pf = self.write_project(filename, snap, progress_callback)
+        self.project_saved(pf, snap)
+        return
+
+    def snapshot_project(self):
+        """Capture everything to be saved on the GUI thread. Tables are
+        copy on write references, meta data such as column order, widths
+        and plot options is copied and figures are pickled, so the project
+        can be written in a worker while editing goes on."""
+
+        # a running autosave is stopped, write_project waits for it to end
+        self.autosave_cancel.set()
+        data = OrderedDict()
+        states = {}
         for i in self.sheets:
             tablewidget = self.sheets[i]
-            table = tablewidget.table
-            data[i] = {}
-            # save dataframe with current column order
-            if table.filtered:
-                df = table.dataframe
+            if isinstance(tablewidget, SheetStub):
+                # sheet not shown yet so save it as it was loaded
+                data[i] = tablewidget.save_data()
+                continue
+            states[i] = state = self.sheet_state(i)
+            if self.project is not None and i in self.saved and self.saved[i][1] == state:
+                data[i] = {'stored': self.project.stored(self.saved[i][0]),
+                           'meta': self.snapshot_meta(tablewidget, figure=False)}
+                continue
+            data[i] = self.snapshot_sheet(tablewidget)
+        plots = OrderedDict()
+        for label in self.plots:
+            fig = self.plots[label]
+            if self.project is not None and self.saved_plots.get(label) is fig:
+                plots[label] = self.project.stored_plot(label)
+            else:
+                plots[label] = fig
+        data['plots'] = plots
+        return {'data': data, 'states': states, 'plots': dict(self.plots)}
+
+    def write_project(self, filename, snap, progress_callback=None):
+        """Write a project snapshot to file, can be run in a worker"""
+
+        # the journal must not be written while sheets are copied from it,
+        # a cancelled autosave leaves it as it was
+        self.autosave_pool.waitForDone()
+        callback = None
+        if progress_callback is not None:
+            callback = progress_callback.emit
+        return project.save_project(filename, snap['data'], callback=callback)
+
+    def project_saved(self, pf, snap):
+        """Update the saved state after a project snapshot was written"""
+
+        # sheets are now stored under their current names in the new file
+        self.project = pf
+        states = snap['states']
+        self.saved = {name: (name, states[name]) for name in states if name in self.sheets}
+        self.saved_plots = snap['plots']
+        for name in self.sheets:
+            w = self.sheets[name]
+            if isinstance(w, SheetStub) and name in pf.sheets:
+                w.source = (pf, name)
+                w.meta = None
+        self.remove_journal()
+        return
+
+    def sheet_state(self, name):
+        """Versions of the table, sub table and plot of a sheet, used to
+        tell if it has changed since it was saved"""
+
+        w = self.sheets[name]
+        sub = None
+        if w.subtable is not None:
+            sub = (id(w.subtable), w.subtable.table.model.version)
+        return (w.table.model.version, sub, w.pf.version)
+
+    def journal_name(self, filename=None):
+        """Autosave journal for a project file, unsaved projects use one
+        in the config folder"""
+
+        if filename is not None:
+            return filename + '.autosave'
+        return os.path.join(configpath, 'autosave.txpl')
+
+    def reset_journal(self):
+        """Forget the autosave journal state"""
+
+        self.journal = None
+        self.journaled = {}
+        self.journaled_plots = {}
+        self.journal_sig = None
+        return
+
+    def remove_journal(self):
+        """Delete the autosave journal, done when the project is saved or
+        changes are discarded"""
+
+        if self.journal is not None:
+            filename = self.journal.filename
+        else:
+            filename = self.journal_name(self.filename)
+        for f in [filename, filename + '.undo']:
+            if os.path.exists(f):
+                os.remove(f)
+        self.reset_journal()
+        return
+
+    def snapshot_sheet(self, tablewidget, maxsize=None, figure=True):
+        """Copy a sheet's table and meta data so they can be written in a
+        worker while editing goes on. Returns None if the table is larger
+        than maxsize and cannot be copied on write."""
+
+        table = tablewidget.table
+        if table.filtered:
+            df = table.dataframe
+        else:
+            df = table.model.df
+        df = util.snapshot(df, maxsize)
+        if df is None:
+            return None
+        meta = self.snapshot_meta(tablewidget, figure)
+        if tablewidget.subtable is not None:
+            meta['subtable'] = util.snapshot(tablewidget.subtable.table.model.df)
+        return {'table': df, 'meta': meta}
+
+    def snapshot_meta(self, tablewidget, figure=True):
+        """Copy of the sheet meta data without the sub table. The figure is
+        pickled here so later plotting does not change it, or left out if
+        figure is False."""
+
+        meta = self.save_meta(tablewidget)
+        meta.pop('subtable', None)
+        fig = meta['plotviewer'].pop('fig', None)
+        meta = copy.deepcopy(meta)
+        if figure == True and fig is not None:
+            meta['plotviewer']['fig'] = project.Pickled(fig)
+        return meta
+
+    def journal_snapshot(self):
+        """Get the sheets and plots changed since the project was saved for
+        writing to the journal. Sheets unchanged since the last autosave
+        are referenced in the journal rather than written again. Returns
+        None if nothing changed since the last autosave."""
+
+        data = OrderedDict()
+        sheets = []
+        states = {}
+        for name in self.sheets:
+            w = self.sheets[name]
+            if isinstance(w, SheetStub):
+                if w.source is not None and w.source[0] is self.project:
+                    sheets.append([name, w.source[1]])
+                else:
+                    sheets.append([name, None])
+                    data[name] = w.save_data()
+                continue
+            state = self.sheet_state(name)
+            if self.project is not None and name in self.saved and self.saved[name][1] == state:
+                sheets.append([name, self.saved[name][0]])
+                continue
+            sheets.append([name, None])
+            if self.journal is not None and name in self.journaled \
+                and self.journaled[name][1] == state:
+                data[name] = {'stored': self.journal.stored(self.journaled[name][0]),
+                              'meta': self.snapshot_meta(w, figure=False)}
+            else:
+                # figures are not journaled, plots can be redrawn from the options
+                snap = self.snapshot_sheet(w, AUTOSAVE_MAXCOPY, figure=False)
+                if snap is None:
+                    print ('%s is too large to copy for autosave' %name)
+                    continue
+                data[name] = snap
+            states[name] = state
+
+        plots = OrderedDict()
+        for label in self.plots:
+            fig = self.plots[label]
+            if self.saved_plots.get(label) is fig:
+                continue
+            if self.journal is not None and self.journaled_plots.get(label) is fig:
+                plots[label] = self.journal.stored_plot(label)
+            else:
+                plots[label] = fig
+        data['plots'] = plots
+
+        sig = (sheets, states, list(self.plots.keys()))
+        if sig == self.journal_sig:
+            return None
+        if self.project is not None and len(data) == 1 and len(plots) == 0 \
+            and sheets == [[n, n] for n in self.project.sheets] \
+            and list(self.plots.keys()) == list(self.project.plots.keys()):
+            # nothing changed since saving
+            return None
+        info = {'project': self.filename, 'sheets': sheets,
+                'plots': list(self.plots.keys())}
+        return data, info, states, sig
+
+    def autosave(self):
+        """Write the changes to the recovery journal in the background.
+        Called on a timer, it is skipped while saving or if the previous
+        autosave has not finished."""
+
+        if self.running or self.autosaving or not hasattr(self, 'sheets'):
+            return
+        snap = self.journal_snapshot()
+        if snap is None:
+            return
+        data, info, states, sig = snap
+        filename = self.journal_name(self.filename)
+        codecs = fileio.available_codecs()
+        # fastest codec available, the journal is rewritten often
+        if 'lz4' in codecs:
+            codec, level = 'lz4', None
+        elif 'zstd' in codecs:
+            codec, level = 'zstd', 1
+        else:
+            codec, level = 'gzip', 1
+        plots = dict(self.plots)
+        self.autosaving = True
+        cancel = self.autosave_cancel = threading.Event()
+
+        def func(progress_callback):
+            path = os.path.dirname(os.path.abspath(filename))
+            if not os.path.exists(path):
+                os.makedirs(path)
+            try:
+                return project.save_project(filename, data, codec, level, info, cancel=cancel)
+            except project.Cancelled:
+                # the project is being saved, the journal is unchanged
+                return None
+
+        def done(jf):
+            if jf is None:
+                return
+            if not os.path.exists(jf.filename) or jf.filename != self.journal_name(self.filename):
+                # the project was saved or closed meanwhile
+                return
+            old = self.journal
+            self.journal = jf
+            self.journaled = {name: (name, states[name]) for name in states}
+            self.journaled_plots = {label: plots[label] for label in jf.plots}
+            self.journal_sig = sig
+            for name in self.sheets:
+                w = self.sheets[name]
+                if isinstance(w, SheetStub) and name in jf.sheets:
+                    if w.source is None or w.source[0] is old:
+                        w.source = (jf, name)
+                        w.meta = None
+
+        def finished():
+            self.autosaving = False
+
+        worker = Worker(fn=func)
+        worker.signals.result.connect(done)
+        worker.signals.error.connect(lambda err: print('autosave failed: %s' %err[1]))
+        worker.signals.finished.connect(finished)
+        self.autosave_pool.start(worker)
+        return
+
+    def recover_journal(self, filename=None):
+        """Offer to restore changes from an autosave journal left by a
+        session that did not close normally"""
+
+        journal = self.journal_name(filename)
+        if not os.path.exists(journal):
+            return
+        try:
+            if project.needs_recovery(journal):
+                project.recover(journal)
+            jf = project.ProjectFile(journal)
+        except Exception as e:
+            print ('could not read autosave journal %s: %s' %(journal, e))
+            return
+        t = time.ctime(os.path.getmtime(journal))
+        reply = QMessageBox.question(self, 'Recover changes?',
+                                     'Unsaved changes from %s were found.\nRecover them?' %t,
+                                     QMessageBox.Yes | QMessageBox.No)
+        if reply == QMessageBox.No:
+            for f in [journal, journal + '.undo']:
+                if os.path.exists(f):
+                    os.remove(f)
+            return
+        info = jf.info or {}
+        self.sheets = OrderedDict()
+        self.main.clear()
+        self.reset_journal()
+        self.journal = jf
+        for name, key in info.get('sheets', []):
+            if name in jf.sheets:
+                source = (jf, name)
+            elif self.project is not None and key in self.project.sheets:
+                source = (self.project, key)
             else:
-                df = table.model.df
-            cols = table.getColumnOrder()
-            data[i]['table'] = df[cols]
-            data[i]['meta'] = self.save_meta(tablewidget)
-        data['plots'] = self.plots
-        file = gzip.GzipFile(filename, 'w')
-        pickle.dump(data, file)
+                continue
+            self.add_sheet(name, source=source, lazy=True)
+        if len(self.sheets) == 0:
+            self.add_sheet('dataset1')
+        journal_plots = plotting.toStoredPlots(jf.read_plots())
+        plots = OrderedDict()
+        for label in info.get('plots', []):
+            if label in journal_plots:
+                plots[label] = journal_plots[label]
+            elif label in self.plots:
+                plots[label] = self.plots[label]
+        self.plots = plots
+        self.journaled_plots = journal_plots
+        self.main.setCurrentIndex(0)
         return
 
     def save_meta(self, tablewidget):
@@ -560,12 +1248,14 @@ class Application(QMainWindow):
         # save table selections
         meta['table'] = util.getAttributes(table)
         meta['table']['column_widths'] = table.getColumnWidths()
+        meta['column_order'] = table.getColumnOrder()
         meta['plotviewer'] = util.getAttributes(pf)
         # print (meta['plotviewer'])
         # save child table if present
         if tablewidget.subtable is not None:
             meta['subtable'] = tablewidget.subtable.table.model.df
         #    meta['childselected'] = util.getAttributes(table.child)
+        meta['pipeline'] = list(tablewidget.pipeline.steps)
 
         return meta
 
@@ -602,8 +1292,10 @@ class Application(QMainWindow):
         if 'column_widths' in tablesettings:
             table.table.setColumnWidths(tablesettings['column_widths'])
         table.refresh()
+        if 'column_order' in meta:
+            table.table.setColumnOrder(meta['column_order'])
         # load plotviewer
-        if 'plotviewer' in meta:
+        if 'plotviewer' in meta and 'fig' in meta['plotviewer']:
             # print (meta['plotviewer'])
             fig = meta['plotviewer']['fig']
             table.pf.setFigure(fig)
@@ -611,6 +1303,8 @@ class Application(QMainWindow):
             # util.setAttributes(table.pf, meta['plotviewer'])
             # table.pf.updateWidgets()
 
+        if 'pipeline' in meta:
+            table.pipeline = operations.Pipeline(meta['pipeline'])
         if subtable is not None:
             table.showSubTable(df=subtable)
             # util.setAttributes(table.child, childsettings)
@@ -712,21 +1406,42 @@ class Application(QMainWindow):
         filename, _ = QFileDialog.getSaveFileName(
             self, "Export",
             "",
-            "csv files (*.csv);;xlsx files (*.xlsx);;xls Files (*.xls);;hdf files (*.hdf5);;All Files (*)",
+            "csv files (*.csv);;compressed csv (*.csv.gz *.csv.zst *.csv.lz4);;xlsx files (*.xlsx);;"
+            "xls Files (*.xls);;hdf files (*.hdf5);;All Files (*)",
             options=options
         )
-        df = w.table.model.df
-        ext = os.path.splitext(filename)[1]
-        if ext == '.csv':
-            df.to_csv(filename)
-        elif ext == '.hdf5':
-            df.to_hdf(filename)
-        elif ext == '.xls':
-            df.to_excel(filename)
+        if not filename:
+            return
+        self.export_dataframe(w.table.model.df, filename)
+        return
+
+    def export_dataframe(self, df, filename):
+        """Export a dataframe in the background, rows are written in chunks.
+        Format and compression are taken from the file extension."""
+
+        self.progressdlg = dlg = ProgressWidget(label='Exporting to %s' % filename,
+                                                title='Exporting..')
+        dlg.show()
+
+        def func(progress_callback):
+            def callback(done, total):
+                if total > 0:
+                    progress_callback.emit(int(done * 100 / total))
+            fileio.export_dataframe(df, filename, callback=callback)
+
+        self.run_threaded_process(func, self.processing_completed, progress=True)
         return
 
-    def add_sheet(self, name=None, df=None, meta=None):
-        """Add a new sheet"""
+    def add_sheet(self, name=None, df=None, meta=None, source=None, lazy=False):
+        """Add a new sheet
+          Args:
+            name: sheet name
+            df: dataframe for the table
+            meta: sheet meta data, see load_meta
+            source: (ProjectFile, name) to read the table and meta from
+            lazy: only add a placeholder tab, the widgets are built when
+                  the tab is first shown
+        """
 
         names = list(self.sheets.keys())
         i = len(self.sheets) + 1
@@ -737,7 +1452,22 @@ class Application(QMainWindow):
             name = 'dataset' + str(random.randint(i, 100))
 
         sheet = QSplitter(self.main)
+        self.sheets[name] = SheetStub(sheet, df, meta, source)
         idx = self.main.addTab(sheet, name)
+        if lazy == False:
+            self.build_sheet(name)
+            self.main.setCurrentIndex(idx)
+        return name
+
+    def build_sheet(self, name):
+        """Create the table and plot widgets for a placeholder sheet"""
+
+        stub = self.sheets[name]
+        if not isinstance(stub, SheetStub):
+            return stub
+        sheet = stub.splitter
+        df = stub.dataframe
+        meta = stub.get_meta()
         # provide reference to self to dataframewidget
         dfw = DataFrameWidget(sheet, dataframe=df, app=self,
                               font=core.FONT, fontsize=core.FONTSIZE,
@@ -752,8 +1482,11 @@ class Application(QMainWindow):
         # reload attributes of table and plotter if present
         if meta is not None:
             self.load_meta(dfw, meta)
-        self.main.setCurrentIndex(idx)
-        return
+        if stub.source is not None and stub.source[0] is self.project:
+            self.saved[name] = (stub.source[1], self.sheet_state(name))
+        elif stub.source is not None and stub.source[0] is self.journal:
+            self.journaled[name] = (stub.source[1], self.sheet_state(name))
+        return dfw
 
     def remove_sheet(self, index, ask=True):
         """Remove sheet"""
@@ -765,9 +1498,22 @@ class Application(QMainWindow):
                 return False
         name = self.main.tabText(index)
         del self.sheets[name]
+        self.saved.pop(name, None)
+        self.journaled.pop(name, None)
         self.main.removeTab(index)
         return
 
+    def sheet_changed(self, index):
+        """Build the widgets of a sheet when it is first shown"""
+
+        name = self.main.tabText(index)
+        w = self.sheets.get(name)
+        if self.deferred:
+            return
+        if isinstance(w, SheetStub) and not w.loading:
+            self.build_sheet(name)
+        return
+
     def rename_sheet(self):
         """Rename the current sheet"""
 
@@ -782,6 +1528,10 @@ class Application(QMainWindow):
                 return
             self.sheets[new] = self.sheets[name]
             del self.sheets[name]
+            if name in self.saved:
+                self.saved[new] = self.saved.pop(name)
+            if name in self.journaled:
+                self.journaled[new] = self.journaled.pop(name)
             self.main.setTabText(index, new)
         return
 
@@ -790,11 +1540,13 @@ class Application(QMainWindow):
 
         index = self.main.currentIndex()
         name = self.main.tabText(index)
-        df = self.sheets[name].table.model.df
+        source = self.build_sheet(name)
+        df = source.table.model.df
         new, ok = QInputDialog.getText(self, 'New name', 'Name:',
                                        QLineEdit.Normal, name + '_copy')
         if ok:
-            self.add_sheet(new, df)
+            new = self.add_sheet(new, df)
+            self.sheets[new].pipeline = source.pipeline.copy()
         return
 
     def load_dataframe(self, df, name=None, select=False):
@@ -834,9 +1586,15 @@ class Application(QMainWindow):
             return
         if reply == QMessageBox.Yes:
             self.save_project()
+        self.autosave_timer.stop()
+        self.autosave_cancel.set()
+        self.autosave_pool.waitForDone()
+        if reply == QMessageBox.No:
+            self.remove_journal()
 
         for s in self.sheets:
-            self.sheets[s].close()
+            if not isinstance(self.sheets[s], SheetStub):
+                self.sheets[s].close()
         self.save_settings()
         if hasattr(self, 'plotgallery'):
             self.plotgallery.close()
@@ -878,7 +1636,7 @@ class Application(QMainWindow):
 
         idx = self.main.currentIndex()
         name = self.main.tabText(idx)
-        table = self.sheets[name]
+        table = self.build_sheet(name)
         return table
 
     def replot(self):
@@ -916,8 +1674,10 @@ class Application(QMainWindow):
 
         idx = self.main.currentIndex()
         name = self.main.tabText(idx)
-        table = self.sheets[name]
+        table = self.build_sheet(name)
+        self.index_sheets([name])
         dlg = dialogs.SearchDialog(self, sheets=table, names=name)
+        dlg.selected.connect(self.jump_to_cell)
         dlg.exec_()
         return
 
@@ -925,10 +1685,56 @@ class Application(QMainWindow):
         """Search keywords in all sheets in project"""
 
         names = list(self.sheets.keys())
+        self.index_sheets(names)
         dlg = dialogs.SearchDialog(self, sheets=self.sheets, names=names)
+        dlg.selected.connect(self.jump_to_cell)
         dlg.exec_()
         return
 
+    def jump_to_cell(self, name, row, col):
+        """Show a sheet and scroll its table to a cell"""
+
+        if name not in self.sheets:
+            return
+        for i in range(self.main.count()):
+            if self.main.tabText(i) == name:
+                self.main.setCurrentIndex(i)
+        table = self.build_sheet(name).table
+        if row >= table.model.rowCount() or col >= table.model.columnCount():
+            return
+        index = table.model.index(row, col)
+        table.scrollTo(index, QAbstractItemView.PositionAtCenter)
+        table.setCurrentIndex(index)
+        return
+
+    def index_sheets(self, names):
+        """Build the search indexes of sheets in the background. Sheets not
+        read from the project file yet are indexed when searched."""
+
+        sources = []
+        for name in names:
+            w = self.sheets[name]
+            if isinstance(w, SheetStub):
+                if w.df is not None:
+                    sources.append((w, w.df, 0))
+                continue
+            model = w.table.model
+            index = model.textindex
+            if index is not None and index.version == model.version:
+                continue
+            df = util.snapshot(model.df, AUTOSAVE_MAXCOPY)
+            if df is not None:
+                sources.append((model, df, model.version))
+        if len(sources) == 0:
+            return
+
+        def func(progress_callback):
+            for holder, df, version in sources:
+                search.get_index(holder, df, version)
+
+        self.threadpool.start(Worker(fn=func))
+        return
+
     '''def runLastAction(self):
         w = self.getCurrentTable()
         w.runLastAction()
@@ -938,10 +1744,12 @@ class Application(QMainWindow):
         """Refresh all tables"""
 
         for s in self.sheets:
+            if isinstance(self.sheets[s], SheetStub):
+                continue
             w = self.sheets[s].table
             w.font = core.FONT
             w.fontsize = core.FONTSIZE
-            w.refresh()
+            w.updateFont()
         return
 
     def store_plot(self):
@@ -950,23 +1758,41 @@ class Application(QMainWindow):
         w = self.get_current_table()
         index = self.main.currentIndex()
         name = self.main.tabText(index)
-        # get the current figure and make a copy of it by using pickle
-        fig = w.pf.fig
-        p = pickle.dumps(fig)
-        fig = pickle.loads(p)
+        # keep an image of the figure and what is needed to redraw it
+        plot = plotting.StoredPlot.fromViewer(w.pf, name)
         t = time.strftime("%H:%M:%S")
         label = name + '-' + t
-        self.plots[label] = fig
+        self.plots[label] = plot
         if hasattr(self, 'plotgallery'):
             self.plotgallery.update(self.plots)
         return
 
+    def rebuild_plot(self, plot):
+        """Redraw a stored plot from the current data of its sheet,
+        returns the figure or None if the sheet is gone"""
+
+        spec = plot.spec
+        if spec is None or spec['sheet'] not in self.sheets:
+            return
+        w = self.build_sheet(spec['sheet'])
+        data = plot.getData(w.table.model.df)
+        # a hidden viewer so the sheet plot and options are not changed
+        pv = plotting.PlotViewer(w.table)
+        opts = {'generalopts': pv.generalopts, 'labelopts': pv.labelopts,
+                'axesopts': pv.axesopts}
+        for m in opts:
+            if m in spec['options']:
+                opts[m].updateWidgets(spec['options'][m])
+        pv.replot(data)
+        fig = pv.fig
+        pv.deleteLater()
+        return fig
+
     def show_plot_gallery(self):
         """Show stored plot figures"""
 
-        from . import plotting
         if not hasattr(self, 'plotgallery'):
-            self.plotgallery = plotting.PlotGallery()
+            self.plotgallery = plotting.PlotGallery(app=self)
             try:
                 self.plotgallery.resize(self.settings.value('plotgallery_size'))
             except:
@@ -998,7 +1824,7 @@ class Application(QMainWindow):
 
         index = self.main.currentIndex()
         name = self.main.tabText(index)
-        tablew = self.sheets[name]
+        tablew = self.build_sheet(name)
         if not hasattr(tablew, 'openplugins'):
             tablew.openplugins = {}
         openplugins = tablew.openplugins
@@ -1046,7 +1872,8 @@ class Application(QMainWindow):
 
         from . import dialogs
         opts = {'font': core.FONT, 'fontsize': core.FONTSIZE,
-                'columnwidth': core.COLUMNWIDTH, 'timeformat': core.TIMEFORMAT}
+                'columnwidth': core.COLUMNWIDTH, 'timeformat': core.TIMEFORMAT,
+                'codec': project.CODEC, 'level': project.LEVEL or 0}
         dlg = dialogs.PreferencesDialog(self, opts)
         dlg.exec_()
         return
@@ -1127,11 +1954,13 @@ class WorkerSignals(QtCore.QObject):
         `tuple` (exctype, value, traceback.format_exc() )
     result
         `object` data returned from processing, anything
+    progress
+        `object` progress information, e.g. percentage done
     """
     finished = QtCore.Signal()
     error = QtCore.Signal(tuple)
     result = QtCore.Signal(object)
-    progress = QtCore.Signal(str)
+    progress = QtCore.Signal(object)
 
 
 def main():
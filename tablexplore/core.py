@@ -27,7 +27,7 @@ import pandas as pd
 from pandas.api.types import is_datetime64_any_dtype as is_datetime
 import string
 from .qt import *
-from . import dialogs, plotting, util
+from . import dialogs, plotting, util, fileio, operations
 
 module_path = os.path.dirname(os.path.abspath(__file__))
 iconpath = os.path.join(module_path, 'icons')
@@ -105,6 +105,9 @@ class DataFrameWidget(QWidget):
         self.subtable = None
         self.filterdock = None
         self.mode = 'default'
+        self.pipeline = operations.Pipeline()
+        #steps are collected here instead of run when set, see askStep
+        self.captured = None
         self.table.model.dataChanged.connect(self.stateChanged)
         return
 
@@ -224,15 +227,18 @@ class DataFrameWidget(QWidget):
         """Export table"""
 
         options = QFileDialog.Options()
-        options.setDefaultSuffix('csv')
         filename, _ = QFileDialog.getSaveFileName(self, "Export",
                                                   "",
-                                                  "csv files (*.csv);;xlsx files (*.xlsx);;xls Files (*.xls);;All Files (*)",
+                                                  "csv files (*.csv);;compressed csv (*.csv.gz *.csv.zst);;"
+                                                  "xlsx files (*.xlsx);;xls Files (*.xls);;All Files (*)",
                                                   options=options)
         if not filename:
             return
         df = self.table.model.df
-        df.to_csv(filename)
+        if self.app is not None:
+            self.app.export_dataframe(df, filename)
+        else:
+            fileio.export_dataframe(df, filename)
         return
 
     def copy(self):
@@ -327,20 +333,24 @@ class DataFrameWidget(QWidget):
         inplace = kwds['inplace']
         if kwds['useselected'] == 1:
             idx = self.table.getSelectedColumns()
-            cols = df.columns[idx]
+            cols = list(df.columns[idx])
         else:
-            cols = df.columns
+            cols = list(df.columns)
 
-        new = df[df.duplicated(subset=cols, keep=keep)]
+        step = operations.make_step('drop_duplicates', cols=cols, keep=keep)
+        if remove == True and inplace == True and self.capture(step):
+            return
+        # fingerprints of the rows are kept so repeated runs are fast
+        model = self.table.model
+        mask = model.rowhashes.duplicated(df, cols, model.columnVersions(cols), keep)
         if remove == True:
-            new = df.drop_duplicates(subset=cols, keep=keep)
+            new = df[~mask]
             if inplace == True:
-                self.table.model.df = new
-                self.refresh()
+                self.setResult(step, new)
             elif len(new) > 0:
                 self.showSubTable(new)
         else:
-            self.showSubTable(new)
+            self.showSubTable(df[mask])
         return
 
     def cleanData(self):
@@ -371,48 +381,15 @@ class DataFrameWidget(QWidget):
                                   'tooltip': ' '},
                 }
 
-        dlg = dialogs.MultipleInputDialog(self, opts, title='Clean Data')
+        dlg = dialogs.CleanDataDialog(self, df, opts)
         dlg.exec_()
         if not dlg.accepted:
             return
-        kwds = dlg.values
-        replace = kwds['replace']
-        symbol = kwds['symbol']
-        method = kwds['method']
-
-        if symbol == 'null':
-            symbol = np.nan
-        try:
-            replace = float(replace)
-        except:
-            pass
-        if symbol != '':
-            if replace != '':
-                df = df.replace(to_replace=replace, value=symbol)
-            else:
-                df = df.fillna(symbol)
-        if kwds['dropcols'] == 1:
-            df = df.dropna(axis=1, how=kwds['how'])
-        if kwds['droprows'] == 1:
-            df = df.dropna(axis=0, how=kwds['how'])
-        if method == '':
-            pass
-        elif method == 'fill scalar':
-            df = df.fillna(kwds['symbol'])
-        elif method == 'interpolate':
-            df = df.interpolate()
-        else:
-            df = df.fillna(method=method, limit=kwds['limit'])
-        if kwds['dropduplicaterows'] == 1:
-            df = df.drop_duplicates()
-        if kwds['dropduplicatecols'] == 1:
-            df = df.loc[:, ~df.columns.duplicated()]
-        if kwds['rounddecimals'] != 0:
-            df = df.round(rounddecimals)
-
-        self.table.model.df = df
-        # print (df)
-        self.refresh()
+        step = operations.make_step('clean', **dlg.values)
+        if self.capture(step):
+            return
+        # the options are compiled to a plan run once in the background
+        self.runInBackground(step, lambda callback: operations.clean_data(df, callback, **dlg.values))
         return
 
     def convertNumeric(self):
@@ -432,6 +409,9 @@ class DataFrameWidget(QWidget):
                                           'tooltip': ' '},
                 'fillempty': {'type': 'checkbox', 'default': 0, 'label': 'Fill Empty',
                               'tooltip': ' '},
+                'parallel': {'type': 'checkbox', 'default': True, 'label': 'Convert columns in parallel'},
+                'report': {'type': 'checkbox', 'default': True, 'label': 'Show report',
+                           'tooltip': 'values set to NaN in each column'},
                 }
         dlg = dialogs.MultipleInputDialog(self, opts, title='Convert Numeric')
         dlg.exec_()
@@ -448,23 +428,132 @@ class DataFrameWidget(QWidget):
             colnames = df.columns[idx]
         else:
             colnames = df.columns
-        print(idx, colnames)
+        threads = None
+        if kwds['parallel'] == True:
+            threads = os.cpu_count()
+        reports = self.runStep('numeric', cols=list(colnames), convtype=convtype, currency=currency,
+                               removetext=removetext, fillempty=fillempty, threads=threads)
+        if kwds['report'] == True and len(reports) > 0:
+            self.showSubTable(reports[0][1], title='Convert Numeric')
+        return
+
+    def runStep(self, name, **args):
+        """Run an operation on the table and record it in the pipeline.
+        Returns:
+            list of (name, summary) reports from the step
+        """
+
+        step = operations.make_step(name, **args)
+        reports = []
+        if self.capture(step):
+            return reports
         self.table.storeCurrent()
-        for c in colnames:
-            x = df[c]
-            if fillempty == 1 or convtype is int:
-                x = x.fillna(0)
-            if currency == 1:
-                x = x.replace('[\$\£\€,)]', '', regex=True).replace('[(]', '-', regex=True)
-            if removetext == 1:
-                x = x.replace('[^\d.]+', '', regex=True)
-            try:
-                self.table.model.df[c] = pd.to_numeric(x, errors='coerce').astype(convtype)
-            except:
-                pass
+        self.table.model.df = operations.run_step(self.table.model.df, step, reports)
+        self.pipeline.add(step)
+        self.refresh()
+        return reports
+
+    def capture(self, step):
+        """Keep a step instead of running it if only the step is wanted,
+        see askStep. Returns True if it was kept."""
+
+        if self.captured is None:
+            return False
+        self.captured.append(step)
+        return True
+
+    def runInBackground(self, step, func):
+        """Run a step in a worker with a progress dialog, the result replaces
+        the table unless it was changed in the meantime.
+        Args:
+            step: the step, recorded when done
+            func: function taking a progress callback and returning the new table
+        """
+
+        from .app import Worker, ProgressWidget
+        model = self.table.model
+        version = model.version
+        self.progressdlg = dlg = ProgressWidget(label='Running %s' %step['name'], title='Running..')
+        dlg.progressbar.setRange(0, 100)
+        dlg.show()
+
+        def run(progress_callback):
+            return func(progress_callback.emit)
+
+        def done(df):
+            if model.version != version:
+                QMessageBox.warning(self, 'Not changed',
+                                    'The table was changed while %s was running.' %step['name'])
+                return
+            self.setResult(step, df)
+
+        worker = Worker(fn=run)
+        worker.signals.progress.connect(dlg.progressbar.setValue)
+        worker.signals.result.connect(done)
+        worker.signals.error.connect(lambda err: QMessageBox.warning(self, 'Error', str(err[1])))
+        worker.signals.finished.connect(dlg.close)
+        QtCore.QThreadPool.globalInstance().start(worker)
+        return
+
+    def askStep(self, funcname, **args):
+        """Show the dialog of an operation and return the step it would
+        run without running it, None if cancelled"""
+
+        self.captured = []
+        try:
+            getattr(self, funcname)(**args)
+        finally:
+            steps = self.captured
+            self.captured = None
+        if len(steps) == 0:
+            return None
+        return steps[0]
+
+    def setResult(self, step, df):
+        """Show the result of a step that was run in the background and
+        record the step"""
+
+        self.table.storeCurrent()
+        self.table.model.df = df
+        self.pipeline.add(step)
         self.refresh()
         return
 
+    def runPipeline(self, pipeline):
+        """Replay a pipeline on this table, its steps are added to the
+        table pipeline"""
+
+        self.table.storeCurrent()
+        self.table.model.df = pipeline.run(self.table.model.df)
+        self.pipeline.extend(pipeline.steps)
+        self.refresh()
+        return
+
+    def exportPipeline(self):
+        """Save the operations done on this table to a file"""
+
+        if len(self.pipeline) == 0:
+            QMessageBox.information(self, 'Export Pipeline', 'No operations recorded for this table.')
+            return
+        filename, _ = QFileDialog.getSaveFileName(self, "Export Pipeline", "",
+                                                  "json files (*.json);;All files (*.*)")
+        if not filename:
+            return
+        if not os.path.splitext(filename)[1]:
+            filename += '.json'
+        self.pipeline.save(filename)
+        return
+
+    def importPipeline(self):
+        """Run a saved pipeline on this table"""
+
+        filename, _ = QFileDialog.getOpenFileName(self, "Run Pipeline", "",
+                                                  "json files (*.json);;All files (*.*)")
+        if not filename:
+            return
+        self.runPipeline(operations.Pipeline.load(filename))
+        return
+
     def convertTypes(self):
 
         dlg = dialogs.ConvertTypesDialog(self, self.table.model.df)
@@ -518,11 +607,8 @@ class DataFrameWidget(QWidget):
         if len(cols) == 0:
             cols = [column]
 
-        singlefuncs = ['round', 'floor', 'ceil', 'trunc', 'power', 'log', 'exp', 'log10', 'log2',
-                       'negative', 'sign', 'diff',
-                       'sin', 'cos', 'tan', 'degrees', 'radians']
-        multifuncs = ['mean', 'std', 'max', 'min',
-                      'sum', 'subtract', 'divide', 'mod', 'remainder', 'convolve']
+        singlefuncs = operations.singlefuncs
+        multifuncs = operations.multifuncs
 
         if len(cols) > 1:
             funcs = multifuncs + singlefuncs
@@ -546,13 +632,6 @@ class DataFrameWidget(QWidget):
         suffix = kwds['suffix']
         group = kwds['group']
 
-        if funcname == 'diff':
-            func = funcname
-        else:
-            func = getattr(np, funcname)
-
-        self.table.storeCurrent()
-
         if newcol == '':
             if len(cols) > 3:
                 s = ' %s cols' % len(cols)
@@ -560,25 +639,14 @@ class DataFrameWidget(QWidget):
                 s = '(%s)' % (','.join(cols))[:20]
             newcol = funcname + s
 
-        if len(cols) == 2 and funcname in ['sum', 'subtract', 'divide', 'mod', 'remainder', 'convolve']:
+        if len(cols) == 2 and funcname in operations.binaryfuncs:
             newcol = cols[0] + ' ' + funcname + ' ' + cols[1]
-            result = df[cols[0]].combine(df[cols[1]], func=func)
-        elif len(cols) > 2:
-            result = df[cols].apply(func, 1)
-        else:
+        if len(cols) < 2 or funcname in singlefuncs:
+            cols = [col]
             if inplace == True:
                 newcol = col
-            if group != '':
-                result = df.groupby(group)[col].apply(func)
-            else:
-                result = df[col].apply(func, 1)
-
-        if inplace == True:
-            df[col] = result
-        else:
-            idx = df.columns.get_loc(col)
-            df.insert(idx + 1, newcol, result)
-        self.refresh()
+        self.runStep('apply', funcname=funcname, cols=list(cols), col=col, newcol=newcol,
+                     group=group, inplace=inplace)
         return
 
     def _getFunction(self, funcname, obj=None):
@@ -599,14 +667,13 @@ class DataFrameWidget(QWidget):
         """Apply resampling and transform functions on a single column."""
 
         df = self.table.model.df
-        col = column
         cols = [column]
         idx = self.table.getSelectedColumns()
         if len(idx) > 1:
             cols = df.columns[idx]
 
-        ops = ['rolling window', 'expanding', 'shift']
-        winfuncs = ['sum', 'mean', 'std', 'max', 'min', 'sem', 'var', 'quantile']
+        ops = operations.windowops
+        winfuncs = operations.winfuncs
         wintypes = ['', 'boxcar', 'triang', 'blackman', 'hamming', 'bartlett',
                     'parzen', 'bohman', 'blackmanharris', 'nuttall', 'barthann']
         opts = {'operation': {'type': 'combobox', 'default': 'int', 'items': ops, 'label': 'Operation'},
@@ -615,6 +682,7 @@ class DataFrameWidget(QWidget):
                 'periods': {'type': 'spinbox', 'default': 1, 'label': 'Periods', 'range': (1, 1000)},
                 'wintype': {'type': 'combobox', 'default': '', 'items': wintypes, 'label': 'Window type'},
                 'center': {'type': 'checkbox', 'default': True, 'label': 'Center window'},
+                'parallel': {'type': 'checkbox', 'default': False, 'label': 'Run columns in parallel'},
                 'newcol': {'type': 'entry', 'default': '', 'label': 'New column name'},
                 'inplace': {'type': 'checkbox', 'default': False, 'label': 'Update in place'},
                 'suffix': {'type': 'entry', 'default': '_x', 'label': 'Suffix'}
@@ -626,7 +694,6 @@ class DataFrameWidget(QWidget):
             return
         kwds = dlg.values
 
-        self.table.storeCurrent()
         op = kwds['operation']
         winfunc = kwds['winfunc']
         wintype = kwds['wintype']
@@ -639,30 +706,13 @@ class DataFrameWidget(QWidget):
 
         if wintype == '':
             wintype = None
+        threads = None
+        if kwds['parallel'] == True:
+            threads = os.cpu_count()
 
-        for col in cols:
-            if op == 'rolling window':
-                w = df[col].rolling(window=window, win_type=wintype, center=center)
-                func = self._getFunction(winfunc, obj=w)
-                result = func()
-            elif op == 'expanding':
-                func = self._getFunction(winfunc)
-                result = df[col].expanding(2, center=True).apply(func)
-            elif op == 'shift':
-                result = df[col].shift(periods=periods)
-
-            if result is None:
-                return
-            if newcol == '' or len(cols) > 1:
-                newcol = winfunc + '(' + col + ')'
-            if inplace == True:
-                df[col] = result
-            else:
-                if newcol in df.columns:
-                    df.drop(columns=newcol)
-                idx = df.columns.get_loc(col)
-                df.insert(idx + 1, newcol, result)
-        self.refresh()
+        self.runStep('transform', cols=list(cols), op=op, winfunc=winfunc, window=window,
+                     wintype=wintype, center=center, periods=periods, threads=threads,
+                     newcol=newcol, inplace=inplace)
         return
 
     def fillData(self, column):
@@ -725,9 +775,7 @@ class DataFrameWidget(QWidget):
         datetime object.
         """
 
-        df = self.table.model.df
-        props = ['day', 'dayofweek', 'month', 'hour', 'minute', 'second', 'microsecond', 'year',
-                 'dayofyear', 'weekofyear', 'quarter', 'days_in_month', 'is_leap_year']
+        props = operations.dateprops
         opts = {'format': {'type': 'combobox', 'default': 'int', 'editable': True,
                            'items': timeformats, 'label': 'Conversion format'},
                 'errors': {'type': 'combobox', 'items': ['ignore', 'coerce'], 'default': 'ignore', 'label': 'Errors'},
@@ -740,43 +788,20 @@ class DataFrameWidget(QWidget):
             return
         kwds = dlg.values
 
-        format = kwds['format']
         props = kwds['prop']
-        errors = kwds['errors']
-        infer = False
-        if format == 'infer':
-            format = None
-            infer = True
-        temp = df[column]
-        self.table.storeCurrent()
-        if temp.dtype != 'datetime64[ns]':
-            temp = pd.to_datetime(temp, format=format, infer_datetime_format=infer,
-                                  errors=errors)
-
-        if props != '' and len(props) > 0:
-            for prop in props:
-                new = getattr(temp.dt, prop)
-                try:
-                    new = new.astype(int)
-                except:
-                    pass
-                if prop in df.columns:
-                    df.drop(columns=prop)
-                idx = df.columns.get_loc(column)
-                df.insert(idx + 1, prop, new)
-        else:
-            self.table.model.df[column] = temp
-        self.refresh()
+        if props == '':
+            props = []
+        self.runStep('dates', column=column, format=kwds['format'], errors=kwds['errors'],
+                     props=list(props))
         return
 
     def applyStringMethod(self, column):
         """Apply string operation to column(s)"""
 
         df = self.table.model.df
-        # cols = self.getSelectedColumns()
+        cols = list(df.columns[self.table.getSelectedColumns()])
         col = column
-        funcs = ['', 'split', 'strip', 'lstrip', 'lower', 'upper', 'title', 'swapcase', 'len',
-                 'slice', 'replace', 'concat']
+        funcs = operations.stringfuncs
         opts = {'function': {'type': 'combobox', 'default': '',
                              'items': funcs, 'label': 'Function'},
                 'sep': {'type': 'entry', 'default': ',', 'label': 'Split separator'},
@@ -792,54 +817,20 @@ class DataFrameWidget(QWidget):
             return
         kwds = dlg.values
 
-        self.table.storeCurrent()
         func = kwds['function']
-        sep = kwds['sep']
-        start = int(kwds['start'])
-        end = int(kwds['end'])
-        pat = kwds['pat']
-        repl = kwds['repl']
-        inplace = kwds['inplace']
-
-        if func == 'split':
-            new = df[col].str.split(sep).apply(pd.Series)
-            new.columns = [col + '_' + str(i) for i in new.columns]
-            self.table.model.df = pd.concat([df, new], 1)
-            self.refresh()
-            return
-        elif func == 'strip':
-            x = df[col].str.strip()
-        elif func == 'lstrip':
-            x = df[col].str.lstrip(pat)
-        elif func == 'upper':
-            x = df[col].str.upper()
-        elif func == 'lower':
-            x = df[col].str.lower()
-        elif func == 'title':
-            x = df[col].str.title()
-        elif func == 'swapcase':
-            x = df[col].str.swapcase()
-        elif func == 'len':
-            x = df[col].str.len()
-        elif func == 'slice':
-            x = df[col].str.slice(start, end)
-        elif func == 'replace':
-            x = df[col].replace(pat, repl, regex=True)
-        elif func == 'concat':
-            x = df[col].str.cat(df[cols[1]].astype(str), sep=sep)
-        if inplace == 0:
-            newcol = col + '_' + func
-        else:
-            newcol = col
-        if x is None:
+        if func == '':
             print('no function selected')
             return
-        if inplace == 0:
-            if newcol in df.columns:
-                df.drop(columns=newcol)
-            idx = df.columns.get_loc(col)
-            df.insert(idx + 1, newcol, x)
-        self.refresh()
+        other = None
+        if func == 'concat':
+            others = [c for c in cols if c != col]
+            if len(others) == 0:
+                print('select a second column to concatenate')
+                return
+            other = others[0]
+        self.runStep('string', col=col, func=func, sep=kwds['sep'], start=int(kwds['start']),
+                     end=int(kwds['end']), pat=kwds['pat'], repl=kwds['repl'], other=other,
+                     inplace=kwds['inplace'])
         return
 
     def resample(self):
@@ -1123,6 +1114,7 @@ class DataFrameTable(QTableView):
 
         self.updateFont()
         # self.horizontalHeader().setDefaultSectionSize(COLUMNWIDTH)
+        self.model.changed()
         self.model.beginResetModel()
         index = self.model.index
         try:
@@ -1140,6 +1132,8 @@ class DataFrameTable(QTableView):
         if hasattr(self, 'dataframe') and self.dataframe is not None:
             self.model.df = self.dataframe
         self.filtered = False
+        if hasattr(self.parent, 'pipeline'):
+            self.parent.pipeline.clearFilter()
         self.refresh()
         return
 
@@ -1199,6 +1193,23 @@ class DataFrameTable(QTableView):
         cols = [df.columns[i] for i in logidx]
         return cols
 
+    def setColumnOrder(self, cols):
+        """Move header sections to show columns in the given order"""
+
+        hh = self.horizontalHeader()
+        df = self.model.df
+        if len(cols) != len(df.columns):
+            return
+        for visual, col in enumerate(cols):
+            try:
+                logical = df.columns.get_loc(col)
+            except Exception:
+                return
+            if not isinstance(logical, int):
+                return
+            hh.moveSection(hh.visualIndex(logical), visual)
+        return
+
     def getSelectedRows(self):
 
         sm = self.selectionModel()
@@ -1265,6 +1276,7 @@ class DataFrameTable(QTableView):
         self.storeCurrent()
         # print (rows, cols)
         self.model.df.iloc[rows, cols] = np.nan
+        self.refresh()
         return
 
     def setRowColor(self, rowIndex, color):
@@ -1528,6 +1540,12 @@ class DataFrameTable(QTableView):
 class DataFrameModel(QtCore.QAbstractTableModel):
     def __init__(self, dataframe=None, *args):
         super(DataFrameModel, self).__init__()
+        #incremented on any change to the data, used to tell if a sheet needs saving
+        self.version = 0
+        #text search index, see search.TextIndex
+        self.textindex = None
+        #row fingerprints for duplicates and comparisons
+        self.rowhashes = operations.RowHashes()
         if dataframe is None:
             self.df = util.getEmptyData()
         else:
@@ -1535,6 +1553,40 @@ class DataFrameModel(QtCore.QAbstractTableModel):
         self.bg = '#F4F4F3'
         return
 
+    @property
+    def df(self):
+        return self._df
+
+    @df.setter
+    def df(self, df):
+        self._df = df
+        self.changed()
+
+    def changed(self, column=None):
+        """Mark the data as changed, column is the name of a single
+        column that was edited"""
+
+        self.version += 1
+        if column is None:
+            self.colversions = {}
+            self.epoch = self.version
+        else:
+            self.colversions[column] = self.version
+        return
+
+    def columnVersion(self, column):
+        """Version of the data in a column, only changes when that column
+        is edited or the whole table changes"""
+
+        return self.colversions.get(column, self.epoch)
+
+    def columnVersions(self, columns=None):
+        """Dict of column versions"""
+
+        if columns is None:
+            columns = self.df.columns
+        return {c: self.columnVersion(c) for c in columns}
+
     def update(self, df):
         # print('Updating Model')
         self.df = df
@@ -1598,6 +1650,12 @@ class DataFrameModel(QtCore.QAbstractTableModel):
         curr = self.df.iloc[i, j]
         # print (curr, value)
         self.df.iloc[i, j] = value
+        index = self.textindex
+        self.changed(self.df.columns[j])
+        if index is not None and index.version == self.version - 1:
+            #keep the search index current for single cell edits
+            index.setValue(i, j, self.df.iloc[i, j])
+            index.version = self.version
         return True
 
     '''def dragMoveEvent(self, event):
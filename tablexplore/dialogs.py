@@ -20,10 +20,11 @@
 """
 
 from __future__ import absolute_import, division, print_function
-import math, time
+import math, time, re, threading
 import os, types, io
 import string, copy
 from collections import OrderedDict
+import numpy as np
 import pandas as pd
 
 try:
@@ -31,7 +32,7 @@ try:
 except:
     import ConfigParser as configparser
 from .qt import *
-from . import util, core
+from . import util, core, fileio, project, search, filters, operations
 
 module_path = os.path.dirname(os.path.abspath(__file__))
 iconpath = os.path.join(module_path, 'icons')
@@ -292,13 +293,88 @@ class TextDialog(QDialog):
         return
 
 
+class SearchHitModel(QtCore.QAbstractListModel):
+    """List model of search hits. Hits are kept as an int32 array of
+    (sheet, row, column) positions and their text is only made when a row
+    of the list is shown."""
+
+    def __init__(self, parent=None):
+        super(SearchHitModel, self).__init__(parent)
+        self.hits = np.zeros((0, 3), dtype=np.int32)
+        self.names = []
+        self.frames = {}
+        return
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return len(self.hits)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or role != QtCore.Qt.DisplayRole:
+            return None
+        name, row, col = self.getHit(index.row())
+        df = self.frames[name]
+        if row >= len(df) or col >= len(df.columns):
+            return '%s: no longer in table' %name
+        value = str(df.iat[row, col])
+        if len(value) > 200:
+            value = value[:200] + '..'
+        return '%s  [%s, %s]  %s' %(name, df.index[row], df.columns[col], value)
+
+    def getHit(self, i):
+        """Sheet name, row and column position of a hit"""
+
+        s, row, col = self.hits[i]
+        return self.names[s], int(row), int(col)
+
+    def addSheet(self, name, df):
+        """Add a sheet that hits can refer to, returns its number"""
+
+        self.names.append(name)
+        self.frames[name] = df
+        return len(self.names) - 1
+
+    def addHits(self, sheet, cells):
+        """Append (row, column) positions found in a sheet"""
+
+        n = len(cells)
+        if n == 0:
+            return
+        hits = np.empty((n, 3), dtype=np.int32)
+        hits[:, 0] = sheet
+        hits[:, 1:] = cells
+        first = len(self.hits)
+        self.beginInsertRows(QtCore.QModelIndex(), first, first + n - 1)
+        self.hits = np.concatenate([self.hits, hits])
+        self.endInsertRows()
+        return
+
+    def clear(self):
+        self.beginResetModel()
+        self.hits = np.zeros((0, 3), dtype=np.int32)
+        self.names = []
+        self.frames = {}
+        self.endResetModel()
+        return
+
+
 class SearchDialog(QDialog):
-    """Search dialog"""
+    """Search dialog. Sheets are indexed and searched in column chunks in a
+    thread pool, hits are added to the list as they are found. Selecting a
+    hit emits selected with the sheet name, row and column."""
+
+    selected = Signal(str, int, int)
+    #columns searched in one task
+    colchunk = 8
 
     def __init__(self, parent, sheets, names):
         super(SearchDialog, self).__init__(parent)
         self.sheets = sheets
         self.names = names
+        self.pool = QtCore.QThreadPool()
+        self.cancelled = threading.Event()
+        self.generation = 0
+        self.pending = 0
+        self.searched = 0
         self.resize(1000, 500)
         self.setWindowTitle("Search")
         layout = QVBoxLayout(self)
@@ -309,10 +385,13 @@ class SearchDialog(QDialog):
         self.searchbox = PlainTextEditor(self)
         self.searchbox.setLineWrapMode(QPlainTextEdit.NoWrap)
         tw_hbox.addWidget(self.searchbox, stretch=1)
-        self.resultbox = PlainTextEditor(self)
-        self.resultbox.setLineWrapMode(QPlainTextEdit.NoWrap)
-        self.resultbox.setReadOnly(True)
-        tw_hbox.addWidget(self.resultbox, stretch=3)
+        self.model = SearchHitModel(self)
+        self.resultview = QListView(self)
+        self.resultview.setUniformItemSizes(True)
+        self.resultview.setModel(self.model)
+        self.resultview.selectionModel().currentChanged.connect(self.showHit)
+        self.resultview.activated.connect(self.showHit)
+        tw_hbox.addWidget(self.resultview, stretch=3)
 
         # Create search option widget
         self.opts = {
@@ -332,74 +411,175 @@ class SearchDialog(QDialog):
         dialog, self.widgets = dialog_from_options(self, self.opts)
         tw_hbox.addWidget(dialog)
         layout.addWidget(tw)
+        self.status = QLabel(self)
+        layout.addWidget(self.status)
 
         # Create button widget
         bw = QWidget(parent)
         bw_hbox = QHBoxLayout(bw)
-        button = QPushButton("Search")
-        button.clicked.connect(self.search)
-        bw_hbox.addWidget(button)
-        button = QPushButton("Clear")
-        button.clicked.connect(self.clear)
-        bw_hbox.addWidget(button)
-        button = QPushButton("Close")
-        button.clicked.connect(self.close)
-        bw_hbox.addWidget(button)
+        buttons = [("Search", self.search), ("Cancel", self.cancel),
+                   ("Clear", self.clear), ("Close", self.close)]
+        for label, func in buttons:
+            button = QPushButton(label)
+            button.clicked.connect(func)
+            bw_hbox.addWidget(button)
         layout.addWidget(bw)
 
         self.show()
         return
 
-    def search(self):
-        searchbox_val = self.searchbox.toPlainText()
-        keywords = searchbox_val.splitlines()
-        self.resultbox.clear()
+    def getQuery(self):
+        """Search arguments for TextIndex.hits from the options"""
+
+        kwds = get_widget_values(self.widgets)
+        case = kwds["case"] == "Yes"
+        text = self.searchbox.toPlainText()
+        if kwds["regex"] == "Yes":
+            re.compile(text)
+            return {'regex': text, 'case': case}
+        keywords = [k for k in text.splitlines() if k != '']
+        if len(keywords) == 0:
+            return None
+        return {'keywords': keywords, 'operator': kwds["operator"],
+                'case': case, 'word': kwds["word"] == "Yes"}
+
+    def getSheets(self):
+        """Names and widgets of the sheets to search"""
+
         if type(self.sheets) is not OrderedDict:
-            df = self.sheets.dataframe
-            self._search_func(keywords, self.names, df)
-        else:
-            for name in self.names:
-                df = self.sheets[name].dataframe
-                if df is not None:
-                    self._search_func(keywords, name, df)
+            return [(self.names, self.sheets)]
+        return [(name, self.sheets[name]) for name in self.names]
+
+    def getSource(self, sheet):
+        """Holder of the search index, table and data version of a sheet.
+        Sheets that have not been shown yet are read only when indexed."""
+
+        if hasattr(sheet, 'table'):
+            model = sheet.table.model
+            return model, model.df, model.version
+        return sheet, lambda: sheet.dataframe, 0
+
+    def submit(self, gen, func, on_result):
+        """Run a search task in the pool"""
+
+        from .app import Worker
+        worker = Worker(fn=func)
+        worker.signals.result.connect(on_result)
+        worker.signals.error.connect(lambda err: self.status.setText(str(err[1])))
+        worker.signals.finished.connect(lambda: self.taskDone(gen))
+        self.pending += 1
+        self.pool.start(worker)
+        return
+
+    def search(self):
+        """Start searching all sheets in the background"""
+
+        try:
+            query = self.getQuery()
+        except re.error as e:
+            self.status.setText("Invalid regular expression: %s" %e)
+            return
+        self.cancel()
+        self.reset()
+        if query is None:
+            return
+        self.cancelled = threading.Event()
+        self.generation += 1
+        self.pending = 0
+        gen = self.generation
+        for name, sheet in self.getSheets():
+            holder, df, version = self.getSource(sheet)
+
+            def func(progress_callback, holder=holder, df=df, version=version):
+                index = search.get_index(holder, df, version)
+                if callable(df):
+                    df = df()
+                return index, df
+
+            self.submit(gen, func, lambda r, name=name: self.indexed(gen, name, r, query))
+        self.updateStatus()
+        return
+
+    def indexed(self, gen, name, result, query):
+        """Search the columns of an indexed sheet in chunks"""
+
+        if gen != self.generation or self.cancelled.is_set():
+            return
+        index, df = result
+        sheet = self.model.addSheet(name, df)
+        self.searched += 1
+        cancel = self.cancelled
+        cols = list(range(len(index.columns)))
+        for i in range(0, len(cols), self.colchunk):
+
+            def func(progress_callback, chunk=cols[i:i+self.colchunk]):
+                return index.hits(columns=chunk, cancel=cancel, **query)
+
+            self.submit(gen, func, lambda cells: self.found(gen, sheet, cells))
+        return
+
+    def found(self, gen, sheet, cells):
+        """Add cells found in a sheet"""
+
+        if gen != self.generation or self.cancelled.is_set():
+            return
+        self.model.addHits(sheet, cells)
+        return
+
+    def taskDone(self, gen):
+        if gen != self.generation:
+            return
+        self.pending -= 1
+        self.updateStatus()
+        return
+
+    def showHit(self, index):
+        """Show the cell of the selected hit in its table"""
+
+        if not index.isValid():
+            return
+        name, row, col = self.model.getHit(index.row())
+        self.selected.emit(name, row, col)
+        return
+
+    def cancel(self):
+        """Stop the current search, tasks end at the next column"""
+
+        self.cancelled.set()
+        self.updateStatus()
+        return
+
+    def done(self, r):
+        self.cancel()
+        super(SearchDialog, self).done(r)
+        return
+
+    def updateStatus(self):
+        n = len(self.model.hits)
+        sheets = len(np.unique(self.model.hits[:, 0]))
+        text = "%s cells found in %s sheets" %(n, sheets)
+        if self.cancelled.is_set() and self.pending > 0:
+            text += ", cancelled"
+        elif self.pending > 0:
+            text += ", searching.."
+        elif self.searched > 0 and n == 0:
+            text = "Not found!"
+        self.status.setText(text)
         return
 
     def clear(self):
+        self.cancel()
         self.searchbox.clear()
-        self.resultbox.clear()
+        self.reset()
         return
 
-    def _search_func(self, keywords, name, df):
-        # Convert all columns type to string
-        df = df[list(df)].astype(str)
-        kwds = get_widget_values(self.widgets)
-        if kwds["regex"] == "Yes":
-            regex = self.searchbox.toPlainText()
-        else:
-            if kwds["operator"] == "OR" and kwds["word"] == "Yes":
-                regex = ''.join([f'\\b{keyword}\\b|' for keyword in keywords])
-                regex = regex[0:-1]
-            elif kwds["operator"] == "OR" and kwds["word"] == "No":
-                regex = '|'.join(keywords)
-            elif kwds["operator"] == "AND" and kwds["word"] == "Yes":
-                regex = ''.join([f'(?=.*\\b{keyword}\\b)' for keyword in keywords])
-            elif kwds["operator"] == "AND" and kwds["word"] == "No":
-                regex = ''.join([f'(?=.*{keyword})' for keyword in keywords])
-            else:
-                regex = '|'.join(keywords)
+    def reset(self):
+        """Remove the results"""
 
-        if kwds["case"] == "Yes":
-            result = df[df.stack().str.contains(regex, case=True).any(level=0)]
-        else:
-            result = df[df.stack().str.contains(regex, case=False).any(level=0)]
-
-        self.resultbox.insertPlainText(f"# {name}:\n")
-        if result.empty:
-            self.resultbox.insertPlainText("Not found!")
-        else:
-            self.resultbox.insertPlainText(result.to_string())
-        self.resultbox.insertPlainText("\n\n")
-        return result
+        self.model.clear()
+        self.searched = 0
+        self.updateStatus()
+        return
 
 
 class MultipleInputDialog(QDialog):
@@ -429,6 +609,75 @@ class MultipleInputDialog(QDialog):
         return
 
 
+class CleanDataDialog(QDialog):
+    """Clean data options with a preview of the result on the first rows
+    of the table, updated as options are changed"""
+
+    #rows used for the preview
+    samplesize = 200
+
+    def __init__(self, parent, df, options, title='Clean Data'):
+        super(CleanDataDialog, self).__init__(parent)
+        self.values = None
+        self.accepted = False
+        self.sample = df.iloc[:self.samplesize]
+        self.setMinimumSize(800, 400)
+        self.setWindowTitle(title)
+        hbox = QHBoxLayout(self)
+        dialog, self.widgets = dialog_from_options(self, options)
+        left = QWidget(self)
+        left.setMaximumWidth(350)
+        vbox = QVBoxLayout(left)
+        vbox.addWidget(dialog)
+        self.plan_w = QLabel('')
+        self.plan_w.setWordWrap(True)
+        vbox.addWidget(self.plan_w)
+        buttonbox = QDialogButtonBox(self)
+        buttonbox.setStandardButtons(QDialogButtonBox.Cancel | QDialogButtonBox.Ok)
+        buttonbox.button(QDialogButtonBox.Ok).clicked.connect(self.accept)
+        buttonbox.button(QDialogButtonBox.Cancel).clicked.connect(self.close)
+        vbox.addWidget(buttonbox)
+        hbox.addWidget(left)
+        self.previewtable = core.DataFrameTable(self, font=core.FONT)
+        hbox.addWidget(self.previewtable)
+        for w in self.widgets.values():
+            if isinstance(w, QComboBox):
+                w.currentTextChanged.connect(self.preview)
+            elif isinstance(w, QCheckBox):
+                w.stateChanged.connect(self.preview)
+            elif isinstance(w, (QSpinBox, QDoubleSpinBox)):
+                w.valueChanged.connect(self.preview)
+            elif isinstance(w, QLineEdit):
+                w.textChanged.connect(self.preview)
+        self.preview()
+        self.show()
+        return
+
+    def preview(self):
+        """Show the plan for the current options and its result on the sample"""
+
+        values = get_widget_values(self.widgets)
+        plan = operations.clean_plan(**values)
+        text = 'Plan: ' + operations.describe_plan(plan)
+        try:
+            df = operations.run_plan(self.sample, plan)
+        except Exception as e:
+            df = self.sample
+            text += '\nPreview failed: %s' %e
+        else:
+            text += '\nFirst %s rows: %s left' %(len(self.sample), len(df))
+        self.plan_w.setText(text)
+        self.previewtable.model.df = df
+        self.previewtable.refresh()
+        return
+
+    def accept(self):
+        self.values = get_widget_values(self.widgets)
+        self.accepted = True
+        self.close()
+        return
+
+
 class ImportDialog(QDialog):
     """Provides a dialog for import settings"""
 
@@ -584,12 +833,9 @@ class ImportDialog(QDialog):
 
         self.show_text()
         self.values = get_widget_values(self.widgets)
-        timeformat = self.values['time format']
-        if timeformat == 'infer':
-            dateparse = None
-        else:
-            dateparse = lambda x: pd.datetime.strptime(x, timeformat)
-        del self.values['time format']
+        # dates are parsed after reading with a format detected per column
+        self.timeformat = self.values.pop('time format')
+        self.parsedates = self.values.pop('parse_dates')
         del self.values['rowsperfile']
         for k in self.values:
             if self.values[k] == '':
@@ -598,8 +844,7 @@ class ImportDialog(QDialog):
         #    self.values['index_col'] = None
 
         try:
-            f = pd.read_csv(self.filename, chunksize=400, error_bad_lines=False,
-                            warn_bad_lines=False, date_parser=dateparse, **self.values)
+            f = pd.read_csv(self.filename, chunksize=400, on_bad_lines='skip', **self.values)
         except Exception as e:
             print('read csv error')
             print(e)
@@ -612,6 +857,7 @@ class ImportDialog(QDialog):
         except pd.errors.ParserError:
             print('parser error')
             df = pd.DataFrame()
+        df = self.parseDates(df)
 
         self.previewtable.model.df = df
         self.previewtable.refresh()
@@ -621,10 +867,20 @@ class ImportDialog(QDialog):
         """Do the import"""
 
         self.update()
-        self.df = pd.read_csv(self.filename, **self.values)
+        df = pd.read_csv(self.filename, **self.values)
+        self.df = self.parseDates(df)
         self.close()
         return
 
+    def parseDates(self, df):
+        """Convert date columns if parse dates is set. Detected formats are
+        cached for the file so the preview and import detect them once."""
+
+        if self.parsedates != 1:
+            return df
+        key = (self.filename, os.path.getmtime(self.filename))
+        return operations.parse_dates(df, self.timeformat, key)
+
     def quit(self):
         self.cancel = True
         self.close()
@@ -640,6 +896,8 @@ class BasicDialog(QDialog):
         self.parent = parent
         self.df = df
         self.app = self.parent.app
+        #pipeline step of the last result, if it can be recorded
+        self.step = None
         self.setWindowTitle(title)
         self.createWidgets()
         self.setGeometry(QtCore.QRect(400, 300, 1000, 600))
@@ -695,7 +953,12 @@ class BasicDialog(QDialog):
         name, ok = QInputDialog().getText(self, "Enter Sheet Name",
                                           "Name:", QLineEdit.Normal)
         if ok and name:
-            self.app.add_sheet(name=name, df=self.table.model.df)
+            name = self.app.add_sheet(name=name, df=self.table.model.df)
+            if self.step is not None and hasattr(self.parent, 'pipeline'):
+                # the new sheet can be made again from the source table
+                pipeline = self.parent.pipeline.copy()
+                pipeline.add(self.step)
+                self.app.sheets[name].pipeline = pipeline
         return
 
     def copy_to_clipboard(self):
@@ -777,13 +1040,9 @@ class AggregateDialog(BasicDialog):
         grpcols = [i.text() for i in self.groupbyw.selectedItems()]
         aggcols = [i.text() for i in self.aggw.selectedItems()]
         funcs = [i.text() for i in self.funcw.selectedItems()]
-        aggdict = {}
-
-        if len(funcs) == 1: funcs = funcs[0]
-        for a in aggcols:
-            aggdict[a] = funcs
 
-        res = self.df.groupby(grpcols).agg(aggdict).reset_index()
+        self.step = operations.make_step('aggregate', grpcols=grpcols, aggcols=aggcols, funcs=funcs)
+        res = operations.run_step(self.df, self.step)
         self.table.model.df = res
         self.table.refresh()
         return
@@ -963,6 +1222,9 @@ class MergeDialog(BasicDialog):
         w = self.right_suffw = QLineEdit('_2')
         l.addWidget(QLabel('Right suffix'))
         l.addWidget(w)
+        w = self.keyinfo_w = QLabel('')
+        w.setWordWrap(True)
+        l.addWidget(w)
 
         self.table = core.DataFrameTable(self, font=core.FONT)
         hbox.addWidget(self.table)
@@ -995,6 +1257,7 @@ class MergeDialog(BasicDialog):
         how = self.how_w.currentText()
         op = self.ops_w.currentText()
         if op == 'merge':
+            self.checkKeys(lefton, righton)
             res = pd.merge(self.df, self.df2,
                            left_on=lefton,
                            right_on=righton,
@@ -1010,6 +1273,35 @@ class MergeDialog(BasicDialog):
         return
 
 
+    def keyDuplicates(self, table, df, cols):
+        """Number of rows of a table with a repeated key, using the row
+        fingerprints of its sheet if it is showing the table"""
+
+        model = getattr(table, 'model', None)
+        if model is not None and model.df is df:
+            hashes, versions = model.rowhashes, model.columnVersions(cols)
+        else:
+            hashes, versions = operations.RowHashes(), {}
+        return int(hashes.duplicated(df, cols, versions).sum())
+
+    def checkKeys(self, lefton, righton):
+        """Show if the merge keys are unique in each table"""
+
+        info = []
+        right = getattr(self.parent.subtable, 'table', None)
+        for name, table, df, cols in [('left', self.parent.table, self.df, lefton),
+                                      ('right', right, self.df2, righton)]:
+            if not cols:
+                continue
+            n = self.keyDuplicates(table, df, cols)
+            if n == 0:
+                info.append('%s keys are unique' %name)
+            else:
+                info.append('%s keys: %s rows repeat a key' %(name, n))
+        self.keyinfo_w.setText('\n'.join(info))
+        return
+
+
 class ConvertTypesDialog(BasicDialog):
     """Dialog to melt table"""
 
@@ -1103,11 +1395,16 @@ class PreferencesDialog(QDialog):
                      'fontsize': {'type': 'slider', 'default': options['fontsize'], 'range': (5, 40),
                                   'interval': 1, 'label': 'font size'},
                      'timeformat': {'type': 'combobox', 'default': options['timeformat'],
-                                    'items': timeformats, 'label': 'Date/Time format'}
+                                    'items': timeformats, 'label': 'Date/Time format'},
+                     'codec': {'type': 'combobox', 'default': options['codec'],
+                               'items': fileio.codecs, 'label': 'compression'},
+                     'level': {'type': 'spinbox', 'default': options['level'], 'range': (0, 22),
+                               'label': 'level (0 default)'}
                      # 'floatprecision':{'type':'spinbox','default':2, 'label':'precision'},
                      }
         sections = {'table': ['alignment', 'rowheight', 'columnwidth'],
-                    'formats': ['font', 'fontsize', 'timeformat']}
+                    'formats': ['font', 'fontsize', 'timeformat'],
+                    'project files': ['codec', 'level']}
 
         dialog, self.widgets = dialog_from_options(self, self.opts, sections)
 
@@ -1138,6 +1435,8 @@ class PreferencesDialog(QDialog):
         core.FONTSIZE = kwds['fontsize']
         core.COLUMNWIDTH = kwds['columnwidth']
         core.TIMEFORMAT = kwds['timeformat']
+        project.CODEC = kwds['codec']
+        project.LEVEL = fileio.compression_level(kwds['codec'], kwds['level'] or None, clamp=True)
         self.parent.refresh()
         return
 
@@ -1155,6 +1454,24 @@ class FilterDialog(QWidget):
         self.resize(400, 200)
         self.createWidgets()
         self.filters = []
+        #masks of the filters, reused while their columns are unchanged
+        self.cache = filters.MaskCache()
+        #sorted column indexes for range and equality filters
+        self.indexes = filters.IndexCache()
+        #versions of the columns of the unfiltered table
+        self.versions = None
+        #live filtering runs one evaluation at a time after a short delay
+        self.pool = QtCore.QThreadPool()
+        self.pool.setMaxThreadCount(1)
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(300)
+        self.timer.timeout.connect(self.applyLive)
+        self.generation = 0
+        self.cancelled = threading.Event()
+        #value counts of columns for the facet panel
+        self.facetcache = filters.MaskCache(maxsize=8)
+        self.facetpanel = None
         # self.setMinimumHeight(200)
         # self.show()
         return
@@ -1164,7 +1481,8 @@ class FilterDialog(QWidget):
         items = {'Apply': {'action': self.apply, 'file': 'filter'},
                  'Add': {'action': self.addFilter, 'file': 'add'},
                  'Refresh': {'action': self.refresh, 'file': 'table-refresh'},
-                 'Subtract': {'action': self.removeFiltered, 'file': 'table-remove'}
+                 'Subtract': {'action': self.removeFiltered, 'file': 'table-remove'},
+                 'Values': {'action': self.showFacets, 'file': 'tableinfo'}
                  }
         toolbar = QToolBar("Toolbar")
         toolbar.setOrientation(QtCore.Qt.Horizontal)
@@ -1183,10 +1501,19 @@ class FilterDialog(QWidget):
         self.layout.addWidget(QLabel('String filter'))
         self.layout.addWidget(self.query_w)
         self.query_w.returnPressed.connect(self.apply)
+        self.query_w.textEdited.connect(self.inputChanged)
+        self.live_w = QCheckBox('Live filter')
+        self.live_w.setToolTip('Filter as you type')
+        self.live_w.stateChanged.connect(self.inputChanged)
+        self.layout.addWidget(self.live_w)
+        self.index_w = QCheckBox('Index columns')
+        self.index_w.setToolTip('Build sorted column indexes for faster range and equality filters')
+        self.layout.addWidget(self.index_w)
         w = self.column_w = QListWidget()
         w.setSelectionMode(QAbstractItemView.MultiSelection)
         # w.setFixedHeight(60)
         w.addItems(cols)
+        w.itemSelectionChanged.connect(self.inputChanged)
         self.layout.addWidget(QLabel('Filter Columns'))
         self.layout.addWidget(self.column_w)
         tb = self.createToolBar(self)
@@ -1201,6 +1528,7 @@ class FilterDialog(QWidget):
         if table.filtered == True and hasattr(table, 'dataframe'):
             table.model.df = table.dataframe
             table.filtered = False
+            self.recordStep(None)
             table.refresh()
         return
 
@@ -1211,99 +1539,181 @@ class FilterDialog(QWidget):
         cols = list(df.columns)
         self.column_w.clear()
         self.column_w.addItems(cols)
+        if self.facetpanel is not None:
+            self.facetpanel.update()
         return
 
+    def showFacets(self):
+        """Show or hide the panel of column values"""
+
+        if self.facetpanel is None:
+            self.facetpanel = FacetPanel(self)
+            self.layout.insertWidget(self.layout.count() - 1, self.facetpanel)
+        else:
+            self.facetpanel.setVisible(not self.facetpanel.isVisible())
+            self.inputChanged()
+        return
+
+    def getFacets(self, col):
+        """Value counts of a column of the unfiltered table, cached for
+        the column version"""
+
+        base = self.getBase()
+        if self.versions is None:
+            return filters.FacetCounts(base[col])
+        key = (col, self.versions.get(col))
+        return self.facetcache.get(key, lambda: filters.FacetCounts(base[col]))
+
+    def getFacetFilter(self):
+        """Value counts and ticked values of the facet panel, if any"""
+
+        if self.facetpanel is None or not self.facetpanel.isVisible():
+            return None
+        return self.facetpanel.getFilter()
+
     def addFilter(self):
         """Add a filter using widgets"""
 
         df = self.table.model.df
         fb = FilterBar(self, self.table)
-        self.layout.insertWidget(4, fb)
+        self.layout.insertWidget(6, fb)
         self.filters.append(fb)
         return
 
-    def apply(self):
-        """Apply filters"""
+    def getBase(self):
+        """The unfiltered table"""
 
         table = self.table
+        model = table.model
         if table.filtered == True and hasattr(table, 'dataframe'):
-            table.model.df = table.dataframe
-        df = table.model.df
-        mask = None
+            return table.dataframe
+        self.versions = {c: model.columnVersion(c) for c in model.df.columns}
+        return model.df
 
-        s = self.query_w.text()
+    def getIndexes(self):
+        """Column index cache if enabled"""
+
+        if self.index_w.isChecked():
+            return self.indexes
+        return None
+
+    def getInputs(self):
+        """The string query, selected columns and filter bar terms"""
+
+        query = self.query_w.text()
         cols = [i.text() for i in self.column_w.selectedItems()]
+        terms = [f.getFilter() for f in self.filters]
+        return query, cols, terms
+
+    def filterTable(self, base, query, cols, terms, versions=None, cancel=None,
+                    indexes=None, facet=None):
+        """Filtered table, None if cancelled. The string query and filter
+        bars are combined into one expression, masks are cached so only
+        changed filters and columns are recomputed."""
+
+        df = base
         if len(cols) > 0:
             df = df[cols]
-        if s != '':
-            try:
-                mask = df.eval(s)
-            except:
-                mask = df.eval(s, engine='python')
-
-        # add widget based filters
-        if len(self.filters) > 0:
-            mask = self.applyWidgetFilters(df, mask)
-        # apply mask
+        cache = self.cache if versions is not None else None
+        mask = filters.apply_filters(df, terms, query, cache, versions, cancel, indexes)
+        if cancel is not None and cancel.is_set():
+            return None
+        if facet is not None:
+            counts, codes = facet
+            fmask = counts.mask(codes)
+            mask = fmask if mask is None else mask & fmask
         if mask is not None:
             df = df[mask]
+        return df
+
+    def getStep(self, query, cols, terms, facet=None, invert=False):
+        """Pipeline step for the filters"""
+
+        if facet is not None:
+            counts, codes = facet
+            labels = [counts.labels.iat[c if c >= 0 else len(counts) - 1] for c in codes]
+            facet = (counts.name, labels)
+        return operations.make_step('filter', query=query, cols=cols,
+                                    terms=[list(t) for t in terms], facet=facet, invert=invert)
+
+    def recordStep(self, step):
+        """Record the filter shown in the table pipeline, None if the
+        unfiltered table is shown"""
+
+        pipeline = getattr(self.table.parent, 'pipeline', None)
+        if pipeline is None:
+            return
+        if step is None:
+            pipeline.clearFilter()
+        else:
+            pipeline.setFilter(step)
+        return
+
+    def showFiltered(self, base, df, step=None):
+        """Show a filtered table"""
+
+        table = self.table
         self.filtdf = df
-        table.dataframe = table.model.df.copy()
+        if step is not None:
+            self.recordStep(step)
+        if table.filtered == False or not hasattr(table, 'dataframe'):
+            # shallow with copy on write, the filtered table is a new frame
+            table.dataframe = util.snapshot(base)
         table.filtered = True
         table.model.df = df
         table.model.layoutChanged.emit()
         table.refresh()
+        return
+
+    def apply(self):
+        """Apply filters"""
 
+        self.generation += 1
+        self.cancelled.set()
+        base = self.getBase()
+        inputs = self.getInputs()
+        facet = self.getFacetFilter()
+        df = self.filterTable(base, *inputs, versions=self.versions,
+                              indexes=self.getIndexes(), facet=facet)
+        self.showFiltered(base, df, self.getStep(*inputs, facet=facet))
         return
 
-    def applyWidgetFilters(self, df, mask=None):
-        """Apply the widget based filters, returns a boolean mask"""
+    def inputChanged(self):
+        """Restart the delay before live filtering"""
 
-        if mask is None:
-            mask = df.index == df.index
+        if self.live_w.isChecked():
+            self.timer.start()
+        return
 
-        for f in self.filters:
-            col, val, op, b = f.getFilter()
-            try:
-                val = float(val)
-            except:
-                pass
-            print(col, val, op, b)
-            if op == 'contains':
-                m = df[col].str.contains(str(val))
-            elif op == 'equals':
-                m = df[col] == val
-            elif op == 'not equals':
-                m = df[col] != val
-            elif op == '>':
-                m = df[col] > val
-            elif op == '<':
-                m = df[col] < val
-            elif op == 'is empty':
-                m = df[col].isnull()
-            elif op == 'not empty':
-                m = ~df[col].isnull()
-            elif op == 'excludes':
-                m = -df[col].str.contains(val)
-            elif op == 'starts with':
-                m = df[col].str.startswith(val)
-            elif op == 'has length':
-                m = df[col].str.len() > val
-            elif op == 'is number':
-                m = df[col].astype('object').str.isnumeric()
-            elif op == 'is lowercase':
-                m = df[col].astype('object').str.islower()
-            elif op == 'is uppercase':
-                m = df[col].astype('object').str.isupper()
-            else:
-                continue
-            if b == 'AND':
-                mask = mask & m
-            elif b == 'OR':
-                mask = mask | m
-            elif b == 'NOT':
-                mask = mask ^ m
-        return mask
+    def applyLive(self):
+        """Apply filters in a worker so typing is not blocked. Evaluations
+        still running when newer input arrives are cancelled and their
+        results dropped."""
+
+        from .app import Worker
+        self.generation += 1
+        gen = self.generation
+        self.cancelled.set()
+        cancel = self.cancelled = threading.Event()
+        base = self.getBase()
+        inputs = self.getInputs()
+        versions = self.versions
+        indexes = self.getIndexes()
+        facet = self.getFacetFilter()
+
+        def func(progress_callback):
+            return self.filterTable(base, *inputs, versions=versions, cancel=cancel,
+                                    indexes=indexes, facet=facet)
+
+        def done(df):
+            if gen == self.generation and df is not None:
+                self.showFiltered(base, df, self.getStep(*inputs, facet=facet))
+
+        worker = Worker(fn=func)
+        worker.signals.result.connect(done)
+        worker.signals.error.connect(lambda err: print('filter failed: %s' %err[1]))
+        self.pool.start(worker)
+        return
 
     def removeFiltered(self):
         """Subtract current filtered result from original table"""
@@ -1317,6 +1727,12 @@ class FilterDialog(QWidget):
         if table.filtered == False:
             return
         idx = list(self.filtdf.index)
+        pipeline = getattr(table.parent, 'pipeline', None)
+        if pipeline is not None and pipeline.filtered is not None:
+            step = pipeline.steps[pipeline.filtered]
+            pipeline.clearFilter()
+            step['args']['invert'] = True
+            pipeline.add(step)
         df = table.dataframe
         table.dataframe = None
         table.filtered = False
@@ -1331,6 +1747,110 @@ class FilterDialog(QWidget):
         self.close()
 
 
+class FacetPanel(QWidget):
+    """Distinct values of a column with their counts. Ticked values are
+    used as a filter. Only the most frequent values are listed, others
+    can be found with the search box."""
+
+    #values listed at most
+    maxvalues = 200
+
+    def __init__(self, parent):
+        super(FacetPanel, self).__init__(parent)
+        self.parent = parent
+        self.facets = None
+        self.selected = set()
+        self.createWidgets()
+        self.update()
+        return
+
+    def createWidgets(self):
+        """Create widgets"""
+
+        l = QVBoxLayout(self)
+        l.setContentsMargins(0, 0, 0, 0)
+        hbox = QHBoxLayout()
+        self.column_w = QComboBox()
+        self.column_w.currentIndexChanged.connect(self.columnChanged)
+        hbox.addWidget(self.column_w)
+        self.search_w = QLineEdit()
+        self.search_w.setPlaceholderText('find values')
+        self.search_w.textEdited.connect(self.showValues)
+        hbox.addWidget(self.search_w)
+        l.addLayout(hbox)
+        self.values_w = QListWidget()
+        self.values_w.itemChanged.connect(self.itemChanged)
+        l.addWidget(self.values_w)
+        self.info_w = QLabel()
+        l.addWidget(self.info_w)
+        return
+
+    def update(self):
+        """Update the columns if the table has changed"""
+
+        col = self.column_w.currentText()
+        df = self.parent.getBase()
+        cols = list(df.columns)
+        self.column_w.blockSignals(True)
+        self.column_w.clear()
+        self.column_w.addItems(cols)
+        if col in cols:
+            self.column_w.setCurrentIndex(cols.index(col))
+        self.column_w.blockSignals(False)
+        self.columnChanged()
+        return
+
+    def columnChanged(self):
+        """Get the value counts for the current column"""
+
+        col = self.column_w.currentText()
+        self.selected = set()
+        if col == '':
+            self.facets = None
+        else:
+            self.facets = self.parent.getFacets(col)
+        self.showValues()
+        self.parent.inputChanged()
+        return
+
+    def showValues(self):
+        """List the most frequent values matching the search text"""
+
+        w = self.values_w
+        w.blockSignals(True)
+        w.clear()
+        if self.facets is not None:
+            rows, total = self.facets.top(self.maxvalues, self.search_w.text())
+            for code, label, count in rows:
+                item = QListWidgetItem('%s (%s)' %(label, count))
+                item.setData(QtCore.Qt.UserRole, code)
+                item.setFlags(item.flags() | QtCore.Qt.ItemIsUserCheckable)
+                if code in self.selected:
+                    item.setCheckState(QtCore.Qt.Checked)
+                else:
+                    item.setCheckState(QtCore.Qt.Unchecked)
+                w.addItem(item)
+            self.info_w.setText('showing %s of %s values' %(len(rows), total))
+        w.blockSignals(False)
+        return
+
+    def itemChanged(self, item):
+        code = item.data(QtCore.Qt.UserRole)
+        if item.checkState() == QtCore.Qt.Checked:
+            self.selected.add(code)
+        else:
+            self.selected.discard(code)
+        self.parent.inputChanged()
+        return
+
+    def getFilter(self):
+        """Value counts and ticked value codes, None if nothing is ticked"""
+
+        if self.facets is None or len(self.selected) == 0:
+            return None
+        return self.facets, frozenset(self.selected)
+
+
 class FilterBar(QWidget):
     """Single Widget based filter"""
 
@@ -1344,9 +1864,8 @@ class FilterBar(QWidget):
     def createWidgets(self):
         """Create widgets"""
 
-        operators = ['contains', 'excludes', 'equals', 'not equals', '>', '<', 'is empty', 'not empty',
-                     'starts with', 'ends with', 'has length', 'is number', 'is lowercase', 'is uppercase']
-        booleanops = ['AND', 'OR', 'NOT']
+        operators = filters.operators
+        booleanops = filters.booleanops
         df = self.table.model.df
         cols = list(df.columns)
         l = self.layout = QHBoxLayout(self)
@@ -1364,6 +1883,9 @@ class FilterBar(QWidget):
 
         self.term_w = QLineEdit()
         l.addWidget(self.term_w)
+        for w in [self.boolean_w, self.column_w, self.operator_w]:
+            w.currentIndexChanged.connect(self.parent.inputChanged)
+        self.term_w.textEdited.connect(self.parent.inputChanged)
         icon = QIcon(os.path.join(iconpath, 'remove.png'))
         btn = QPushButton()
         btn.setIcon(icon)
@@ -1384,3 +1906,4 @@ class FilterBar(QWidget):
     def onClose(self, ce):
         self.parent.filters.remove(self)
         self.close()
+        self.parent.inputChanged()
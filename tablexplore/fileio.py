@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+"""
+    File reading and writing methods for tablexplore.
+    Created October 2026
+    Copyright (C) Damien Farrell
+
+    This program is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 3
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+from __future__ import absolute_import, division, print_function
+import os, gzip
+
+CHUNKSIZE = 100000
+#excel sheet row limit, larger tables are split over several sheets
+EXCEL_MAXROWS = 1048576
+compressions = {'.gz': 'gzip', '.zst': 'zstd', '.lz4': 'lz4'}
+#codecs for project files, 'none' is stored uncompressed
+codecs = ['none', 'gzip', 'lz4', 'zstd']
+#range of compression levels for each codec, parquet limits lz4 to 12
+levels = {'gzip': (1, 9), 'lz4': (1, 12), 'zstd': (1, 22)}
+#stream headers used to detect the compression of a file
+magic = {b'\x1f\x8b': 'gzip', b'\x28\xb5\x2f\xfd': 'zstd',
+         b'\x04\x22\x4d\x18': 'lz4'}
+csv_formats = {'.csv': ',', '.txt': ',', '.tsv': '\t', '': ','}
+hdf_formats = ['.hdf5', '.hdf', '.h5']
+
+def get_compression(filename):
+    """Get the format extension and compression from a file name,
+    e.g. 'table.csv.gz' returns ('.csv', 'gzip')"""
+
+    base, ext = os.path.splitext(filename)
+    ext = ext.lower()
+    if ext in compressions:
+        fmt = os.path.splitext(base)[1].lower()
+        return fmt, compressions[ext]
+    return ext, None
+
+def detect_compression(fh):
+    """Get the compression of an open binary file from its header,
+    the file position is restored. Returns None if not compressed."""
+
+    pos = fh.tell()
+    head = fh.read(4)
+    fh.seek(pos)
+    for m in magic:
+        if head.startswith(m):
+            return magic[m]
+    return None
+
+def available_codecs():
+    """Codecs that can be used for compressing files"""
+
+    found = ['none', 'gzip']
+    for codec, module in [('lz4', 'lz4.frame'), ('zstd', 'zstandard')]:
+        try:
+            __import__(module)
+            found.append(codec)
+        except ImportError:
+            pass
+    return found
+
+def compression_level(codec, level, clamp=False):
+    """Check a compression level for a codec. Returns None for no level
+    or no compression, which uses the codec default.
+    Args:
+        clamp: if True levels out of range are moved to the nearest
+               valid level, otherwise a ValueError is raised
+    """
+
+    if level is None or codec in [None, 'none']:
+        return None
+    low, high = levels[codec]
+    level = int(level)
+    if low <= level <= high:
+        return level
+    if clamp == True:
+        return min(max(level, low), high)
+    raise ValueError('%s compression level must be from %s to %s' %(codec, low, high))
+
+def open_compressed(filename, mode='wb', compression=None, level=None, **kwargs):
+    """Open a file handle with transparent compression.
+    Args:
+        filename: file name or an open binary file object
+        compression: None, 'gzip', 'lz4' or 'zstd'
+        level: compression level, uses the codec default if None
+        kwargs: passed to the underlying open call e.g. encoding
+    """
+
+    if compression in [None, 'none']:
+        return open(filename, mode, **kwargs)
+    elif compression == 'gzip':
+        if level is None:
+            level = 6
+        return gzip.open(filename, mode, compresslevel=level, **kwargs)
+    elif compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('zstd compression requires the zstandard package')
+        if level is None:
+            level = 3
+        if 'r' in mode:
+            return zstandard.open(filename, mode, **kwargs)
+        #compress on all cores
+        cctx = zstandard.ZstdCompressor(level=level, threads=-1)
+        return zstandard.open(filename, mode, cctx=cctx, **kwargs)
+    elif compression == 'lz4':
+        try:
+            import lz4.frame
+        except ImportError:
+            raise ImportError('lz4 compression requires the lz4 package')
+        if level is None:
+            level = 0
+        return lz4.frame.open(filename, mode, compression_level=level, **kwargs)
+    raise ValueError('unknown compression %s' %compression)
+
+def _chunks(n, chunksize):
+    """Row ranges for writing n rows in chunks"""
+
+    for start in range(0, n, chunksize):
+        yield start, min(start + chunksize, n)
+
+def to_csv(df, filename, compression=None, sep=',', chunksize=CHUNKSIZE,
+           callback=None, **kwargs):
+    """Write a dataframe to csv in row chunks so large tables are not
+    formatted in memory all at once.
+    Args:
+        callback: function called with (rows written, total rows)
+    """
+
+    n = len(df)
+    with open_compressed(filename, 'wt', compression, encoding='utf-8', newline='') as f:
+        if n == 0:
+            df.to_csv(f, sep=sep, **kwargs)
+        for start, end in _chunks(n, chunksize):
+            df.iloc[start:end].to_csv(f, sep=sep, header=(start == 0), **kwargs)
+            if callback is not None:
+                callback(end, n)
+    return
+
+def to_xlsx(df, filename, sheet_name='Sheet1', index=True, chunksize=CHUNKSIZE,
+            callback=None):
+    """Write a dataframe to xlsx using the constant memory mode of xlsxwriter,
+    rows are streamed to disk as they are written. Tables longer than
+    the excel row limit are continued on further sheets."""
+
+    try:
+        import xlsxwriter
+    except ImportError:
+        # not streamed, the pandas writer holds the sheet in memory
+        df.to_excel(filename, sheet_name=sheet_name, index=index)
+        return
+
+    options = {'constant_memory': True, 'remove_timezone': True,
+               'default_date_format': 'yyyy-mm-dd hh:mm:ss'}
+    wb = xlsxwriter.Workbook(filename, options)
+    header = [str(c) for c in df.columns]
+    if index == True:
+        header.insert(0, '' if df.index.name is None else str(df.index.name))
+    n = len(df)
+    rowsper = EXCEL_MAXROWS - 1
+    ws = None
+    sheets = 0
+    row = 0
+    for start, end in _chunks(n, chunksize):
+        chunk = df.iloc[start:end]
+        if index == True:
+            chunk = chunk.reset_index()
+        #plain python objects with None for missing values
+        chunk = chunk.astype(object)
+        chunk = chunk.where(chunk.notna(), None)
+        for values in chunk.itertuples(index=False, name=None):
+            if ws is None or row > rowsper:
+                sheets += 1
+                name = sheet_name if sheets == 1 else '%s_%s' %(sheet_name, sheets)
+                ws = wb.add_worksheet(name)
+                ws.write_row(0, 0, header)
+                row = 1
+            ws.write_row(row, 0, values)
+            row += 1
+        if callback is not None:
+            callback(end, n)
+    if ws is None:
+        ws = wb.add_worksheet(sheet_name)
+        ws.write_row(0, 0, header)
+    wb.close()
+    return
+
+def export_dataframe(df, filename, chunksize=CHUNKSIZE, callback=None):
+    """Export a dataframe to file, the format and any compression are
+    taken from the file extension e.g. .csv, .csv.gz, .tsv.zst, .xlsx, .hdf5
+    Args:
+        df: dataframe
+        filename: output file
+        chunksize: rows written per chunk
+        callback: function called with (rows written, total rows)
+    """
+
+    fmt, compression = get_compression(filename)
+    if fmt in csv_formats:
+        to_csv(df, filename, compression, sep=csv_formats[fmt],
+               chunksize=chunksize, callback=callback)
+        return
+    if compression is not None:
+        raise ValueError('compression is only supported for text formats')
+    if fmt == '.xlsx':
+        to_xlsx(df, filename, chunksize=chunksize, callback=callback)
+    elif fmt == '.xls':
+        df.to_excel(filename)
+    elif fmt in hdf_formats:
+        #fixed format writes each column block directly without copying
+        df.to_hdf(filename, key='df', mode='w')
+    else:
+        raise ValueError('unsupported export format %s' %fmt)
+    if callback is not None:
+        callback(len(df), len(df))
+    return
@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+"""
+    Table filtering functions for tablexplore.
+    Created October 2026
+    Copyright (C) Damien Farrell
+
+    This program is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 3
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+from __future__ import absolute_import, division, print_function
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+operators = ['contains', 'excludes', 'equals', 'not equals', '>', '<', 'is empty', 'not empty',
+             'starts with', 'ends with', 'has length', 'is number', 'is lowercase', 'is uppercase']
+booleanops = ['AND', 'OR', 'NOT']
+
+def _bool(m):
+    """Boolean array from a mask, missing values are False"""
+
+    if isinstance(m, pd.Series):
+        m = m.fillna(False)
+    return np.asarray(m, dtype=bool)
+
+def _number(val):
+    """Filter term as a number if possible"""
+
+    try:
+        return float(val)
+    except:
+        return val
+
+def _is_text(s):
+    """Check if a column holds strings"""
+
+    if pd.api.types.is_numeric_dtype(s) or pd.api.types.is_datetime64_any_dtype(s):
+        return False
+    return pd.api.types.infer_dtype(s, skipna=True) == 'string'
+
+def column_mask(s, op, val):
+    """Boolean mask for a filter operator applied to a column.
+    Args:
+        s: column as a pandas Series
+        op: one of operators
+        val: filter term, compared as a number if possible. Text and
+             date columns are compared with the term as given, in the
+             same way as the SortedIndex
+    Returns:
+        boolean numpy array, None if the operator is not known
+    """
+
+    num = _number(val)
+    if op in ['equals', 'not equals'] and not pd.api.types.is_numeric_dtype(s):
+        num = val
+    elif op in ['>', '<'] and (pd.api.types.is_datetime64_any_dtype(s) or _is_text(s)):
+        num = val
+    if op == 'contains':
+        m = s.str.contains(val)
+    elif op == 'equals':
+        m = s == num
+    elif op == 'not equals':
+        m = ~_bool(s == num)
+    elif op == '>':
+        m = s > num
+    elif op == '<':
+        m = s < num
+    elif op == 'is empty':
+        m = s.isnull()
+    elif op == 'not empty':
+        m = ~s.isnull()
+    elif op == 'excludes':
+        m = ~_bool(s.str.contains(val))
+    elif op == 'starts with':
+        m = s.str.startswith(val)
+    elif op == 'ends with':
+        m = s.str.endswith(val)
+    elif op == 'has length':
+        m = s.str.len() > num
+    elif op == 'is number':
+        m = s.astype('object').str.isnumeric()
+    elif op == 'is lowercase':
+        m = s.astype('object').str.islower()
+    elif op == 'is uppercase':
+        m = s.astype('object').str.isupper()
+    else:
+        return None
+    return _bool(m)
+
+
+class SortedIndex(object):
+    """Secondary index of a column. Values are factorized in sorted order and
+    rows are grouped by value, so the rows for a range of values are one
+    slice found by binary search."""
+
+    #operators that can use the index
+    operators = ['equals', 'not equals', '>', '<', 'starts with']
+
+    def __init__(self, values, kind):
+
+        codes, uniques = pd.factorize(values, sort=True)
+        self.kind = kind
+        self.uniques = np.asarray(uniques)
+        self.nrows = len(codes)
+        self.order = np.argsort(codes, kind='stable')
+        #missing values have code -1 and sort first
+        counts = np.bincount(codes[codes >= 0], minlength=len(self.uniques))
+        nulls = self.nrows - counts.sum()
+        self.offsets = nulls + np.concatenate([[0], np.cumsum(counts)])
+        return
+
+    @classmethod
+    def create(cls, s):
+        """Index for a numeric, datetime or string column, None for other
+        types"""
+
+        if pd.api.types.is_bool_dtype(s):
+            return None
+        if pd.api.types.is_numeric_dtype(s):
+            return cls(s.values, 'number')
+        if pd.api.types.is_datetime64_dtype(s):
+            return cls(s.values, 'datetime')
+        if isinstance(s.dtype, pd.CategoricalDtype) or s.dtype == object or pd.api.types.is_string_dtype(s):
+            values = s.astype(object)
+            if pd.api.types.infer_dtype(values, skipna=True) != 'string':
+                return None
+            return cls(values.values, 'string')
+        return None
+
+    def _key(self, val):
+        """Filter term converted to the type of the column, None if it
+        can't be"""
+
+        try:
+            if self.kind == 'number':
+                return float(val)
+            elif self.kind == 'datetime':
+                return np.datetime64(pd.Timestamp(val))
+        except (ValueError, TypeError):
+            return None
+        return val
+
+    def mask(self, op, val):
+        """Boolean mask of rows for an operator, None if the index can't be
+        used for it"""
+
+        if op not in self.operators:
+            return None
+        if op == 'starts with' and self.kind != 'string':
+            return None
+        key = self._key(val)
+        if key is None:
+            return None
+        u = self.uniques
+        if op == '>':
+            a, b = np.searchsorted(u, key, 'right'), len(u)
+        elif op == '<':
+            a, b = 0, np.searchsorted(u, key, 'left')
+        elif op == 'starts with':
+            a = np.searchsorted(u, key, 'left')
+            b = np.searchsorted(u, key + '\U0010ffff', 'left')
+        else:
+            a, b = np.searchsorted(u, key, 'left'), np.searchsorted(u, key, 'right')
+        m = np.zeros(self.nrows, dtype=bool)
+        m[self.order[self.offsets[a]:self.offsets[b]]] = True
+        if op == 'not equals':
+            m = ~m
+        return m
+
+
+def query_mask(df, query):
+    """Mask for a string query, evaluated with numexpr if it can be"""
+
+    if numexpr is not None:
+        try:
+            return _bool(df.eval(query, engine='numexpr'))
+        except Exception as e:
+            print('query not supported by numexpr (%s), using python engine' %e)
+    return _bool(df.eval(query, engine='python'))
+
+def compile_filters(ops, first=False):
+    """Combine filter masks into one boolean expression.
+    Args:
+        ops: the boolean operator joining each mask, named m0, m1.., to the
+             result so far, which starts as all rows (t)
+        first: start from a query mask named q instead
+    Returns:
+        expression string
+    """
+
+    expr = 'q' if first else 't'
+    for i, op in enumerate(ops):
+        m = 'm%s' %i
+        if op == 'AND':
+            expr = '(%s & %s)' %(expr, m)
+        elif op == 'OR':
+            expr = '(%s | %s)' %(expr, m)
+        elif op == 'NOT':
+            # exclusive or, numexpr has no ^
+            expr = '((%s & ~%s) | (~%s & %s))' %(expr, m, expr, m)
+    return expr
+
+def evaluate(expr, masks):
+    """Evaluate a compiled filter expression over named boolean arrays"""
+
+    if numexpr is not None:
+        return numexpr.evaluate(expr, local_dict=masks)
+    return eval(expr, {'__builtins__': {}}, masks)
+
+
+class MaskCache(object):
+    """Least recently used cache of filter masks. Keys should include the
+    column version so masks of edited columns are not reused."""
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.masks = OrderedDict()
+        self.lock = threading.Lock()
+        return
+
+    def get(self, key, func):
+        """Get a mask, computed with func if not cached"""
+
+        with self.lock:
+            if key in self.masks:
+                self.masks.move_to_end(key)
+                return self.masks[key]
+        m = func()
+        with self.lock:
+            self.masks[key] = m
+            while len(self.masks) > self.maxsize:
+                self.masks.popitem(last=False)
+        return m
+
+    def clear(self):
+        with self.lock:
+            self.masks.clear()
+        return
+
+
+class IndexCache(MaskCache):
+    """Cache of SortedIndex objects, keyed by column and column version so
+    an index is rebuilt after its column is edited"""
+
+    def __init__(self, maxsize=8):
+        super(IndexCache, self).__init__(maxsize)
+        return
+
+    def mask(self, s, version, op, val):
+        """Mask from the index of a column, None if it can't be used"""
+
+        if op not in SortedIndex.operators:
+            return None
+        index = self.get((s.name, version), lambda: SortedIndex.create(s))
+        if index is None:
+            return None
+        return index.mask(op, val)
+
+
+class FacetCounts(object):
+    """Distinct values of a column and their counts from one factorize.
+    Rows for a set of values are found from the value codes."""
+
+    def __init__(self, s):
+
+        codes, uniques = pd.factorize(s)
+        self.name = s.name
+        self.codes = codes
+        self.labels = pd.Series(uniques, dtype=object).astype(str)
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        nulls = len(codes) - counts.sum()
+        self.nulls = nulls > 0
+        if self.nulls:
+            # missing values use the code -1
+            self.labels = pd.concat([self.labels, pd.Series(['(empty)'])], ignore_index=True)
+            counts = np.append(counts, nulls)
+        self.counts = counts
+        self.order = np.argsort(-counts, kind='stable')
+        return
+
+    def __len__(self):
+        return len(self.counts)
+
+    def code(self, i):
+        """Code in the column of the value at position i"""
+
+        if self.nulls and i == len(self.counts) - 1:
+            return -1
+        return int(i)
+
+    def top(self, n=200, text=None):
+        """The most frequent values, optionally only those containing text.
+        Returns:
+            list of (code, label, count) and the number of values matching
+        """
+
+        order = self.order
+        if text is not None and text != '':
+            found = self.labels.str.contains(text, case=False, regex=False).values
+            order = order[found[order]]
+        rows = [(self.code(i), self.labels.iat[i], int(self.counts[i])) for i in order[:n]]
+        return rows, len(order)
+
+    def find(self, labels):
+        """Codes of the values with the given labels, used to replay a
+        recorded selection of values"""
+
+        found = np.flatnonzero(self.labels.isin(list(labels)).values)
+        return [self.code(i) for i in found]
+
+    def mask(self, codes):
+        """Boolean mask of rows having any of the given value codes"""
+
+        lookup = np.zeros(len(self.counts) + 1, dtype=bool)
+        lookup[list(codes)] = True
+        return lookup[self.codes]
+
+
+def apply_filters(df, terms, query=None, cache=None, versions=None, cancel=None,
+                  indexes=None):
+    """Filter mask for a table from a string query and filter terms.
+    Args:
+        df: dataframe
+        terms: list of (column, value, operator, boolean operator)
+        query: string query for df.eval
+        cache: MaskCache to reuse masks from
+        versions: dict of column versions used in the cache keys
+        cancel: threading.Event, checked before each mask is made
+        indexes: IndexCache for range and equality filters, only used
+                 with versions
+    Returns:
+        boolean numpy array or None if there is nothing to filter or
+        it was cancelled
+    """
+
+    if cache is None:
+        cache = MaskCache()
+    if versions is None:
+        versions = {}
+    if (query is None or query == '') and len(terms) == 0:
+        return None
+    masks = {}
+    first = False
+    if query is not None and query != '':
+        key = ('query', query, tuple((c, versions.get(c)) for c in df.columns))
+        masks['q'] = cache.get(key, lambda: query_mask(df, query))
+        first = True
+    else:
+        masks['t'] = np.ones(len(df), dtype=bool)
+    ops = []
+    for col, val, op, b in terms:
+        if cancel is not None and cancel.is_set():
+            return None
+        key = (col, versions.get(col), op, val)
+
+        def func():
+            m = None
+            if indexes is not None and col in versions:
+                m = indexes.mask(df[col], versions[col], op, val)
+            if m is None:
+                m = column_mask(df[col], op, val)
+            return m
+
+        m = cache.get(key, func)
+        if m is None:
+            continue
+        masks['m%s' %len(ops)] = m
+        ops.append(b)
+    expr = compile_filters(ops, first)
+    return evaluate(expr, masks)
@@ -0,0 +1,1009 @@
+#!/usr/bin/env python
+"""
+    Table operations for tablexplore.
+    Created October 2026
+    Copyright (C) Damien Farrell
+
+    This program is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 3
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+    The calculations behind the DataFrameWidget table operations, kept
+    free of any gui code and working on whole columns at once.
+"""
+
+from __future__ import absolute_import, division, print_function
+import json, warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+try:
+    from pandas.tseries.api import guess_datetime_format
+except ImportError:
+    # pandas < 2.0
+    try:
+        from pandas._libs.tslibs.parsing import guess_datetime_format
+    except ImportError:
+        guess_datetime_format = None
+from . import filters
+
+singlefuncs = ['round', 'floor', 'ceil', 'trunc', 'power', 'log', 'exp', 'log10', 'log2',
+               'negative', 'sign', 'diff',
+               'sin', 'cos', 'tan', 'degrees', 'radians']
+multifuncs = ['mean', 'std', 'max', 'min',
+              'sum', 'subtract', 'divide', 'mod', 'remainder', 'convolve']
+#functions of two columns, applied elementwise
+binaryfuncs = {'sum': np.add, 'subtract': np.subtract, 'divide': np.divide,
+               'mod': np.mod, 'remainder': np.remainder, 'convolve': np.multiply}
+
+def single_function(s, funcname):
+    """Apply a function from singlefuncs to a whole column"""
+
+    if funcname == 'diff':
+        return s.diff()
+    elif funcname == 'power':
+        return np.power(s, 2)
+    return getattr(np, funcname)(s)
+
+def column_function(df, funcname, cols, group=None):
+    """Apply a function to one or more columns.
+    Args:
+        df: dataframe
+        funcname: name from singlefuncs or multifuncs
+        cols: column names, functions of several columns are applied per
+              row, of two columns elementwise
+        group: column to group by, single column functions are then
+               applied per group
+    Returns:
+        pandas Series
+    """
+
+    cols = list(cols)
+    if len(cols) == 1 or funcname in singlefuncs:
+        s = df[cols[0]]
+        if group not in [None, ''] and funcname == 'diff':
+            return s.groupby(df[group]).transform('diff')
+        # elementwise functions give the same result with or without groups
+        return single_function(s, funcname)
+    x = df[cols]
+    if funcname == 'std':
+        # as numpy, the population standard deviation
+        return x.std(axis=1, ddof=0)
+    elif funcname in ['mean', 'max', 'min']:
+        return getattr(x, funcname)(axis=1)
+    elif len(cols) == 2:
+        return binaryfuncs[funcname](x.iloc[:, 0], x.iloc[:, 1])
+    elif funcname == 'sum':
+        return x.sum(axis=1)
+    values = binaryfuncs[funcname].reduce(x.values, axis=1)
+    return pd.Series(values, index=df.index)
+
+windowops = ['rolling window', 'expanding', 'shift']
+winfuncs = ['sum', 'mean', 'std', 'max', 'min', 'sem', 'var', 'quantile']
+
+def _window(x, op, winfunc, window=1, wintype=None, center=True, periods=1):
+    """Window operation on a frame using the native pandas aggregations"""
+
+    if op == 'shift':
+        return x.shift(periods=periods)
+    if op == 'rolling window':
+        w = x.rolling(window=window, win_type=wintype, center=center)
+    else:
+        w = x.expanding(2)
+    if winfunc in ['std', 'var'] and op == 'expanding':
+        # as the numpy functions used before, population statistics
+        return getattr(w, winfunc)(ddof=0)
+    elif winfunc == 'quantile':
+        return w.quantile(0.5)
+    return getattr(w, winfunc)()
+
+def window_function(df, cols, op, winfunc, window=1, wintype=None, center=True,
+                    periods=1, threads=None):
+    """Rolling, expanding or shift operation on several columns at once.
+    Args:
+        df: dataframe
+        cols: column names
+        op: one of windowops
+        winfunc: one of winfuncs
+        threads: split the columns over this many threads, the pandas
+                 window aggregations release the GIL
+    Returns:
+        dataframe with the same columns
+    """
+
+    x = df[list(cols)]
+    kwargs = dict(op=op, winfunc=winfunc, window=window, wintype=wintype,
+                  center=center, periods=periods)
+    if threads is None or threads < 2 or len(cols) < 2:
+        return _window(x, **kwargs)
+    chunks = np.array_split(np.arange(len(cols)), min(threads, len(cols)))
+    with ThreadPoolExecutor(len(chunks)) as ex:
+        results = list(ex.map(lambda c: _window(x.iloc[:, c], **kwargs), chunks))
+    return pd.concat(results, axis=1)
+
+stringfuncs = ['', 'split', 'strip', 'lstrip', 'lower', 'upper', 'title', 'swapcase', 'len',
+               'slice', 'replace', 'concat']
+
+def _stringdtype():
+    """Arrow backed string dtype, missing values are NaN where supported
+    as for the default string columns of pandas 3"""
+
+    try:
+        return pd.StringDtype('pyarrow', na_value=np.nan)
+    except TypeError:
+        return pd.StringDtype('pyarrow')
+
+STRING = _stringdtype() if pa is not None else None
+
+def _strings(s):
+    """Column with Arrow string storage if it holds text, None if pyarrow is
+    not installed or the column has other types"""
+
+    if pa is None:
+        return None
+    if isinstance(s.dtype, pd.StringDtype) and s.dtype.storage == 'pyarrow':
+        return s
+    if pd.api.types.infer_dtype(s, skipna=True) not in ['string', 'empty']:
+        return None
+    return s.astype(STRING)
+
+def _arrow(s):
+    """pyarrow array of a string column"""
+
+    arr = pa.array(s, type=pa.string(), from_pandas=True)
+    if isinstance(arr, pa.ChunkedArray):
+        arr = arr.combine_chunks()
+    return arr
+
+def _ascii(s):
+    """Check if an Arrow string column is all ascii"""
+
+    return pc.all(pc.string_is_ascii(_arrow(s))).as_py() != False
+
+def split_strings(s, sep=','):
+    """Split an Arrow string column into a dataframe of the parts, one
+    column per position as with str.split(expand=True). The parts are
+    taken from the split lists by offset without making python lists."""
+
+    lists = pc.split_pattern(_arrow(s), sep)
+    offsets = lists.offsets.to_numpy()
+    parts = lists.flatten()
+    lengths = np.diff(offsets)
+    lengths[~lists.is_valid().to_numpy(zero_copy_only=False)] = 0
+    cols = OrderedDict()
+    for i in range(lengths.max() if len(lengths) > 0 else 0):
+        has = lengths > i
+        idx = pa.array(np.where(has, offsets[:-1] + i, 0), mask=~has)
+        cols[i] = pd.array(parts.take(idx), dtype=STRING)
+    return pd.DataFrame(cols, index=s.index)
+
+def string_method(s, func, sep=',', start=0, end=1, pat='', repl='', other=None):
+    """Apply a string operation to a column. Text columns are converted
+    to Arrow strings so the operations use pyarrow kernels and results are
+    stored compactly, other columns use python string methods.
+    Returns:
+        Series, or a dataframe of the parts for split
+    """
+
+    x = _strings(s)
+    arrow = x is not None
+    if not arrow:
+        x = s
+    if func == 'split':
+        if arrow:
+            return split_strings(x, sep)
+        return x.str.split(sep, expand=True)
+    elif func == 'strip':
+        return x.str.strip()
+    elif func == 'lstrip':
+        return x.str.lstrip(pat)
+    elif func in ['upper', 'swapcase'] and arrow and not _ascii(x):
+        # python makes some letters such as ß several capitals, arrow one
+        return getattr(x.astype(object).str, func)().astype(STRING)
+    elif func == 'upper':
+        return x.str.upper()
+    elif func == 'lower':
+        return x.str.lower()
+    elif func == 'title':
+        return x.str.title()
+    elif func == 'swapcase':
+        return x.str.swapcase()
+    elif func == 'len':
+        return x.str.len()
+    elif func == 'slice':
+        return x.str.slice(start, end)
+    elif func == 'replace':
+        if arrow:
+            try:
+                return x.str.replace(pat, repl, regex=True)
+            except pa.ArrowInvalid:
+                # regex features the arrow engine does not support
+                pass
+        return s.replace(pat, repl, regex=True)
+    elif func == 'concat' and other is not None:
+        if arrow:
+            joined = pc.binary_join_element_wise(_arrow(x), _arrow(other.astype(str)), sep)
+            return pd.Series(pd.array(joined, dtype=STRING), index=s.index, name=s.name)
+        return s.str.cat(other.astype(str), sep=sep)
+    return None
+
+#text that converts to a number, other values become NaN
+NUMBER = r'^[-+]?((\d+\.?\d*|\.\d+)([eE][-+]?\d+)?|[iI]nf(inity)?|INF|[nN]a[nN])$'
+#removed from currency values, and ( is made a minus sign
+CURRENCY = '[$£€,)]'
+
+def _number_text(x, currency=False, removetext=False):
+    """Strip currency symbols or all text from a string column with
+    vectorized kernels. Returns a pyarrow array if pyarrow is available,
+    else a Series."""
+
+    if pa is None:
+        if removetext == 1:
+            return x.str.replace(r'[^\d.]+', '', regex=True)
+        elif currency == 1:
+            # one pass over the values, no regex needed
+            return x.str.translate(str.maketrans({'$': None, '£': None, '€': None,
+                                                  ',': None, ')': None, '(': '-'}))
+        return x
+    arr = pa.array(x, type=pa.string(), from_pandas=True)
+    if removetext == 1:
+        # also removes anything the currency option would
+        arr = pc.replace_substring_regex(arr, r'[^\d.]+', '')
+    elif currency == 1:
+        arr = pc.replace_substring_regex(arr, CURRENCY, '')
+        arr = pc.replace_substring(arr, '(', '-')
+    return arr
+
+def _parse_numbers(arr):
+    """Parse an array of number text to floats, anything else is NaN"""
+
+    arr = pc.utf8_trim_whitespace(arr)
+    ok = pc.match_substring_regex(arr, NUMBER)
+    arr = pc.if_else(ok, arr, pa.scalar(None, pa.string()))
+    return pc.cast(arr, pa.float64()).to_numpy(zero_copy_only=False)
+
+def convert_numeric(x, convtype='float', currency=False, removetext=False, fillempty=False):
+    """Convert a column to numbers, values that can't be converted are
+    set to NaN. String columns are cleaned and parsed with pyarrow
+    kernels when it is installed.
+    Returns:
+        converted Series and the number of values set to NaN
+    """
+
+    empty = x.isnull().values
+    if pd.api.types.is_numeric_dtype(x) and not pd.api.types.is_bool_dtype(x):
+        new = x
+    elif pd.api.types.infer_dtype(x, skipna=True) in ['string', 'empty']:
+        text = _number_text(x, currency, removetext)
+        if pa is not None:
+            new = pd.Series(_parse_numbers(text), index=x.index, name=x.name)
+        else:
+            new = pd.to_numeric(text, errors='coerce')
+    else:
+        # mixed types, only the strings are changed
+        if currency == 1:
+            x = x.replace(CURRENCY, '', regex=True).replace('[(]', '-', regex=True)
+        if removetext == 1:
+            x = x.replace(r'[^\d.]+', '', regex=True)
+        new = pd.to_numeric(x, errors='coerce')
+    nulls = new.isnull().values
+    coerced = int((nulls & ~empty).sum())
+    if fillempty == 1:
+        new = new.where(~empty, 0)
+    return new.astype(convtype), coerced
+
+def numeric_columns(df, cols, convtype='float', currency=False, removetext=False,
+                    fillempty=False, threads=None):
+    """Convert several columns to numbers, optionally in parallel.
+    Returns:
+        dict of converted columns and a dataframe reporting for each column
+        the values set to NaN, or why it could not be converted
+    """
+
+    def func(c):
+        try:
+            new, coerced = convert_numeric(df[c], convtype, currency, removetext, fillempty)
+            return new, (c, coerced, str(new.dtype), '')
+        except Exception as e:
+            return None, (c, np.nan, str(df[c].dtype), str(e))
+
+    if threads is None or threads < 2 or len(cols) < 2:
+        results = [func(c) for c in cols]
+    else:
+        with ThreadPoolExecutor(min(threads, len(cols))) as ex:
+            results = list(ex.map(func, cols))
+    new = {c: r[0] for c, r in zip(cols, results) if r[0] is not None}
+    report = pd.DataFrame([r[1] for r in results], columns=['column', 'coerced to NaN', 'type', 'error'])
+    return new, report
+
+dateprops = ['day', 'dayofweek', 'month', 'hour', 'minute', 'second', 'microsecond', 'year',
+             'dayofyear', 'weekofyear', 'quarter', 'days_in_month', 'is_leap_year']
+
+#formats tried when detecting the format of a date column
+dateformats = ['%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S',
+               '%d/%m/%Y', '%m/%d/%Y', '%d/%m/%y', '%m/%d/%y', '%Y/%m/%d', '%y/%m/%d', '%Y/%d/%m',
+               '%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%m/%d/%Y %H:%M:%S', '%m/%d/%Y %H:%M',
+               '%d-%m-%Y', '%d-%m-%Y %H:%M:%S', '%d-%m-%Y %H:%M', '%d-%b-%Y', '%b-%d-%Y',
+               '%d %b %Y', '%d %B %Y', '%d.%m.%Y', '%Y%m%d', '%d%m%Y', '%H:%M:%S', '%H:%M']
+#resolution of datetimes pandas parses from text, ns before pandas 3
+DATEUNIT = np.datetime_data(pd.to_datetime(pd.Series(['2000-01-01'])).dtype)[0]
+#detected formats of file columns, keyed by (file, modified time, column)
+formatcache = filters.MaskCache(maxsize=256)
+
+def _sample(s, n):
+    """Up to n distinct non empty values spread over a column"""
+
+    s = s.dropna()
+    if len(s) > n * 10:
+        s = s.iloc[np.linspace(0, len(s) - 1, n * 10).astype(int)]
+    return s.drop_duplicates().iloc[:n]
+
+def detect_format(s, sample=500, key=None):
+    """Find the date format of a text column from a sample of its values.
+    The guess from the first value and the common formats are tried and
+    the one that parses most of the sample is used.
+    Args:
+        s: column
+        sample: number of values to try
+        key: cache the format under this key, e.g. the file and column
+    Returns:
+        format string or None if no format fits
+    """
+
+    if key is not None:
+        return formatcache.get(key, lambda: detect_format(s, sample))
+    if pd.api.types.infer_dtype(s, skipna=True) != 'string':
+        return None
+    values = _sample(s, sample).astype(str)
+    if len(values) == 0:
+        return None
+    first = second = None
+    if guess_datetime_format is not None:
+        # month first is preferred when both fit, as pandas does
+        with warnings.catch_warnings():
+            # pandas warns when the guess does not follow dayfirst
+            warnings.simplefilter('ignore', UserWarning)
+            first = guess_datetime_format(values.iat[0])
+            second = guess_datetime_format(values.iat[0], dayfirst=True)
+    candidates = [first] + dateformats + [second]
+    candidates = [f for f in dict.fromkeys(candidates) if f is not None]
+    best, found = None, 0
+    for fmt in candidates:
+        n = pd.to_datetime(values, format=fmt, errors='coerce').notnull().sum()
+        if n > found:
+            best, found = fmt, n
+            if n == len(values):
+                break
+    if found < len(values) * .9:
+        return None
+    return best
+
+def _strptime(s, format, errors='coerce'):
+    """Parse text with an explicit format using the pyarrow kernel. Values
+    it reads differently to pandas, such as 31/02 or unpadded numbers, are
+    found by formatting the result back and parsed again with pandas."""
+
+    arr = pa.array(s, type=pa.string(), from_pandas=True)
+    parsed = pc.strptime(arr, format=format, unit=DATEUNIT, error_is_null=True)
+    same = pc.equal(pc.strftime(pc.cast(parsed, pa.timestamp('s')), format=format), arr)
+    redo = np.flatnonzero(pc.invert(pc.fill_null(same, False)).to_numpy(zero_copy_only=False)
+                          & s.notnull().values)
+    #a copy, the array from arrow is read only when there are no nulls
+    values = np.array(parsed.to_numpy(zero_copy_only=False))
+    if len(redo) > 0:
+        other = pd.to_datetime(s.iloc[redo], format=format, errors=errors)
+        values[redo] = other.values.astype('datetime64[%s]' %DATEUNIT)
+    return pd.Series(values, index=s.index, name=s.name)
+
+def convert_dates(s, format=None, errors='coerce'):
+    """Convert a column to datetimes. The format is detected from a sample
+    if not given, text columns are parsed with an explicit format"""
+
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s
+    if format in ['infer', '', None]:
+        format = detect_format(s)
+    if errors == 'ignore':
+        # leave the column unchanged if it can't be converted
+        try:
+            return convert_dates(s, format, 'raise')
+        except (ValueError, TypeError):
+            return s
+    if (format is not None and pa is not None and '%f' not in format and '%z' not in format
+            and pd.api.types.infer_dtype(s, skipna=True) == 'string'):
+        return _strptime(s, format, errors)
+    return pd.to_datetime(s, format=format, errors=errors)
+
+def parse_dates(df, format=None, key=None):
+    """Convert the text columns of a table that hold dates. Formats are
+    detected per column and cached if key, e.g. a filename, is given."""
+
+    for col in df.columns:
+        s = df[col]
+        if pd.api.types.infer_dtype(s, skipna=True) != 'string':
+            continue
+        fmt = format
+        if fmt in ['infer', '', None]:
+            fmt = detect_format(s, key=None if key is None else (key, col))
+        if fmt is None:
+            continue
+        df[col] = convert_dates(s, fmt, 'ignore')
+    return df
+
+def date_properties(s, props):
+    """Properties of a datetime column such as year or hour. The date
+    parts are computed once with numpy and shared by all properties.
+    Returns:
+        dict of property name and column, as int if there are no missing values
+    """
+
+    if isinstance(s.dtype, pd.DatetimeTZDtype):
+        # local times are needed, use pandas
+        parts = {p: getattr(s.dt, p) for p in props if p != 'weekofyear'}
+    else:
+        # kept in the column unit, nanoseconds overflow outside 1677-2262
+        v = s.values
+        Y = v.astype('M8[Y]')
+        M = v.astype('M8[M]')
+        D = v.astype('M8[D]')
+        missing = np.isnat(v)
+        # time of day, missing values are masked below
+        t = v - D
+        t[missing] = 0
+        second = np.timedelta64(1, 's')
+        year = Y.astype(np.int64) + 1970
+        month = (M - Y).astype(np.int64) + 1
+        leap = ((year % 4 == 0) & (year % 100 != 0)) | (year % 400 == 0)
+        funcs = {'year': lambda: year,
+                 'month': lambda: month,
+                 'day': lambda: (D - M).astype(np.int64) + 1,
+                 'hour': lambda: t // np.timedelta64(1, 'h'),
+                 'minute': lambda: t // np.timedelta64(1, 'm') % 60,
+                 'second': lambda: t // second % 60,
+                 'microsecond': lambda: t % second // np.timedelta64(1, 'us'),
+                 'dayofweek': lambda: (D.astype(np.int64) + 3) % 7,
+                 'dayofyear': lambda: (D - Y).astype(np.int64) + 1,
+                 'quarter': lambda: (month - 1) // 3 + 1,
+                 'days_in_month': lambda: ((M + 1).astype('M8[D]') - M).astype(np.int64),
+                 'is_leap_year': lambda: leap}
+        parts = {}
+        for p in props:
+            if p not in funcs:
+                continue
+            x = funcs[p]()
+            if missing.any() and p != 'is_leap_year':
+                x = np.where(missing, np.nan, x)
+            parts[p] = pd.Series(x, index=s.index)
+    if 'weekofyear' in props:
+        parts['weekofyear'] = s.dt.isocalendar().week.astype(float)
+    result = {}
+    for p in props:
+        x = parts[p]
+        if x.isnull().any() == False and x.dtype != bool:
+            x = x.astype(int)
+        result[p] = x
+    return result
+
+def clean_plan(replace='', symbol='', method='', limit=1, dropcols=0, droprows=0,
+               how='any', dropduplicaterows=0, dropduplicatecols=0, rounddecimals=0):
+    """Compile the clean data options into a plan, a list of (stage,
+    arguments). Options that do nothing are left out, the row and column
+    drops are one selection and so are the duplicate drops."""
+
+    if symbol == 'null':
+        symbol = np.nan
+    try:
+        replace = float(replace)
+    except:
+        pass
+    if how == '':
+        how = 'any'
+    plan = []
+    filled = False
+    if not isinstance(symbol, str) or symbol != '':
+        if replace != '':
+            plan.append(('replace', {'to_replace': replace, 'value': symbol}))
+        elif not pd.isnull(symbol):
+            plan.append(('fillna', {'value': symbol}))
+            filled = True
+    if dropcols == 1 or droprows == 1:
+        plan.append(('dropna', {'cols': dropcols == 1, 'rows': droprows == 1, 'how': how}))
+    if method == 'fill scalar':
+        # nothing is left to fill if empty values were already filled
+        if not filled and not pd.isnull(symbol):
+            plan.append(('fillna', {'value': symbol}))
+    elif method == 'interpolate':
+        plan.append(('interpolate', {}))
+    elif method in ['ffill', 'bfill']:
+        plan.append((method, {'limit': 1 if limit else None}))
+    if dropduplicaterows == 1 or dropduplicatecols == 1:
+        plan.append(('duplicates', {'rows': dropduplicaterows == 1, 'cols': dropduplicatecols == 1}))
+    if rounddecimals != 0:
+        plan.append(('round', {'decimals': rounddecimals}))
+    return plan
+
+def describe_plan(plan):
+    """Text of the stages of a plan"""
+
+    if len(plan) == 0:
+        return 'nothing to do'
+    return ', '.join('%s %s' %(op, ' '.join('%s=%s' %(k, v) for k, v in args.items()))
+                     for op, args in plan)
+
+def run_plan(df, plan, callback=None):
+    """Run a clean data plan. Stages run one after the other on the whole
+    table, each returns a new table as the pandas call it stands for does.
+    Args:
+        df: dataframe
+        plan: from clean_plan
+        callback: function called with the percentage done after each stage
+    """
+
+    for i, (op, args) in enumerate(plan):
+        if op == 'replace':
+            df = df.replace(**args)
+        elif op == 'fillna':
+            df = df.fillna(**args)
+        elif op == 'dropna':
+            # one null mask gives the columns and then the rows to keep
+            na = df.isnull().values
+            reduce = np.any if args['how'] == 'any' else np.all
+            cols = np.ones(df.shape[1], dtype=bool)
+            rows = np.ones(df.shape[0], dtype=bool)
+            if args['cols']:
+                cols = ~reduce(na, axis=0)
+            if args['rows']:
+                rows = ~reduce(na[:, cols], axis=1)
+            if not cols.all() or not rows.all():
+                df = df.iloc[rows, cols]
+        elif op == 'interpolate':
+            df = df.interpolate()
+        elif op == 'ffill':
+            df = df.ffill(**args)
+        elif op == 'bfill':
+            df = df.bfill(**args)
+        elif op == 'duplicates':
+            rows = np.ones(df.shape[0], dtype=bool)
+            cols = np.ones(df.shape[1], dtype=bool)
+            if args['rows']:
+                rows = ~df.duplicated().values
+            if args['cols']:
+                cols = ~df.columns.duplicated()
+            if not cols.all() or not rows.all():
+                df = df.iloc[rows, cols]
+        elif op == 'round':
+            df = df.round(**args)
+        if callback is not None:
+            callback(int((i + 1) * 100 / len(plan)))
+    return df
+
+def clean_data(df, callback=None, **kwargs):
+    """Replace or fill missing values and drop empty or duplicate rows and
+    columns, see clean_plan for the options"""
+
+    return run_plan(df, clean_plan(**kwargs), callback)
+
+def aggregate(df, grpcols, aggcols, funcs):
+    """Groupby aggregate"""
+
+    if len(funcs) == 1:
+        funcs = funcs[0]
+    aggdict = {}
+    for a in aggcols:
+        aggdict[a] = funcs
+    return df.groupby(grpcols).agg(aggdict).reset_index()
+
+
+def hash_column(s):
+    """Hashes of the values of a column. Numbers and booleans are hashed
+    as float64 and datetimes as seconds and nanoseconds, so equal values in
+    columns of different types such as 1 and 1.0 get the same hash. Integers too large for a
+    float can share a hash and need comparing."""
+
+    if pd.api.types.is_bool_dtype(s) or (pd.api.types.is_numeric_dtype(s)
+                                         and not pd.api.types.is_complex_dtype(s)):
+        s = s.astype('float64')
+    elif pd.api.types.is_datetime64_dtype(s):
+        # whole seconds and the nanoseconds after them hold every unit's
+        # range, casts to seconds round down so the remainder is positive
+        v = s.values
+        seconds = v.astype('M8[s]')
+        rest = (v - seconds).astype('m8[ns]')
+        return combine_hashes([pd.util.hash_array(seconds.view(np.int64)),
+                               pd.util.hash_array(rest.view(np.int64))])
+    return pd.util.hash_pandas_object(s, index=False).values
+
+def combine_hashes(hashes):
+    """Combine uint64 hashes of several columns into one per row, the
+    column order matters"""
+
+    result = np.zeros(len(hashes[0]), dtype=np.uint64)
+    for h in hashes:
+        # multiply and add with wrap around, as for tuple hashes
+        result = result * np.uint64(1000003) + h
+    return result
+
+
+class RowHashes(object):
+    """Cache of row fingerprints of a table for sets of columns. Each column
+    is hashed once with hash_column and kept for its version, so after an
+    edit only the edited columns are hashed again. Duplicate masks found
+    from the fingerprints are also cached."""
+
+    def __init__(self):
+        self.columns = filters.MaskCache(maxsize=64)
+        self.rows = filters.MaskCache(maxsize=16)
+        return
+
+    def column(self, s, version):
+        """Hashes of a column"""
+
+        return self.columns.get((s.name, version), lambda: hash_column(s))
+
+    def get(self, df, cols, versions):
+        """Row fingerprints for columns of a table.
+        Args:
+            df: dataframe
+            cols: columns, in order
+            versions: dict of column versions, see DataFrameModel.columnVersion
+        """
+
+        key = tuple((c, versions.get(c)) for c in cols)
+        return self.rows.get(key, lambda: combine_hashes([self.column(df[c], versions.get(c))
+                                                          for c in cols]))
+
+    def duplicated(self, df, cols, versions, keep='first'):
+        """Boolean mask of duplicate rows as for DataFrame.duplicated. Rows
+        with equal fingerprints are compared to be sure they are equal."""
+
+        key = ('duplicated', keep) + tuple((c, versions.get(c)) for c in cols)
+
+        def func():
+            codes, uniques = pd.factorize(self.get(df, cols, versions))
+            n = len(codes)
+            rows = np.arange(n)
+            # row of the first and last occurrence of each fingerprint
+            first = np.unique(codes, return_index=True)[1]
+            if keep == 'first':
+                mask = first[codes] != rows
+            elif keep == 'last':
+                last = n - 1 - np.unique(codes[::-1], return_index=True)[1]
+                mask = last[codes] != rows
+            else:
+                mask = np.bincount(codes, minlength=len(uniques))[codes] > 1
+            # compare rows with the first row having their fingerprint
+            check = np.flatnonzero(first[codes] != rows)
+            if len(check) == 0:
+                return mask
+            other = first[codes[check]]
+            for c in cols:
+                x = df[c]
+                a = x.take(check).values
+                b = x.take(other).values
+                same = (a == b) | (pd.isnull(a) & pd.isnull(b))
+                if not np.asarray(same, dtype=bool).all():
+                    # a hash collision, very unlikely
+                    return df.duplicated(subset=cols, keep=keep).values
+            return mask
+
+        return self.rows.get(key, func)
+
+    def isin(self, df, cols, versions, other):
+        """Mask of rows whose fingerprint is in an array of other
+        fingerprints, e.g. those of another table"""
+
+        return np.isin(self.get(df, cols, versions), other)
+
+    def clear(self):
+        self.columns.clear()
+        self.rows.clear()
+        return
+
+
+class Columns(object):
+    """Columns of a table being changed by column wise steps. Steps read
+    and set columns here, and the changes are applied to the table in one
+    go so no intermediate tables are made."""
+
+    def __init__(self, df, reports=None):
+        self.df = df
+        self.order = list(df.columns)
+        self.changed = OrderedDict()
+        self.reports = reports
+        return
+
+    def report(self, name, info):
+        """Give a summary of what a step did to the caller, if it wants one"""
+
+        if self.reports is not None:
+            self.reports.append((name, info))
+        return
+
+    def __getitem__(self, key):
+        if isinstance(key, (list, tuple, pd.Index)):
+            return pd.concat([self[k].rename(k) for k in key], axis=1)
+        if key in self.changed:
+            return self.changed[key]
+        return self.df[key]
+
+    def __len__(self):
+        return len(self.df)
+
+    @property
+    def columns(self):
+        return pd.Index(self.order)
+
+    @property
+    def index(self):
+        return self.df.index
+
+    def set(self, name, s, after=None):
+        """Set a column, a new column goes after the given one or at the end"""
+
+        if name not in self.order:
+            if after in self.order:
+                self.order.insert(self.order.index(after) + 1, name)
+            else:
+                self.order.append(name)
+        self.changed[name] = s
+        return
+
+    def frame(self):
+        """The table with the changed columns"""
+
+        if len(self.changed) == 0:
+            return self.df
+        df = self.df.copy(deep=False)
+        for i, name in enumerate(self.order):
+            if name not in self.changed:
+                continue
+            if name in df.columns:
+                df[name] = self.changed[name]
+            else:
+                df.insert(i, name, self.changed[name])
+        return df
+
+
+#recordable steps, name: (function, column wise)
+registry = OrderedDict()
+
+def register(name, columnwise=False):
+    """Make a function available as a pipeline step. Column wise steps take
+    a Columns object to read and set columns, others take and return a
+    dataframe. Other arguments must be serializable as json."""
+
+    def wrap(func):
+        registry[name] = (func, columnwise)
+        return func
+    return wrap
+
+@register('apply', columnwise=True)
+def apply_step(t, funcname, cols, col, newcol, group=None, inplace=False):
+    result = column_function(t, funcname, cols, group)
+    if inplace == True:
+        t.set(col, result)
+    else:
+        t.set(newcol, result, after=col)
+    return
+
+@register('transform', columnwise=True)
+def transform_step(t, cols, op, winfunc, window=1, wintype=None, center=True,
+                   periods=1, threads=None, newcol='', inplace=False):
+    result = window_function(t, cols, op, winfunc, window, wintype, center, periods, threads)
+    for col in cols:
+        if inplace == True:
+            t.set(col, result[col])
+            continue
+        name = newcol
+        if newcol == '' or len(cols) > 1:
+            name = winfunc + '(' + col + ')'
+        t.set(name, result[col], after=col)
+    return
+
+@register('string', columnwise=True)
+def string_step(t, col, func, sep=',', start=0, end=1, pat='', repl='', other=None,
+                inplace=False):
+    x = string_method(t[col], func, sep, start, end, pat, repl,
+                      t[other] if other is not None else None)
+    if x is None:
+        return
+    if func == 'split':
+        for i in x.columns:
+            t.set(col + '_' + str(i), x[i])
+    elif inplace == True:
+        t.set(col, x)
+    else:
+        t.set(col + '_' + func, x, after=col)
+    return
+
+@register('numeric', columnwise=True)
+def numeric_step(t, cols, convtype='float', currency=False, removetext=False, fillempty=False,
+                 threads=None):
+    new, report = numeric_columns(t, cols, convtype, currency, removetext, fillempty, threads)
+    for c in new:
+        t.set(c, new[c])
+    t.report('numeric', report)
+    return
+
+@register('dates', columnwise=True)
+def dates_step(t, column, format=None, errors='coerce', props=None):
+    temp = convert_dates(t[column], format, errors)
+    if props is None or len(props) == 0:
+        t.set(column, temp)
+        return
+    if not pd.api.types.is_datetime64_any_dtype(temp):
+        return
+    parts = date_properties(temp, props)
+    after = column
+    for prop in props:
+        t.set(prop, parts[prop], after=after)
+        after = prop
+    return
+
+@register('clean')
+def clean_step(df, **kwargs):
+    return clean_data(df, **kwargs)
+
+@register('filter')
+def filter_step(df, query='', cols=None, terms=None, facet=None, invert=False):
+    """Filter rows. facet is a column name and the labels of the values to
+    keep, as given by filters.FacetCounts"""
+
+    x = df[cols] if cols else df
+    mask = filters.apply_filters(x, [tuple(t) for t in terms or []], query)
+    if facet is not None:
+        col, values = facet
+        # labels made the same way as when the values were picked
+        counts = filters.FacetCounts(df[col])
+        fmask = counts.mask(counts.find(values))
+        mask = fmask if mask is None else mask & fmask
+    if invert == True:
+        if mask is None:
+            return df.iloc[:0]
+        return df[~mask]
+    if mask is not None:
+        x = x[mask]
+    return x
+
+@register('drop_duplicates')
+def duplicates_step(df, cols=None, keep='first'):
+    return df.drop_duplicates(subset=cols, keep=keep)
+
+@register('aggregate')
+def aggregate_step(df, grpcols, aggcols, funcs):
+    return aggregate(df, grpcols, aggcols, funcs)
+
+def make_step(name, **args):
+    """A pipeline step, a dict of the step name and arguments"""
+
+    if name not in registry:
+        raise ValueError('unknown step %s' %name)
+    return {'name': name, 'args': args}
+
+def run_steps(df, steps, reports=None):
+    """Run steps on a table. Consecutive column wise steps share one
+    Columns object so their results are applied to the table together.
+    Steps may add (name, summary) tuples to a reports list."""
+
+    t = None
+    for step in steps:
+        func, columnwise = registry[step['name']]
+        if columnwise:
+            if t is None:
+                t = Columns(df, reports)
+            func(t, **step['args'])
+        else:
+            if t is not None:
+                df = t.frame()
+                t = None
+            df = func(df, **step['args'])
+    if t is not None:
+        df = t.frame()
+    return df
+
+def run_step(df, step, reports=None):
+    """Run a single step"""
+
+    return run_steps(df, [step], reports)
+
+
+class Pipeline(object):
+    """Recorded table operations that can be saved and replayed on another
+    table. The last filter applied to the table is kept at the end while it
+    is shown, since removing the filter shows the table from before it."""
+
+    def __init__(self, steps=None):
+        self.steps = list(steps or [])
+        #position of the filter step being shown
+        self.filtered = None
+        return
+
+    def __len__(self):
+        return len(self.steps)
+
+    def add(self, step):
+        self.steps.append(step)
+        return
+
+    def extend(self, steps):
+        self.steps.extend(steps)
+        return
+
+    def setFilter(self, step):
+        """Record the filter being shown, replacing the previous one and any
+        steps run on the filtered table"""
+
+        self.clearFilter()
+        self.filtered = len(self.steps)
+        self.steps.append(step)
+        return
+
+    def clearFilter(self):
+        """Remove the filter when the unfiltered table is shown again"""
+
+        if self.filtered is not None:
+            del self.steps[self.filtered:]
+            self.filtered = None
+        return
+
+    def copy(self):
+        return Pipeline(self.steps)
+
+    def run(self, df):
+        """Replay the steps on a table"""
+
+        return run_steps(df, self.steps)
+
+    def toJSON(self):
+        return json.dumps({'steps': self.steps}, indent=1, default=str)
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            f.write(self.toJSON())
+        return
+
+    @classmethod
+    def fromJSON(cls, text):
+        return cls(json.loads(text)['steps'])
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as f:
+            return cls.fromJSON(f.read())
+
+
+def main():
+    """Run a saved pipeline on a file without the gui"""
+
+    from argparse import ArgumentParser
+    from . import fileio
+    parser = ArgumentParser(description='Run a tablexplore pipeline on a table')
+    parser.add_argument("pipeline", help="pipeline json file")
+    parser.add_argument("input", help="csv file")
+    parser.add_argument("output", help="output csv or xlsx file")
+    args = parser.parse_args()
+    pipeline = Pipeline.load(args.pipeline)
+    df = pd.read_csv(args.input)
+    df = pipeline.run(df)
+    fileio.export_dataframe(df, args.output)
+    print('%s steps, wrote %s rows to %s' %(len(pipeline), len(df), args.output))
+    return
+
+if __name__ == '__main__':
+    main()
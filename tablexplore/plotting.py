@@ -22,7 +22,7 @@
 """
 
 from __future__ import absolute_import, division, print_function
-import sys,os,random
+import sys,os,io,copy,random
 from collections import OrderedDict
 
 import matplotlib as mpl
@@ -121,6 +121,8 @@ class PlotViewer(QWidget):
         sizepolicy = QSizePolicy()
         self.setSizePolicy(QSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding))
         self.style = None
+        #incremented when the figure changes
+        self.version = 0
         return
 
     def addPlotWidget(self):
@@ -171,6 +173,7 @@ class PlotViewer(QWidget):
         self.fig = self.canvas.figure
         self.ax = self.canvas.ax
         self.canvas.draw()
+        self.version += 1
         return
 
     def createDialogs(self, parent):
@@ -319,6 +322,7 @@ class PlotViewer(QWidget):
 
         plot3d = self.generalopts.kwds['3D plot']
         self._initFigure()
+        self.version += 1
         if plot3d == 1:
             self.plot3D(redraw=redraw)
         else:
@@ -354,6 +358,7 @@ class PlotViewer(QWidget):
         self.canvas.draw()
         self.table.plotted=None
         self.gridaxes = {}
+        self.version += 1
         return
 
     def savePlot(self, filename=None):
@@ -1556,11 +1561,89 @@ class AxesOptions(BaseOptions):
         self.kwds = {}
         return
 
+def rowRuns(positions):
+    """Compress sorted row positions to a list of [start, stop) runs"""
+
+    positions = np.asarray(positions, dtype=np.int64)
+    if len(positions) == 0:
+        return []
+    breaks = np.where(np.diff(positions) != 1)[0] + 1
+    starts = positions[np.concatenate([[0], breaks])]
+    stops = positions[np.concatenate([breaks - 1, [len(positions) - 1]])] + 1
+    return [[int(a), int(b)] for a, b in zip(starts, stops)]
+
+
+class StoredPlot(object):
+    """A stored plot kept as a rendered png image together with the spec
+    needed to redraw it: the sheet, plotted columns, row ranges and the
+    plot options. Figures are only rebuilt from the spec when needed."""
+
+    def __init__(self, image, spec=None):
+        self.image = image
+        self.spec = spec
+        return
+
+    @classmethod
+    def fromFigure(cls, fig, spec=None, dpi=100):
+        """Render a figure to a stored plot"""
+
+        buf = io.BytesIO()
+        fig.savefig(buf, format='png', dpi=dpi)
+        return cls(buf.getvalue(), spec)
+
+    @classmethod
+    def fromViewer(cls, pf, sheet):
+        """Store the current plot of a plot viewer. The plotted data is
+        referenced by its row positions in the sheet table, this needs a
+        unique index, otherwise only the image is kept."""
+
+        pf.applyPlotoptions()
+        spec = None
+        data = getattr(pf, 'data', None)
+        df = pf.table.model.df
+        if data is not None and df.index.is_unique:
+            rows = df.index.get_indexer(data.index)
+            if (rows >= 0).all():
+                opts = {'generalopts': pf.generalopts.kwds, 'labelopts': pf.labelopts.kwds,
+                        'axesopts': pf.axesopts.kwds}
+                spec = {'sheet': sheet, 'columns': list(data.columns),
+                        'rows': rowRuns(np.sort(rows)), 'options': copy.deepcopy(opts)}
+        return cls.fromFigure(pf.fig, spec)
+
+    def getData(self, df):
+        """Get the plotted data from the sheet table, rows or columns no
+        longer present are skipped"""
+
+        runs = [np.arange(a, b) for a, b in self.spec['rows']]
+        rows = np.concatenate(runs) if len(runs) > 0 else np.array([], dtype=np.int64)
+        rows = rows[rows < len(df)]
+        cols = [c for c in self.spec['columns'] if c in df.columns]
+        return df.iloc[rows][cols]
+
+    def pixmap(self):
+        """Image as a QPixmap"""
+
+        pm = QPixmap()
+        pm.loadFromData(self.image, 'PNG')
+        return pm
+
+
+def toStoredPlots(plots):
+    """Convert stored figures from older projects to stored plots"""
+
+    for name in plots:
+        if isinstance(plots[name], Figure):
+            plots[name] = StoredPlot.fromFigure(plots[name])
+    return plots
+
+
 class PlotGallery(QWidget):
-    """Plot gallery class"""
-    def __init__(self, parent=None):
+    """Plot gallery showing thumbnails of stored plots. Opened plots show
+    the stored image, the figure is redrawn from its data when asked."""
+    def __init__(self, parent=None, app=None):
         super(PlotGallery, self).__init__(parent)
         self.parent = parent
+        self.app = app
         self.setMinimumSize(400,300)
         self.setGeometry(QtCore.QRect(300, 200, 800, 600))
         self.setWindowTitle("Saved Figures")
@@ -1571,16 +1654,18 @@ class PlotGallery(QWidget):
         return
 
     def createWidgets(self):
-        """Create widgets. Plot on left and dock for tools on right."""
+        """Create widgets. Thumbnails on top and opened plots below."""
 
         self.main = QTabWidget(self)
         self.main.setTabsClosable(True)
-        self.main.tabCloseRequested.connect(lambda index: self.remove(index))
+        self.main.tabCloseRequested.connect(lambda index: self.main.removeTab(index))
         layout = QVBoxLayout(self)
         toolbar = QToolBar("toolbar")
         layout.addWidget(toolbar)
         items = { 'save': {'action':self.save,'file':'save'},
                   'save all': {'action':self.saveAll,'file':'save-all'},
+                  'redraw': {'action':self.rebuild,'file':'plot'},
+                  'remove': {'action':self.remove,'file':'remove'},
                   'clear': {'action':self.clear,'file':'clear'}
                     }
         for i in items:
@@ -1592,45 +1677,108 @@ class PlotGallery(QWidget):
             btn = QAction(icon, i, self)
             btn.triggered.connect(items[i]['action'])
             toolbar.addAction(btn)
-        layout.addWidget(self.main)
+        splitter = QSplitter(QtCore.Qt.Vertical, self)
+        self.thumbs = QListWidget(splitter)
+        self.thumbs.setViewMode(QListView.IconMode)
+        self.thumbs.setIconSize(QtCore.QSize(160, 120))
+        self.thumbs.setResizeMode(QListView.Adjust)
+        self.thumbs.setMovement(QListView.Static)
+        self.thumbs.itemActivated.connect(lambda item: self.showPlot(item.text()))
+        splitter.addWidget(self.thumbs)
+        splitter.addWidget(self.main)
+        splitter.setSizes((150, 450))
+        layout.addWidget(splitter)
         return
 
     def update(self, plots):
-        """Display a dict of stored mpl figures"""
+        """Display thumbnails for a dict of stored plots"""
 
-        self.main.clear()
+        self.thumbs.clear()
         for name in plots:
-            fig = plots[name]
-            #fig.savefig(name+'.png')
-            pw = PlotWidget(self.main)
-            self.main.addTab(pw, name)
-            pw.figure = fig
-            pw.draw()
-            plt.tight_layout()
+            pm = plots[name].pixmap()
+            icon = QIcon(pm.scaled(160, 120, QtCore.Qt.KeepAspectRatio,
+                                   QtCore.Qt.SmoothTransformation))
+            self.thumbs.addItem(QListWidgetItem(icon, name))
+        #close opened plots that were removed
+        for i in reversed(range(self.main.count())):
+            if self.main.tabText(i) not in plots:
+                self.main.removeTab(i)
         self.plots = plots
         return
 
-    def remove(self, idx):
-        """Remove selected tab and figure"""
+    def showPlot(self, name):
+        """Show the full size image of a stored plot"""
+
+        for i in range(self.main.count()):
+            if self.main.tabText(i) == name:
+                self.main.setCurrentIndex(i)
+                return
+        area = QScrollArea(self.main)
+        label = QLabel()
+        label.setPixmap(self.plots[name].pixmap())
+        area.setWidget(label)
+        idx = self.main.addTab(area, name)
+        self.main.setCurrentIndex(idx)
+        return
+
+    def rebuild(self):
+        """Redraw the current plot from its data as an interactive figure"""
 
         index = self.main.currentIndex()
+        if index < 0:
+            return
         name = self.main.tabText(index)
-        del self.plots[name]
+        plot = self.plots[name]
+        fig = None
+        if self.app is not None and plot.spec is not None:
+            fig = self.app.rebuild_plot(plot)
+        if fig is None:
+            QMessageBox.information(self, "Cannot redraw",
+                                    "The data for this plot is not available.")
+            return
+        pw = PlotWidget(self.main)
+        pw.figure = fig
+        pw.draw()
         self.main.removeTab(index)
+        self.main.insertTab(index, pw, name)
+        self.main.setCurrentIndex(index)
+        return
+
+    def selectedName(self):
+        """Name of the plot selected in the thumbnails or opened"""
+
+        item = self.thumbs.currentItem()
+        if item is not None:
+            return item.text()
+        index = self.main.currentIndex()
+        if index >= 0:
+            return self.main.tabText(index)
+        return
+
+    def remove(self):
+        """Remove the selected plot"""
+
+        name = self.selectedName()
+        if name is None:
+            return
+        del self.plots[name]
+        self.update(self.plots)
         return
 
     def save(self):
         """Save selected figure"""
 
-        index = self.main.currentIndex()
-        name = self.main.tabText(index)
-        suff = "PNG files (*.png);;JPG files (*.jpg);;PDF files (*.pdf);;All files (*.*)"
+        name = self.selectedName()
+        if name is None:
+            return
+        suff = "PNG files (*.png);;All files (*.*)"
         filename, _ = QFileDialog.getSaveFileName(self, "Save Figure", name, suff)
         if not filename:
             return
-
-        fig = self.plots[name]
-        fig.savefig(filename+'.png', dpi=100)
+        if not filename.endswith('.png'):
+            filename += '.png'
+        with open(filename, 'wb') as f:
+            f.write(self.plots[name].image)
         return
 
     def saveAll(self):
@@ -1641,13 +1789,14 @@ class PlotGallery(QWidget):
         if not dir:
             return
         for name in self.plots:
-            fig = self.plots[name]
-            fig.savefig(os.path.join(dir,name+'.png'), dpi=100)
+            with open(os.path.join(dir,name+'.png'), 'wb') as f:
+                f.write(self.plots[name].image)
         return
 
     def clear(self):
         """Clear plots"""
 
         self.plots.clear()
+        self.thumbs.clear()
         self.main.clear()
         return
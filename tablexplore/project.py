@@ -0,0 +1,652 @@
+#!/usr/bin/env python
+"""
+    Project file reading and writing for tablexplore.
+    Created October 2026
+    Copyright (C) Damien Farrell
+
+    This program is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 3
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+    Version 2 project files are zip containers with one member per sheet
+    table, a json manifest holding sheet meta data and plot options and
+    separate members for stored figures:
+
+        manifest-0.json
+        sheets/0-0.parquet
+        sheets/0-0-subtable.parquet
+        plots/0-sheet-0.pkl
+        plots/0-0.pkl
+
+    Sheet tables are stored as parquet when pyarrow is available and as
+    pickles otherwise. Members are compressed with the codec set by CODEC,
+    parquet compresses internally and pickles are wrapped in a compressed
+    stream. The codec is recorded in the manifest and pickle streams are
+    also detected from their header when read. Saving again appends only the changed members and a
+    new manifest revision, the newest manifest describes the project.
+    Members no longer referenced are dropped when the file is compacted.
+    Version 1 files are a gzipped pickle of a dict.
+"""
+
+from __future__ import absolute_import, division, print_function
+import os, re, time, datetime, json, pickle, gzip, zipfile, tempfile
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from . import fileio
+
+VERSION = 2
+BUFSIZE = 1 << 20
+#compression codec for saving and its level, None uses the codec default
+CODEC = 'zstd'
+LEVEL = None
+
+def is_legacy(filename):
+    """Check if a project file is the old gzipped pickle format"""
+
+    with open(filename, 'rb') as f:
+        return f.read(2) == b'\x1f\x8b'
+
+def load_legacy(filename):
+    """Load a version 1 project, returns a dict of sheets"""
+
+    return pickle.load(gzip.GzipFile(filename, 'r'))
+
+def _parquet_table(df):
+    """Convert a dataframe to an arrow table for parquet, None if not possible"""
+
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return None
+    try:
+        return pa.Table.from_pandas(df)
+    except Exception as e:
+        #column names or mixed object types parquet cannot handle
+        print ('cannot store table as parquet, using pickle: %s' %e)
+        return None
+
+def get_codec(codec=None):
+    """Get the codec to use, falls back to gzip if the module for the
+    requested codec is not installed"""
+
+    if codec is None:
+        codec = CODEC
+    if codec not in fileio.codecs:
+        raise ValueError('unknown codec %s' %codec)
+    if codec not in fileio.available_codecs():
+        print ('%s not available, using gzip' %codec)
+        codec = 'gzip'
+    return codec
+
+def _parquet_codec(codec):
+    """Check if parquet can use the codec"""
+
+    import pyarrow as pa
+    return codec == 'none' or pa.Codec.is_available(codec)
+
+def _open_stream(fh, mode, codec, level=None):
+    """Wrap a zip member in a compressed stream"""
+
+    if codec in [None, 'none']:
+        return fh
+    return fileio.open_compressed(fh, mode, codec, level)
+
+def write_table(zf, member, df, codec='none', level=None, callback=None):
+    """Write a dataframe to a zip member, the extension is added to the
+    member name. Returns the member name and format used.
+    Args:
+        callback: function called with (rows written, total rows)
+    """
+
+    n = len(df)
+    table = _parquet_table(df)
+    if table is not None and _parquet_codec(codec):
+        import pyarrow.parquet as pq
+        member += '.parquet'
+        with zf.open(member, 'w', force_zip64=True) as fh:
+            # one row group per chunk so progress can be reported
+            with pq.ParquetWriter(fh, table.schema, compression=codec,
+                                  compression_level=level) as writer:
+                for start, end in fileio._chunks(n, fileio.CHUNKSIZE):
+                    writer.write_table(table.slice(start, end - start))
+                    if callback is not None:
+                        callback(end, n)
+        if n == 0 and callback is not None:
+            callback(0, 0)
+        return member, 'parquet'
+    member += '.pkl'
+    with zf.open(member, 'w', force_zip64=True) as fh:
+        with _open_stream(fh, 'wb', codec, level) as f:
+            df.to_pickle(f, compression=None)
+    if callback is not None:
+        callback(n, n)
+    return member, 'pickle'
+
+def read_table(fh, fmt):
+    """Read a dataframe from a file handle"""
+
+    if fmt == 'parquet':
+        return pd.read_parquet(fh)
+    with _open_stream(fh, 'rb', fileio.detect_compression(fh)) as f:
+        return pd.read_pickle(f, compression=None)
+
+class Pickled(object):
+    """An object pickled in advance, used to copy figures on the GUI
+    thread before they are written in a worker"""
+
+    def __init__(self, obj):
+        self.data = pickle.dumps(obj)
+        return
+
+def write_object(zf, member, obj, codec='none', level=None):
+    """Pickle an object such as a figure to a zip member"""
+
+    with zf.open(member, 'w', force_zip64=True) as fh:
+        with _open_stream(fh, 'wb', codec, level) as f:
+            if isinstance(obj, Pickled):
+                f.write(obj.data)
+            else:
+                pickle.dump(obj, f)
+    return member
+
+def read_object(fh):
+    """Unpickle an object from a file handle"""
+
+    with _open_stream(fh, 'rb', fileio.detect_compression(fh)) as f:
+        return pickle.load(f)
+
+def _to_json(obj):
+    """Encode values the json module cannot, used when writing the manifest.
+    Numpy values become python values, timestamps and timedeltas are tagged
+    so they are read back as the same type. Anything else raises a TypeError
+    rather than being stored as a string."""
+
+    if isinstance(obj, (datetime.datetime, np.datetime64)):
+        return {'__timestamp__': pd.Timestamp(obj).isoformat()}
+    if isinstance(obj, (datetime.timedelta, np.timedelta64)):
+        return {'__timedelta__': pd.Timedelta(obj).isoformat()}
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError('cannot store %s in the project manifest' %type(obj).__name__)
+
+def _from_json(d):
+    """Decode the values tagged by _to_json"""
+
+    if len(d) == 1:
+        if '__timestamp__' in d:
+            return pd.Timestamp(d['__timestamp__'])
+        if '__timedelta__' in d:
+            return pd.Timedelta(d['__timedelta__'])
+    return d
+
+def _split_meta(meta):
+    """Separate dataframes and figures from the json serializable meta data"""
+
+    if meta is None:
+        return None, None, None
+    meta = dict(meta)
+    subtable = meta.pop('subtable', None)
+    fig = None
+    if 'plotviewer' in meta:
+        pv = meta['plotviewer'] = dict(meta['plotviewer'])
+        fig = pv.pop('fig', None)
+    return meta, subtable, fig
+
+
+def table_size(df):
+    """Approximate size of a dataframe in bytes, used for progress"""
+
+    return int(df.memory_usage(index=True).sum())
+
+
+class Cancelled(Exception):
+    """Raised in a save that was cancelled"""
+
+
+class Progress(object):
+    """Progress of saving or loading a project. Reported to a callback as
+    a dict with the sheets and bytes done and their totals, the throughput
+    in bytes/s, elapsed and estimated remaining seconds and the percentage
+    done. Extra keywords given to update are added to the dict. If cancel,
+    a threading.Event, is set the next update raises Cancelled."""
+
+    def __init__(self, callback, sheets, nbytes, interval=0.1, cancel=None):
+        self.callback = callback
+        self.cancel = cancel
+        self.total_sheets = sheets
+        self.total_bytes = nbytes
+        self.sheets = 0
+        self.bytes = 0
+        self.interval = interval
+        self.start = time.time()
+        self.last = 0
+        return
+
+    def update(self, nbytes=0, sheets=0, **kwargs):
+        """Add bytes and sheets done and report, updates within a sheet
+        are reported at most once per interval"""
+
+        if self.cancel is not None and self.cancel.is_set():
+            raise Cancelled('save cancelled')
+        self.bytes += nbytes
+        self.sheets += sheets
+        if self.callback is None:
+            return
+        now = time.time()
+        if sheets == 0 and len(kwargs) == 0 and now - self.last < self.interval:
+            return
+        self.last = now
+        elapsed = now - self.start
+        if self.total_bytes > 0:
+            frac = min(self.bytes / self.total_bytes, 1)
+        else:
+            frac = self.sheets / max(self.total_sheets, 1)
+        eta = None
+        if frac > 0:
+            eta = elapsed * (1 - frac) / frac
+        info = {'sheets': self.sheets, 'total_sheets': self.total_sheets,
+                'bytes': self.bytes, 'total_bytes': self.total_bytes,
+                'rate': self.bytes / elapsed if elapsed > 0 else 0,
+                'elapsed': elapsed, 'eta': eta, 'percent': int(frac * 100)}
+        info.update(kwargs)
+        self.callback(info)
+        return
+
+    def rows(self, nbytes):
+        """Callback for write_table that reports a share of nbytes for
+        the rows written"""
+
+        done = [0]
+        def func(rows, total):
+            b = nbytes * rows // total if total > 0 else nbytes
+            self.update(b - done[0])
+            done[0] = b
+        return func
+
+
+class Stored(object):
+    """Reference to a sheet or plot already written to a project file,
+    used to save it again without serializing the data"""
+
+    def __init__(self, pf, entry):
+        self.pf = pf
+        self.entry = entry
+        return
+
+    def members(self):
+        """Names of the zip members used"""
+
+        if 'file' in self.entry:
+            return [self.entry['file']]
+        return [self.entry[k] for k in ['data', 'subtable', 'figure'] if k in self.entry]
+
+    def size(self):
+        """Size of the stored members in bytes"""
+
+        with zipfile.ZipFile(self.pf.filename, 'r') as zf:
+            return sum(zf.getinfo(m).file_size for m in self.members())
+
+    def copy(self, zf, member, newname, progress=None):
+        """Copy a member of the stored file to another zip without decompressing"""
+
+        newname += os.path.splitext(member)[1]
+        with zipfile.ZipFile(self.pf.filename, 'r') as src:
+            with src.open(member) as fsrc, zf.open(newname, 'w', force_zip64=True) as fdst:
+                while True:
+                    buf = fsrc.read(BUFSIZE)
+                    if not buf:
+                        break
+                    fdst.write(buf)
+                    if progress is not None:
+                        progress.update(len(buf))
+        return newname
+
+
+def _write_members(zf, data, rev, inplace=False, codec='none', level=None, info=None,
+                   progress=None):
+    """Write sheets and plots to an open zip and return the manifest.
+    Stored references are kept as they are if inplace is True, meaning
+    the zip is their own file, otherwise their members are copied."""
+
+    if progress is None:
+        progress = Progress(None, 0, 0)
+    manifest = {'format': 'txpl', 'version': VERSION, 'revision': rev,
+                'codec': codec, 'level': level, 'info': info, 'sheets': [], 'plots': []}
+    i = 0
+    for name in data:
+        if name in ['meta', 'plots']:
+            continue
+        sheet = data[name]
+        prefix = 'sheets/%s-%s' %(rev, i)
+        if 'stored' in sheet:
+            ref = sheet['stored']
+            entry = dict(ref.entry)
+            meta = sheet['meta'] if 'meta' in sheet else entry.get('meta')
+            entry['meta'] = _split_meta(meta)[0]
+            if inplace == False:
+                entry['data'] = ref.copy(zf, entry['data'], prefix, progress)
+                if 'subtable' in entry:
+                    entry['subtable'] = ref.copy(zf, entry['subtable'], prefix+'-subtable', progress)
+                if 'figure' in entry:
+                    entry['figure'] = ref.copy(zf, entry['figure'],
+                                               'plots/%s-sheet-%s' %(rev, i), progress)
+        else:
+            entry = {'codec': codec}
+            df = sheet['table']
+            entry['data'], entry['format'] = write_table(zf, prefix, df, codec, level,
+                                                         progress.rows(table_size(df)))
+            meta, subtable, fig = _split_meta(sheet.get('meta'))
+            if subtable is not None:
+                entry['subtable'], entry['subtable_format'] = \
+                    write_table(zf, prefix+'-subtable', subtable, codec, level,
+                                progress.rows(table_size(subtable)))
+            if fig is not None:
+                entry['figure'] = write_object(zf, 'plots/%s-sheet-%s.pkl' %(rev, i),
+                                               fig, codec, level)
+            entry['meta'] = meta
+        entry['name'] = name
+        manifest['sheets'].append(entry)
+        progress.update(sheets=1)
+        i += 1
+
+    plots = data.get('plots') or {}
+    for i, label in enumerate(plots):
+        p = plots[label]
+        if isinstance(p, Stored):
+            entry = dict(p.entry)
+            if inplace == False:
+                entry['file'] = p.copy(zf, entry['file'], 'plots/%s-%s' %(rev, i), progress)
+        else:
+            entry = {'codec': codec,
+                     'file': write_object(zf, 'plots/%s-%s.pkl' %(rev, i), p, codec, level)}
+        entry['name'] = label
+        manifest['plots'].append(entry)
+    zf.writestr('manifest-%s.json' %rev, json.dumps(manifest, indent=1, default=_to_json))
+    return manifest
+
+def _write_project(filename, data, **kwargs):
+    """Write the whole project to a new file that replaces filename"""
+
+    path = os.path.dirname(os.path.abspath(filename))
+    fd, tmpname = tempfile.mkstemp(suffix='.tmp', dir=path)
+    os.close(fd)
+    try:
+        with zipfile.ZipFile(tmpname, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+            _write_members(zf, data, 0, **kwargs)
+        os.replace(tmpname, filename)
+    finally:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+    return
+
+def _undo_name(filename):
+    return filename + '.undo'
+
+def needs_recovery(filename):
+    """Check if an incremental save of filename was interrupted"""
+
+    return os.path.exists(_undo_name(filename))
+
+def recover(filename):
+    """Roll back an interrupted incremental save. Appending overwrites the
+    zip central directory, so it is kept in an undo file until the save
+    completes. Returns True if the file was restored. This is only done
+    when saving or when asked for, opening a file never changes it."""
+
+    undo = _undo_name(filename)
+    if not os.path.exists(undo):
+        return False
+    with open(undo, 'rb') as f:
+        offset = int.from_bytes(f.read(8), 'little')
+        tail = f.read()
+    if len(tail) > 0:
+        with open(filename, 'r+b') as f:
+            f.truncate(offset)
+            f.seek(offset)
+            f.write(tail)
+    os.remove(undo)
+    print ('restored %s after an incomplete save' %filename)
+    return True
+
+def _append_project(filename, data, rev, **kwargs):
+    """Append changed members and a new manifest to an existing project"""
+
+    with zipfile.ZipFile(filename, 'r') as zf:
+        offset = zf.start_dir
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        tail = f.read()
+    undo = _undo_name(filename)
+    with open(undo + '.tmp', 'wb') as f:
+        f.write(offset.to_bytes(8, 'little'))
+        f.write(tail)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(undo + '.tmp', undo)
+    try:
+        with zipfile.ZipFile(filename, 'a', zipfile.ZIP_STORED, allowZip64=True) as zf:
+            _write_members(zf, data, rev, inplace=True, **kwargs)
+        with open(filename, 'rb') as f:
+            os.fsync(f.fileno())
+    except BaseException:
+        recover(filename)
+        raise
+    os.remove(undo)
+    return
+
+def _save_progress(data, callback, inplace, cancel=None):
+    """Progress for a save, the total is the in memory size of the tables
+    written and the size of stored members to be copied"""
+
+    nbytes = 0
+    sheets = 0
+    for name in data:
+        if name in ['meta', 'plots']:
+            continue
+        sheet = data[name]
+        sheets += 1
+        if 'stored' in sheet:
+            if inplace == False:
+                nbytes += sheet['stored'].size()
+            continue
+        nbytes += table_size(sheet['table'])
+        subtable = _split_meta(sheet.get('meta'))[1]
+        if subtable is not None:
+            nbytes += table_size(subtable)
+    return Progress(callback, sheets, nbytes, cancel=cancel)
+
+def _stored_refs(data):
+    """Get the stored references in project data"""
+
+    refs = [data[n]['stored'] for n in data
+            if n not in ['meta', 'plots'] and 'stored' in data[n]]
+    plots = data.get('plots') or {}
+    refs.extend([p for p in plots.values() if isinstance(p, Stored)])
+    return refs
+
+def _can_append(filename, refs):
+    """Check if changes can be appended to filename. All stored references
+    must be to the latest revision of this file and the space taken by
+    unreferenced members must be less than that still in use."""
+
+    if len(refs) == 0 or not os.path.exists(filename) or not zipfile.is_zipfile(filename):
+        return False
+    for ref in refs:
+        if not os.path.samefile(ref.pf.filename, filename):
+            return False
+    latest = ProjectFile(filename).revision
+    if any(ref.pf.revision != latest for ref in refs):
+        return False
+    members = set()
+    for ref in refs:
+        members.update(ref.members())
+    with zipfile.ZipFile(filename, 'r') as zf:
+        live = sum(zf.getinfo(m).compress_size for m in members)
+    garbage = os.path.getsize(filename) - live
+    return garbage < live
+
+def save_project(filename, data, codec=None, level=None, info=None, callback=None,
+                 cancel=None):
+    """Save a project as a version 2 container. Sheets and plots given as
+    Stored references to the same file are kept and only the changed members
+    and a new manifest are appended. Otherwise the whole file is written.
+    Args:
+        filename: project file
+        data: dict of sheets, each a dict with a 'table' dataframe or a
+              'stored' reference and a 'meta' dict, and stored plots under
+              the 'plots' key as figures or Stored references
+        codec: compression codec, one of fileio.codecs, default is CODEC
+        level: compression level in the range for the codec in fileio.levels,
+               default is LEVEL
+        info: json serializable dict stored in the manifest
+        callback: function called with progress dicts, see Progress
+        cancel: threading.Event that stops the save when set, raising
+                Cancelled and leaving the file as it was
+    Returns:
+        a ProjectFile for the saved file
+    """
+
+    requested = codec or CODEC
+    codec = get_codec(codec)
+    if level is None:
+        level = LEVEL
+    #a level for the requested codec may not suit the fallback
+    level = fileio.compression_level(codec, level, clamp=codec != requested)
+    if os.path.exists(filename):
+        recover(filename)
+    refs = _stored_refs(data)
+    append = _can_append(filename, refs)
+    kwargs = {'codec': codec, 'level': level, 'info': info}
+    if callback is not None or cancel is not None:
+        progress = kwargs['progress'] = _save_progress(data, callback, append, cancel)
+        # stops here if cancelled before anything is written
+        progress.update()
+    if append:
+        rev = refs[0].pf.revision + 1
+        _append_project(filename, data, rev, **kwargs)
+    else:
+        _write_project(filename, data, **kwargs)
+    return ProjectFile(filename)
+
+
+class ProjectFile(object):
+    """Read access to a version 2 project file. Only the manifest is read
+    when opened, sheet tables and figures are read when requested."""
+
+    def __init__(self, filename):
+
+        self.filename = filename
+        with zipfile.ZipFile(filename, 'r') as zf:
+            revs = {}
+            for n in zf.namelist():
+                m = re.match(r'manifest-(\d+)\.json$', n)
+                if m:
+                    revs[int(m.group(1))] = n
+            self.revision = max(revs)
+            self.manifest = json.loads(zf.read(revs[self.revision]).decode('utf-8'),
+                                       object_hook=_from_json)
+        self.sheets = OrderedDict((s['name'], s) for s in self.manifest['sheets'])
+        self.plots = OrderedDict((p['name'], p) for p in self.manifest['plots'])
+        self.info = self.manifest.get('info')
+        return
+
+    def _open(self, member):
+        """Open a member, the zip is opened per read so the file is not held
+        open and reads can be done from worker threads"""
+
+        zf = zipfile.ZipFile(self.filename, 'r')
+        return zf, zf.open(member)
+
+    def _read_table(self, member, fmt):
+        zf, fh = self._open(member)
+        with zf, fh:
+            return read_table(fh, fmt)
+
+    def _read_object(self, member):
+        zf, fh = self._open(member)
+        with zf, fh:
+            return read_object(fh)
+
+    def sheet_size(self, name):
+        """Size of a stored sheet table in bytes"""
+
+        with zipfile.ZipFile(self.filename, 'r') as zf:
+            return zf.getinfo(self.sheets[name]['data']).file_size
+
+    def load(self, callback=None, names=None):
+        """Read sheet tables in order, each is passed to the callback with
+        the progress as the 'sheet' and 'table' keys when read"""
+
+        if names is None:
+            names = list(self.sheets.keys())
+        with zipfile.ZipFile(self.filename, 'r') as zf:
+            sizes = {n: zf.getinfo(self.sheets[n]['data']).file_size for n in names}
+        progress = Progress(callback, len(names), sum(sizes.values()))
+        for name in names:
+            df = self.read_sheet(name)
+            progress.update(sizes[name], sheets=1, sheet=name, table=df)
+        return
+
+    def read_sheet(self, name):
+        """Read the table for a sheet"""
+
+        entry = self.sheets[name]
+        return self._read_table(entry['data'], entry['format'])
+
+    def read_meta(self, name):
+        """Read the meta data for a sheet including subtable and figure"""
+
+        entry = self.sheets[name]
+        meta = entry.get('meta')
+        if meta is None:
+            return None
+        meta = dict(meta)
+        if 'subtable' in entry:
+            meta['subtable'] = self._read_table(entry['subtable'], entry['subtable_format'])
+        if 'figure' in entry and 'plotviewer' in meta:
+            meta['plotviewer'] = dict(meta['plotviewer'])
+            meta['plotviewer']['fig'] = self._read_object(entry['figure'])
+        return meta
+
+    def read_plots(self):
+        """Read the stored plots"""
+
+        plots = OrderedDict()
+        for name in self.plots:
+            plots[name] = self._read_object(self.plots[name]['file'])
+        return plots
+
+    def stored(self, name):
+        """Reference to a sheet in this file for saving it again unchanged"""
+
+        return Stored(self, self.sheets[name])
+
+    def stored_plot(self, name):
+        """Reference to a stored plot in this file"""
+
+        return Stored(self, self.plots[name])
+
+
+def open_project(filename):
+    """Open a project file. Returns a ProjectFile for version 2 files and
+    the dict of sheets for legacy files. A file left by an interrupted
+    save should be restored with recover first."""
+
+    if zipfile.is_zipfile(filename):
+        return ProjectFile(filename)
+    elif is_legacy(filename):
+        return load_legacy(filename)
+    raise ValueError('%s is not a project file' %filename)
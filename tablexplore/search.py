@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+"""
+    Text search index for tablexplore.
+    Created October 2026
+    Copyright (C) Damien Farrell
+
+    This program is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 3
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+    Each column is factorized so its text is only searched once per distinct
+    value. Trigram and word postings over the distinct values give the
+    candidates for a query, which are then checked against the text.
+    Rows are found from the matching values through the column codes.
+"""
+
+from __future__ import absolute_import, division, print_function
+import re, threading
+import numpy as np
+import pandas as pd
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+#minimum length of a literal used to look up candidates
+NGRAM = 3
+
+def _text(values):
+    """Text of values as shown by astype(str)"""
+
+    return pd.Series(values, dtype=object).astype(str).tolist()
+
+def ngrams(text):
+    """Overlapping trigrams of a string"""
+
+    return [text[i:i+NGRAM] for i in range(len(text) - NGRAM + 1)]
+
+def tokens(text):
+    """Words in a string"""
+
+    return re.findall(r'\w+', text)
+
+
+class Postings(object):
+    """Sorted arrays of value ids for each key, stored contiguously. Keys
+    added after building are kept in a small dict of lists."""
+
+    def __init__(self, keys, ids):
+
+        pairs = pd.DataFrame({'key': keys, 'id': ids}).drop_duplicates()
+        codes, uniques = pd.factorize(pairs.key.values)
+        order = np.argsort(codes, kind='stable')
+        self.ids = pairs.id.values[order].astype(np.int64)
+        counts = np.bincount(codes, minlength=len(uniques))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.keys = dict(zip(uniques, range(len(uniques))))
+        self.added = {}
+        return
+
+    def get(self, key):
+        """Ids for a key"""
+
+        if key in self.keys:
+            i = self.keys[key]
+            ids = self.ids[self.offsets[i]:self.offsets[i+1]]
+        else:
+            ids = np.array([], dtype=np.int64)
+        if key in self.added:
+            ids = np.union1d(ids, self.added[key])
+        return ids
+
+    def add(self, key, id):
+        self.added.setdefault(key, []).append(id)
+        return
+
+
+class ColumnIndex(object):
+    """Index of the distinct text values of a column"""
+
+    def __init__(self, values):
+
+        codes, uniques = pd.factorize(values)
+        self.text = _text(uniques)
+        codes = codes.astype(np.int64)
+        if (codes < 0).any():
+            # missing values are shown as nan
+            codes[codes < 0] = len(self.text)
+            self.text.append('nan')
+        self.codes = codes
+        lower = pd.Series(self.text, dtype=object).str.lower()
+        self.grams = self._build(lower.str.findall('(?=(.{%s}))' %NGRAM, flags=re.S))
+        self.words = self._build(lower.str.findall(r'\w+'))
+        return
+
+    def _build(self, lists):
+        keys = lists.explode().dropna()
+        return Postings(keys.values, keys.index.values)
+
+    def setValue(self, row, value):
+        """Update the text of a cell"""
+
+        text = _text([value])[0]
+        uid = len(self.text)
+        self.text.append(text)
+        self.codes[row] = uid
+        lower = text.lower()
+        for g in set(ngrams(lower)):
+            self.grams.add(g, uid)
+        for w in set(tokens(lower)):
+            self.words.add(w, uid)
+        return
+
+    def candidates(self, literal=None, word=None):
+        """Ids of values that may contain a literal or a word, None if
+        every value is a candidate"""
+
+        if word is not None:
+            return self.words.get(word.lower())
+        if literal is None or len(literal) < NGRAM:
+            return None
+        ids = None
+        for g in set(ngrams(literal.lower())):
+            p = self.grams.get(g)
+            ids = p if ids is None else np.intersect1d(ids, p, assume_unique=True)
+            if len(ids) == 0:
+                break
+        return ids
+
+    def match(self, func, ids=None):
+        """Ids of values for which func(text) is true"""
+
+        text = self.text
+        if ids is None:
+            ids = range(len(text))
+        return np.array([i for i in ids if func(text[i])], dtype=np.int64)
+
+    def rows(self, ids):
+        """Row mask for a set of value ids"""
+
+        lookup = np.zeros(len(self.text), dtype=bool)
+        lookup[ids] = True
+        return lookup[self.codes]
+
+
+def _literal(pattern):
+    """Longest literal that any match of a regex must contain, None if
+    there is no such literal. Only top level literals are used."""
+
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception:
+        return None
+    best = ''
+    current = ''
+    for op, av in parsed:
+        if op == sre_parse.LITERAL:
+            current += chr(av)
+        else:
+            best = max(best, current, key=len)
+            current = ''
+    best = max(best, current, key=len)
+    if len(best) < NGRAM:
+        return None
+    return best
+
+
+class TextIndex(object):
+    """Search index for the text of a dataframe. version is the data
+    version it was built for, see DataFrameModel.version."""
+
+    def __init__(self, df, version=None):
+
+        self.version = version
+        self.columns = [ColumnIndex(df.iloc[:, j]) for j in range(df.shape[1])]
+        self.nrows = len(df)
+        return
+
+    def setValue(self, row, col, value):
+        """Update the index after a cell is edited"""
+
+        self.columns[col].setValue(row, value)
+        return
+
+    def _keyword(self, column, keyword, case, word):
+        """Ids of values matching a keyword in a column"""
+
+        if word:
+            pat = re.compile(r'\b%s\b' %re.escape(keyword), 0 if case else re.I)
+            simple = re.match(r'^\w+$', keyword) is not None
+            ids = column.candidates(word=keyword) if simple else column.candidates(literal=keyword)
+            return column.match(lambda t: pat.search(t) is not None, ids)
+        ids = column.candidates(literal=keyword)
+        if case:
+            return column.match(lambda t: keyword in t, ids)
+        kw = keyword.lower()
+        return column.match(lambda t: kw in t.lower(), ids)
+
+    def _cells(self, keywords=None, operator='OR', case=False, word=False,
+               regex=None, columns=None, cancel=None):
+        """Column positions and row masks of matching cells"""
+
+        if columns is None:
+            columns = range(len(self.columns))
+        if regex is not None:
+            pat = re.compile(regex, 0 if case else re.I)
+            literal = _literal(regex)
+        for j in columns:
+            if cancel is not None and cancel.is_set():
+                break
+            column = self.columns[j]
+            if regex is not None:
+                ids = column.match(lambda t: pat.search(t) is not None,
+                                   column.candidates(literal=literal))
+            else:
+                ids = None
+                for kw in keywords:
+                    found = self._keyword(column, kw, case, word)
+                    if ids is None:
+                        ids = found
+                    elif operator == 'AND':
+                        ids = np.intersect1d(ids, found)
+                    else:
+                        ids = np.union1d(ids, found)
+                if ids is None:
+                    continue
+            if len(ids) > 0:
+                yield j, column.rows(ids)
+        return
+
+    def search(self, keywords=None, operator='OR', case=False, word=False,
+               regex=None, columns=None, cancel=None):
+        """Find rows where a cell matches the query.
+        Args:
+            keywords: list of literal strings
+            operator: 'OR' if any keyword should be found in a cell,
+                      'AND' if all should be found in the same cell
+            case: case sensitive
+            word: match whole words only
+            regex: regular expression, used instead of keywords
+            columns: column positions to search, default is all
+            cancel: threading.Event, checked before each column
+        Returns:
+            boolean numpy array of matching rows
+        """
+
+        mask = np.zeros(self.nrows, dtype=bool)
+        for j, rows in self._cells(keywords, operator, case, word, regex, columns, cancel):
+            mask |= rows
+        return mask
+
+    def hits(self, keywords=None, operator='OR', case=False, word=False,
+             regex=None, columns=None, cancel=None):
+        """Find matching cells, arguments are as for search.
+        Returns:
+            int32 array of (row, column) positions ordered by row
+        """
+
+        found = []
+        for j, rows in self._cells(keywords, operator, case, word, regex, columns, cancel):
+            pos = np.flatnonzero(rows)
+            cells = np.empty((len(pos), 2), dtype=np.int32)
+            cells[:, 0] = pos
+            cells[:, 1] = j
+            found.append(cells)
+        if len(found) == 0:
+            return np.zeros((0, 2), dtype=np.int32)
+        cells = np.concatenate(found)
+        return cells[np.argsort(cells[:, 0], kind='stable')]
+
+
+_lock = threading.Lock()
+
+def get_index(holder, df, version=None):
+    """Get the search index kept on an object such as a DataFrameModel,
+    it is built if missing or out of date. df may be a function returning
+    the table so it is only read when needed. Safe to call from a worker
+    thread, a caller waits for an index that is already being built."""
+
+    with _lock:
+        if not hasattr(holder, '_indexlock'):
+            holder._indexlock = threading.Lock()
+    with holder._indexlock:
+        index = getattr(holder, 'textindex', None)
+        if index is None or index.version != version:
+            if callable(df):
+                df = df()
+            index = TextIndex(df, version)
+            holder.textindex = index
+    return index
@@ -41,6 +41,38 @@ def check_multiindex(index):
     else:
         return 0
 
+def copy_on_write():
+    """Check if pandas copy on write is enabled, it is always on from pandas 3"""
+
+    if int(pd.__version__.split('.')[0]) >= 3:
+        return True
+    try:
+        return pd.options.mode.copy_on_write is True
+    except Exception:
+        return False
+
+def enable_copy_on_write():
+    """Turn on pandas copy on write if available, so tables can be
+    snapshot cheaply for saving in the background"""
+
+    if not copy_on_write():
+        try:
+            pd.set_option('mode.copy_on_write', True)
+        except Exception:
+            pass
+    return copy_on_write()
+
+def snapshot(df, maxsize=None):
+    """Copy of a dataframe that is not affected by later edits to it.
+    With copy on write this is a cheap shallow copy, otherwise the data is
+    copied unless it is larger than maxsize bytes, then None is returned."""
+
+    if copy_on_write():
+        return df.copy(deep=False)
+    if maxsize is not None and df.memory_usage(index=True).sum() > maxsize:
+        return None
+    return df.copy()
+
 def getAttributes(obj):
     """Get non hidden and built-in type object attributes that can be persisted"""
 
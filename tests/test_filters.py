@@ -0,0 +1,112 @@
+"""
+    Tests for table filtering.
+"""
+
+import itertools
+import numpy as np
+import pandas as pd
+import pytest
+from tablexplore import filters
+
+def make_table(n=200):
+    r = np.random.RandomState(4)
+    df = pd.DataFrame({'x': r.normal(size=n).round(2),
+                       'n': r.randint(0, 20, n),
+                       'name': r.choice(['alpha', 'beta', 'Gamma', 'delta', '12'], n)})
+    df.loc[df.index[::7], 'name'] = None
+    df.loc[df.index[::11], 'x'] = np.nan
+    return df
+
+def chain(masks, ops, start):
+    """Combine masks one at a time as the filter dialog used to"""
+
+    mask = start
+    for m, b in zip(masks, ops):
+        if b == 'AND':
+            mask = mask & m
+        elif b == 'OR':
+            mask = mask | m
+        elif b == 'NOT':
+            mask = mask ^ m
+    return mask
+
+@pytest.mark.parametrize('first', [False, True])
+def test_compile_filters(first):
+    r = np.random.RandomState(2)
+    n = 50
+    for k in range(1, 4):
+        for ops in itertools.product(filters.booleanops, repeat=k):
+            masks = {'m%s' %i: r.rand(n) > 0.5 for i in range(k)}
+            start = r.rand(n) > 0.5 if first else np.ones(n, dtype=bool)
+            masks['q' if first else 't'] = start
+            expr = filters.compile_filters(ops, first)
+            result = filters.evaluate(expr, masks)
+            expected = chain([masks['m%s' %i] for i in range(k)], ops, start)
+            assert np.array_equal(result, expected), expr
+
+def test_compile_no_filters():
+    assert filters.compile_filters([]) == 't'
+    assert filters.compile_filters([], first=True) == 'q'
+
+def test_apply_filters():
+    df = make_table()
+    terms = [('x', '0', '>', 'AND'), ('name', 'a', 'contains', 'OR'),
+             ('n', '5', 'not equals', 'NOT'), ('name', 'be', 'starts with', 'AND')]
+    m = filters.apply_filters(df, terms)
+    masks = [df.x > 0, df.name.str.contains('a').fillna(False), df.n != 5,
+             df.name.str.startswith('be').fillna(False)]
+    expected = chain(masks, [t[3] for t in terms], np.ones(len(df), dtype=bool))
+    assert np.array_equal(m, expected.values)
+
+def test_apply_filters_query():
+    df = make_table()
+    terms = [('name', 'beta', 'equals', 'OR')]
+    m = filters.apply_filters(df, terms, query='n > 10')
+    expected = (df.n > 10) | (df.name == 'beta')
+    assert np.array_equal(m, expected.values)
+    assert filters.apply_filters(df, []) is None
+
+def test_mask_cache():
+    df = make_table()
+    cache = filters.MaskCache()
+    terms = [('n', '5', '>', 'AND')]
+    m1 = filters.apply_filters(df, terms, cache=cache, versions={'n': 1})
+    df.loc[:, 'n'] = 0
+    #same version reuses the cached mask
+    m2 = filters.apply_filters(df, terms, cache=cache, versions={'n': 1})
+    assert np.array_equal(m1, m2)
+    m3 = filters.apply_filters(df, terms, cache=cache, versions={'n': 2})
+    assert not m3.any()
+
+def index_columns():
+    df = make_table()
+    r = np.random.RandomState(5)
+    dates = pd.Series(pd.date_range('2020-01-01', periods=len(df), freq='D'))
+    dates[::9] = pd.NaT
+    return {'x': df.x, 'n': df.n, 'name': df.name, 'dates': dates.sample(frac=1, random_state=r),
+            'digits': pd.Series(r.randint(0, 30, len(df)).astype(str)),
+            'arrow': df.name.astype(pd.StringDtype('pyarrow'))}
+
+@pytest.mark.parametrize('col', ['x', 'n', 'name', 'dates', 'digits', 'arrow'])
+def test_sorted_index(col):
+    s = index_columns()[col]
+    index = filters.SortedIndex.create(s)
+    assert index is not None
+    values = ['0', '5', '12', '-1.5', 'beta', 'b', 'zz', '2020-03-01', '2020']
+    for op in filters.SortedIndex.operators:
+        for val in values:
+            m = index.mask(op, val)
+            if m is None:
+                continue
+            assert np.array_equal(m, filters.column_mask(s, op, val)), (op, val)
+
+def test_sorted_index_terms():
+    #numeric looking terms compare as text in string columns on both paths
+    s = pd.Series(['10', '9', 'abc', None, '5'])
+    index = filters.SortedIndex.create(s)
+    for op in ['>', '<']:
+        assert np.array_equal(index.mask(op, '5'), filters.column_mask(s, op, '5'))
+    assert list(filters.column_mask(s, '>', '5')) == [False, True, True, False, False]
+    #terms that can't be converted are left to column_mask
+    assert filters.SortedIndex.create(pd.Series([1, 2])).mask('>', 'a') is None
+    assert filters.SortedIndex.create(pd.Series([True, False])) is None
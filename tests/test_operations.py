@@ -0,0 +1,361 @@
+"""
+    Tests for table operations, compared with the pandas calls they replace.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from tablexplore import filters, operations
+
+numbers = ['1', '-2.5', '+3', '.5', '5.', '1e3', '2E-2', ' 7 ', 'inf', '-Infinity', 'nan',
+           '$1,200.50', '£30', '€4', '(12)', '($5.25)', '1,000', 'abc', '12kg', 'x9y', '',
+           '1.2.3', '--4', None, np.nan]
+
+def make_column(n=500, seed=1):
+    r = np.random.RandomState(seed)
+    return pd.Series(r.choice(np.array(numbers, dtype=object), n), name='x')
+
+def old_numeric(x, convtype='float', currency=False, removetext=False, fillempty=False):
+    """Conversion as done before with pandas"""
+
+    if fillempty == 1:
+        x = x.fillna(0)
+    if currency == 1:
+        x = x.replace(r'[\$\£\€,)]', '', regex=True).replace('[(]', '-', regex=True)
+    if removetext == 1:
+        x = x.replace(r'[^\d.]+', '', regex=True)
+    return pd.to_numeric(x, errors='coerce').astype(convtype)
+
+@pytest.fixture(params=['arrow', 'python'])
+def engine(request, monkeypatch):
+    if request.param == 'python':
+        monkeypatch.setattr(operations, 'pa', None)
+    elif operations.pa is None:
+        pytest.skip('pyarrow not installed')
+    return request.param
+
+@pytest.mark.parametrize('currency', [False, True])
+@pytest.mark.parametrize('removetext', [False, True])
+@pytest.mark.parametrize('fillempty', [False, True])
+def test_convert_numeric(engine, currency, removetext, fillempty):
+    x = make_column()
+    new, coerced = operations.convert_numeric(x, 'float', currency, removetext, fillempty)
+    expected = old_numeric(x, 'float', currency, removetext, fillempty)
+    pd.testing.assert_series_equal(new, expected)
+    assert coerced == int((new.isnull() & x.notnull()).sum())
+
+def test_convert_numeric_types():
+    x = pd.Series([1, 2, 3])
+    new, coerced = operations.convert_numeric(x, 'float')
+    assert new.dtype == float and coerced == 0
+    mixed = pd.Series([1, '2', '$3', None, 'a'], dtype=object)
+    new, coerced = operations.convert_numeric(mixed, 'float', currency=True)
+    pd.testing.assert_series_equal(new, old_numeric(mixed, 'float', currency=True))
+    assert coerced == 1
+    new, _ = operations.convert_numeric(pd.Series(['1', '2']), 'int')
+    assert list(new) == [1, 2] and new.dtype == int
+
+def test_numeric_columns():
+    df = pd.DataFrame({'a': make_column(seed=2), 'b': make_column(seed=3),
+                       'c': pd.Series(['1', None, 'x'] * 10)})
+    new, report = operations.numeric_columns(df, ['a', 'b', 'c'], 'int', threads=2)
+    #NaN can't be converted to int
+    assert len(new) == 0
+    assert list(report.column) == ['a', 'b', 'c'] and (report.error != '').all()
+    new, report = operations.numeric_columns(df, ['a', 'b', 'c'], currency=True, threads=2)
+    for c in new:
+        pd.testing.assert_series_equal(new[c], old_numeric(df[c], currency=True))
+    assert report.set_index('column').loc['c', 'coerced to NaN'] == 10
+
+def make_dates(fmt, n=300, nulls=True, unpadded=False, seed=1):
+    r = np.random.RandomState(seed)
+    d = pd.Series(pd.Timestamp('1990-01-01') + pd.to_timedelta(r.randint(0, 20000, n), 'D')
+                  + pd.to_timedelta(r.randint(0, 86400, n), 's'))
+    s = d.dt.strftime(fmt)
+    if unpadded:
+        s = s.str.replace(r'\b0(\d)', r'\1', regex=True)
+    if nulls:
+        s[::13] = None
+    return s.astype(object)
+
+@pytest.mark.parametrize('fmt', ['%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y %H:%M', '%d-%b-%Y',
+                                 '%Y-%m-%dT%H:%M:%S', '%d.%m.%Y'])
+@pytest.mark.parametrize('nulls', [False, True])
+@pytest.mark.parametrize('unpadded', [False, True])
+def test_convert_dates(fmt, nulls, unpadded):
+    s = make_dates(fmt, nulls=nulls, unpadded=unpadded)
+    expected = pd.to_datetime(s, format=fmt, errors='coerce')
+    pd.testing.assert_series_equal(operations.convert_dates(s, fmt), expected)
+    pd.testing.assert_series_equal(operations._strptime(s, fmt), expected)
+
+def test_strptime_no_nulls():
+    #unpadded and mixed padding, no missing values
+    s = pd.Series(['1/2/2020', '01/02/2020', '12/3/2020', '5/11/2021'])
+    expected = pd.to_datetime(s, format='%d/%m/%Y')
+    pd.testing.assert_series_equal(operations._strptime(s, '%d/%m/%Y'), expected)
+    pd.testing.assert_series_equal(operations.convert_dates(s, '%d/%m/%Y', 'raise'), expected)
+
+def test_strptime_invalid():
+    s = pd.Series(['31/02/2020', '01/02/2020', '1/3/2020'])
+    expected = pd.to_datetime(s, format='%d/%m/%Y', errors='coerce')
+    assert expected.isnull().sum() == 1
+    pd.testing.assert_series_equal(operations.convert_dates(s, '%d/%m/%Y'), expected)
+    with pytest.raises(ValueError):
+        operations.convert_dates(s, '%d/%m/%Y', 'raise')
+    pd.testing.assert_series_equal(operations.convert_dates(s, '%d/%m/%Y', 'ignore'), s)
+
+def test_detect_format():
+    assert operations.detect_format(make_dates('%Y-%m-%d')) == '%Y-%m-%d'
+    assert operations.detect_format(make_dates('%d/%m/%Y', unpadded=True)) == '%d/%m/%Y'
+    assert operations.detect_format(make_dates('%m/%d/%Y %H:%M')) == '%m/%d/%Y %H:%M'
+    assert operations.detect_format(pd.Series(['a', 'b', 'c'])) is None
+
+def test_detect_format_no_guess(monkeypatch):
+    #pandas without guess_datetime_format only tries the listed formats
+    monkeypatch.setattr(operations, 'guess_datetime_format', None)
+    assert operations.detect_format(make_dates('%d/%m/%Y', unpadded=True)) == '%d/%m/%Y'
+    assert operations.detect_format(make_dates('%m/%d/%Y %H:%M')) == '%m/%d/%Y %H:%M'
+
+def test_parse_dates():
+    df = pd.DataFrame({'a': make_dates('%d/%m/%Y', nulls=False, unpadded=True),
+                       'b': make_dates('%Y-%m-%d', seed=2),
+                       'c': ['x', 'y', 'z'] * 100, 'd': np.arange(300)})
+    expected = {'a': pd.to_datetime(df.a, format='%d/%m/%Y'),
+                'b': pd.to_datetime(df.b, format='%Y-%m-%d')}
+    df = operations.parse_dates(df)
+    for c in expected:
+        pd.testing.assert_series_equal(df[c], expected[c])
+    assert not pd.api.types.is_datetime64_any_dtype(df.c)
+    assert df.d.dtype == int
+
+@pytest.mark.parametrize('nulls', [False, True])
+def test_date_properties(nulls):
+    s = pd.to_datetime(make_dates('%Y-%m-%d %H:%M:%S', nulls=nulls))
+    props = [p for p in operations.dateprops if p != 'weekofyear']
+    result = operations.date_properties(s, operations.dateprops)
+    for p in props:
+        expected = getattr(s.dt, p)
+        pd.testing.assert_series_equal(result[p], expected, check_dtype=False, check_names=False)
+    week = s.dt.isocalendar().week
+    pd.testing.assert_series_equal(result['weekofyear'], week, check_dtype=False, check_names=False)
+
+def test_date_properties_range():
+    #dates outside the nanosecond range keep their own unit
+    values = np.array(['1500-03-01T10:20:30', '2500-12-31T23:59:59', 'NaT'], dtype='M8[s]')
+    s = pd.Series(values)
+    props = [p for p in operations.dateprops if p != 'weekofyear']
+    result = operations.date_properties(s, props)
+    assert list(result['year'].iloc[:2]) == [1500, 2500]
+    for p in props:
+        pd.testing.assert_series_equal(result[p], getattr(s.dt, p), check_dtype=False, check_names=False)
+    s = pd.Series(np.array(['2020-01-01T00:00:01.250001'], dtype='M8[us]'))
+    result = operations.date_properties(s, ['second', 'microsecond'])
+    assert (result['second'][0], result['microsecond'][0]) == (1, 250001)
+
+words = ['  alpha ', 'Beta,gamma', 'DELTA', 'epsilon,zeta,eta', 'ÜBER straße', '', 'x,,y',
+         'Title Case', 'a1b2', None]
+
+def values(x):
+    """Values of a column with missing values as None, for comparing
+    columns with different dtypes"""
+
+    x = x.astype(object)
+    return list(x.where(x.notnull(), None))
+
+@pytest.mark.parametrize('func', ['strip', 'lstrip', 'lower', 'upper', 'title', 'swapcase',
+                                  'len', 'slice', 'replace'])
+def test_string_method(func):
+    s = pd.Series(words * 20, dtype=object, name='x')
+    args = {'start': 1, 'end': 4, 'pat': ' ', 'repl': '_'}
+    result = operations.string_method(s, func, **args)
+    if operations.pa is not None:
+        assert isinstance(result.dtype, pd.StringDtype) or func == 'len'
+    old = {'strip': s.str.strip(), 'lstrip': s.str.lstrip(' '), 'lower': s.str.lower(),
+           'upper': s.str.upper(), 'title': s.str.title(), 'swapcase': s.str.swapcase(),
+           'len': s.str.len(), 'slice': s.str.slice(1, 4),
+           'replace': s.replace(' ', '_', regex=True)}
+    expected = old[func]
+    if func == 'len':
+        assert np.allclose(result.astype(float), expected.astype(float), equal_nan=True)
+    else:
+        assert values(result) == values(expected)
+
+def test_string_replace_regex():
+    s = pd.Series(words * 5, dtype=object)
+    for pat, repl in [(r'(\w+),(\w+)', r'\2-\1'), (r'a(?=l)', 'A'), (r'^\s+|\s+$', '')]:
+        result = operations.string_method(s, 'replace', pat=pat, repl=repl)
+        assert values(result) == values(s.replace(pat, repl, regex=True)), pat
+
+def test_string_split():
+    s = pd.Series(words * 5, dtype=object)
+    result = operations.string_method(s, 'split', sep=',')
+    expected = s.str.split(',', expand=True)
+    assert list(result.columns) == list(expected.columns)
+    for c in result.columns:
+        assert values(result[c]) == values(expected[c])
+    assert list(operations.string_method(s.iloc[:0], 'split').columns) == []
+
+def test_string_concat():
+    s = pd.Series(words * 5, dtype=object)
+    other = pd.Series(np.arange(len(s)))
+    result = operations.string_method(s, 'concat', sep='-', other=other)
+    assert values(result) == values(s.str.cat(other.astype(str), sep='-'))
+
+def test_string_method_other_types():
+    #columns that are not text use the python methods
+    s = pd.Series([1, 'a', None], dtype=object)
+    result = operations.string_method(s, 'upper')
+    assert values(result) == values(s.str.upper())
+    assert operations.string_method(s, '') is None
+
+def make_rows(n=1000, seed=3):
+    r = np.random.RandomState(seed)
+    df = pd.DataFrame({'a': r.randint(0, 5, n), 'b': r.choice(['x', 'y', None], n),
+                       'c': r.randint(0, 3, n).astype(float),
+                       'd': pd.Timestamp('2020-01-01') + pd.to_timedelta(r.randint(0, 3, n), 'D'),
+                       'e': r.rand(n) > 0.5})
+    df.loc[df.index[::17], 'c'] = np.nan
+    return df
+
+@pytest.mark.parametrize('keep', ['first', 'last', False])
+@pytest.mark.parametrize('cols', [['a'], ['a', 'b'], ['b', 'c', 'd'], ['a', 'b', 'c', 'd', 'e']])
+def test_rowhashes_duplicated(keep, cols):
+    df = make_rows()
+    hashes = operations.RowHashes()
+    versions = {c: 0 for c in cols}
+    mask = hashes.duplicated(df, cols, versions, keep)
+    assert np.array_equal(mask, df.duplicated(subset=cols, keep=keep).values)
+    #cached for the same versions
+    assert hashes.duplicated(df, cols, versions, keep) is mask
+
+def test_rowhashes_collision():
+    class Collide(operations.RowHashes):
+        def get(self, df, cols, versions):
+            return np.zeros(len(df), dtype=np.uint64)
+
+    df = make_rows()
+    mask = Collide().duplicated(df, ['a', 'b'], {})
+    assert np.array_equal(mask, df.duplicated(subset=['a', 'b']).values)
+
+def test_rowhashes_types():
+    #equal values hash the same whatever the column type
+    h = operations.hash_column
+    ints = pd.Series([1, 2, 3])
+    assert np.array_equal(h(ints), h(ints.astype(float)))
+    assert np.array_equal(h(ints), h(ints.astype('Int64')))
+    assert np.array_equal(h(pd.Series([True, False])), h(pd.Series([1.0, 0.0])))
+    dates = pd.Series(pd.to_datetime(['2020-01-01', '2021-06-01', None]))
+    assert np.array_equal(h(dates.astype('datetime64[s]')), h(dates.astype('datetime64[ns]')))
+    #outside the ns range and before 1970
+    dates = pd.Series(np.array(['2500-01-01', '2500-01-01T00:00:00.001', '1960-05-01T10:00:00.5',
+                                'NaT'], dtype='M8[ms]'))
+    assert np.array_equal(h(dates), h(dates.astype('datetime64[us]')))
+    assert len(set(h(dates))) == 4
+    text = pd.Series(['a', None], dtype=object)
+    assert np.array_equal(h(text), h(text.astype(pd.StringDtype('pyarrow'))))
+
+def test_rowhashes_isin():
+    df1 = pd.DataFrame({'a': [1, 2, 3], 'b': ['x', 'y', 'z']})
+    df2 = pd.DataFrame({'a': [1.0, 2.5, 3.0], 'b': ['x', 'y', 'w']})
+    h1, h2 = operations.RowHashes(), operations.RowHashes()
+    cols = ['a', 'b']
+    assert list(h1.isin(df1, cols, {}, h2.get(df2, cols, {}))) == [True, False, False]
+    assert list(h2.isin(df2, cols, {}, h1.get(df1, cols, {}))) == [True, False, False]
+
+def old_clean(df, replace='', symbol='', method='', limit=1, dropcols=0, droprows=0,
+              how='any', dropduplicaterows=0, dropduplicatecols=0, rounddecimals=0):
+    """Clean data as done before, one pandas call per option"""
+
+    if symbol == 'null':
+        symbol = np.nan
+    try:
+        replace = float(replace)
+    except:
+        pass
+    how = how or 'any'
+    if not isinstance(symbol, str) or symbol != '':
+        if replace != '':
+            df = df.replace(to_replace=replace, value=symbol)
+        else:
+            df = df.fillna(symbol)
+    if dropcols == 1:
+        df = df.dropna(axis=1, how=how)
+    if droprows == 1:
+        df = df.dropna(axis=0, how=how)
+    if method == 'fill scalar':
+        df = df.fillna(symbol)
+    elif method == 'interpolate':
+        df = df.interpolate()
+    elif method in ['ffill', 'bfill']:
+        df = getattr(df, method)(limit=1 if limit else None)
+    if dropduplicaterows == 1:
+        df = df.drop_duplicates()
+    if dropduplicatecols == 1:
+        df = df.loc[:, ~df.columns.duplicated()]
+    if rounddecimals != 0:
+        df = df.round(rounddecimals)
+    return df
+
+def make_unclean(seed):
+    r = np.random.RandomState(seed)
+    n = 40
+    df = pd.DataFrame({'a': r.choice([1.0, 2.5, 0, np.nan], n), 'b': r.choice([1, 2, 3], n),
+                       'c': r.choice(np.array(['x', '-', None], dtype=object), n),
+                       'd': r.choice([np.nan, 0.123, 4.567], n), 'e': np.nan})
+    df = pd.concat([df, df[['b']]], axis=1)
+    return pd.concat([df, df.iloc[:5]], ignore_index=True)
+
+def test_clean_plan():
+    r = np.random.RandomState(0)
+    options = {'replace': ['', '0', '-', 'x'], 'symbol': ['', 0, 'null', '-'],
+               'method': ['', 'fill scalar', 'ffill', 'bfill', 'interpolate'],
+               'limit': [0, 1], 'dropcols': [0, 1], 'droprows': [0, 1], 'how': ['', 'any', 'all'],
+               'dropduplicaterows': [0, 1], 'dropduplicatecols': [0, 1], 'rounddecimals': [0, 1]}
+    for i in range(300):
+        kwargs = {k: v[r.randint(len(v))] for k, v in options.items()}
+        df = make_unclean(i)
+        try:
+            expected = old_clean(df, **kwargs)
+        except Exception as e:
+            with pytest.raises(type(e)):
+                operations.clean_data(df, **kwargs)
+            continue
+        progress = []
+        result = operations.run_plan(df, operations.clean_plan(**kwargs), progress.append)
+        pd.testing.assert_frame_equal(result, expected, obj=str(kwargs))
+        if len(progress) > 0:
+            assert progress[-1] == 100
+
+def test_clean_plan_stages():
+    assert operations.clean_plan() == []
+    assert operations.describe_plan([]) == 'nothing to do'
+    plan = operations.clean_plan(symbol=0, method='fill scalar', dropcols=1, droprows=1)
+    #filling once is enough and the drops are one stage
+    assert [op for op, args in plan] == ['fillna', 'dropna']
+    plan = operations.clean_plan(symbol='null', method='fill scalar')
+    assert plan == []
+
+def facet_labels(s, picked):
+    """Labels of picked values as recorded by the filter dialog"""
+
+    counts = filters.FacetCounts(s)
+    codes = [counts.code(i) for i in range(len(counts)) if counts.labels.iat[i] in picked]
+    return [counts.labels.iat[c if c >= 0 else len(counts) - 1] for c in codes]
+
+@pytest.mark.parametrize('col,picked,expected', [
+    ('d', ['2020-01-02 00:00:00'], [1, 3]),
+    ('t', ['2020-01-01 12:30:00', '(empty)'], [0, 2]),
+    ('x', ['1.5', '(empty)'], [0, 3]),
+    ('s', ['b'], [1])])
+def test_filter_step_facet(col, picked, expected):
+    df = pd.DataFrame({'d': pd.to_datetime(['2020-01-01', '2020-01-02', '2020-01-03', '2020-01-02']),
+                       't': pd.to_datetime(['2020-01-01 12:30', '2020-01-01 00:00', None,
+                                            '2020-01-02 00:00']),
+                       'x': [1.5, 2.0, 2.5, np.nan], 's': ['a', 'b', None, 'c']})
+    labels = facet_labels(df[col], picked)
+    assert sorted(labels) == sorted(picked)
+    step = operations.make_step('filter', facet=[col, labels])
+    #replayed after a json round trip as for exported pipelines
+    p = operations.Pipeline.fromJSON(operations.Pipeline([step]).toJSON())
+    result = p.run(df)
+    assert list(result.index) == expected
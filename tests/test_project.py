@@ -0,0 +1,149 @@
+"""
+    Tests for version 2 project files.
+"""
+
+import os, json, zipfile, threading
+import numpy as np
+import pandas as pd
+import pytest
+from tablexplore import fileio, project
+
+def make_data():
+    df1 = pd.DataFrame({'a': np.arange(10), 'b': list('abcdefghij'),
+                        'c': pd.date_range('2020-01-01', periods=10)})
+    df2 = pd.DataFrame({'x': np.random.RandomState(1).normal(size=20)})
+    meta = {'table': {'column_widths': [np.int64(80), 100]},
+            'column_order': ['a', 'b', pd.Timestamp('2020-01-01')],
+            'subtable': df2.head()}
+    return {'sheet1': {'table': df1, 'meta': meta},
+            'sheet2': {'table': df2, 'meta': None}}
+
+def test_save_and_read(tmp_path):
+    filename = str(tmp_path / 'test.txpl')
+    data = make_data()
+    pf = project.save_project(filename, data, codec='gzip')
+    assert pf.revision == 0
+    assert list(pf.sheets) == ['sheet1', 'sheet2']
+    for name in data:
+        pd.testing.assert_frame_equal(pf.read_sheet(name), data[name]['table'])
+    meta = pf.read_meta('sheet1')
+    assert meta['table']['column_widths'] == [80, 100]
+    assert meta['column_order'] == ['a', 'b', pd.Timestamp('2020-01-01')]
+    pd.testing.assert_frame_equal(meta['subtable'], data['sheet2']['table'].head())
+    assert pf.read_meta('sheet2') is None
+
+def test_manifest_rejects_unknown_types(tmp_path):
+    filename = str(tmp_path / 'test.txpl')
+    data = {'sheet1': {'table': pd.DataFrame({'a': [1]}), 'meta': {'x': object()}}}
+    with pytest.raises(TypeError):
+        project.save_project(filename, data)
+
+def test_append(tmp_path):
+    filename = str(tmp_path / 'test.txpl')
+    data = make_data()
+    pf = project.save_project(filename, data)
+    size = os.path.getsize(filename)
+    changed = data['sheet2']['table'] * 2
+    new = {'sheet1': {'stored': pf.stored('sheet1'), 'meta': {'table': {}}},
+           'sheet2': {'table': changed, 'meta': None}}
+    pf2 = project.save_project(filename, new)
+    assert pf2.revision == 1
+    assert os.path.getsize(filename) > size
+    with zipfile.ZipFile(filename) as zf:
+        names = zf.namelist()
+    assert 'manifest-0.json' in names and 'manifest-1.json' in names
+    assert pf2.sheets['sheet1']['data'] == pf.sheets['sheet1']['data']
+    pd.testing.assert_frame_equal(pf2.read_sheet('sheet1'), data['sheet1']['table'])
+    pd.testing.assert_frame_equal(pf2.read_sheet('sheet2'), changed)
+    assert pf2.read_meta('sheet1')['table'] == {}
+
+def interrupt_append(filename):
+    """Leave the state of an append that stopped after overwriting the
+    central directory"""
+
+    with zipfile.ZipFile(filename, 'r') as zf:
+        offset = zf.start_dir
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        tail = f.read()
+    with open(project._undo_name(filename), 'wb') as f:
+        f.write(offset.to_bytes(8, 'little'))
+        f.write(tail)
+    with open(filename, 'r+b') as f:
+        f.truncate(offset)
+        f.seek(offset)
+        f.write(b'partial member')
+    return
+
+def test_recover(tmp_path):
+    filename = str(tmp_path / 'test.txpl')
+    data = make_data()
+    project.save_project(filename, data)
+    with open(filename, 'rb') as f:
+        saved = f.read()
+    interrupt_append(filename)
+    assert project.needs_recovery(filename)
+    #opening does not roll back
+    with pytest.raises(zipfile.BadZipFile):
+        project.ProjectFile(filename)
+    assert project.needs_recovery(filename)
+    assert project.recover(filename) == True
+    assert not project.needs_recovery(filename)
+    with open(filename, 'rb') as f:
+        assert f.read() == saved
+    pf = project.open_project(filename)
+    pd.testing.assert_frame_equal(pf.read_sheet('sheet1'), data['sheet1']['table'])
+    assert project.recover(filename) == False
+
+def test_save_recovers(tmp_path):
+    filename = str(tmp_path / 'test.txpl')
+    data = make_data()
+    pf = project.save_project(filename, data)
+    interrupt_append(filename)
+    new = {'sheet1': {'stored': pf.stored('sheet1')},
+           'sheet2': {'table': data['sheet2']['table'], 'meta': None}}
+    pf2 = project.save_project(filename, new)
+    assert not project.needs_recovery(filename)
+    assert pf2.revision == 1
+    pd.testing.assert_frame_equal(pf2.read_sheet('sheet1'), data['sheet1']['table'])
+
+def test_manifest_is_json(tmp_path):
+    filename = str(tmp_path / 'test.txpl')
+    project.save_project(filename, make_data(), info={'sheets': [['sheet1', 0]]})
+    with zipfile.ZipFile(filename) as zf:
+        manifest = json.loads(zf.read('manifest-0.json'))
+    assert manifest['format'] == 'txpl'
+    assert manifest['info'] == {'sheets': [['sheet1', 0]]}
+
+def test_compression_level(tmp_path):
+    filename = str(tmp_path / 'test.txpl')
+    data = make_data()
+    with pytest.raises(ValueError):
+        project.save_project(filename, data, codec='gzip', level=15)
+    pf = project.save_project(filename, data, codec='zstd', level=15)
+    assert pf.manifest['level'] == 15
+    pf = project.save_project(filename, data, codec='none', level=15)
+    assert pf.manifest['level'] is None
+    assert fileio.compression_level('gzip', 15, clamp=True) == 9
+    assert fileio.compression_level('lz4', 0, clamp=True) == 1
+
+def test_cancel(tmp_path):
+    filename = str(tmp_path / 'test.txpl')
+    data = make_data()
+    pf = project.save_project(filename, data)
+    with open(filename, 'rb') as f:
+        saved = f.read()
+    new = {'sheet1': {'stored': pf.stored('sheet1')},
+           'sheet2': {'table': data['sheet2']['table'] * 2, 'meta': None}}
+    cancel = threading.Event()
+    with pytest.raises(project.Cancelled):
+        #cancelled once the save has started
+        project.save_project(filename, new, callback=lambda p: cancel.set(), cancel=cancel)
+    assert not project.needs_recovery(filename)
+    with open(filename, 'rb') as f:
+        assert f.read() == saved
+    other = str(tmp_path / 'other.txpl')
+    with pytest.raises(project.Cancelled):
+        project.save_project(other, data, cancel=cancel)
+    assert not os.path.exists(other)
+    assert os.listdir(str(tmp_path)) == ['test.txpl']